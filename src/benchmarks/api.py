@@ -0,0 +1,166 @@
+"""
+End to end benchmark of the HTTP API.
+
+Runs the real server (gunicorn with the Flask app, or the asyncio one with
+`--server asyncio`) against a stand-in docker daemon on a unix socket
+(`benchmarks.fakedocker`) and a storage driver that does not copy anything
+(`benchmarks.fakestorage`), drives a mix of create, inspect, list and delete
+requests (`benchmarks.load`) and reports throughput and latency percentiles
+of every endpoint. It does not need docker, nor root.
+
+Run it from the `src` directory:
+
+    python -m benchmarks.api --concurrency 50 --requests 2000 \\
+        --mix create=2,inspect=6,list=1,delete=1 --json results.json
+
+Everything lives in a temporary directory removed at the end, use `--keep`
+to look at the server logs.
+"""
+import asyncio
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import urllib.request
+import uuid
+from time import sleep, monotonic
+
+import click
+
+from .load import LoadGenerator, parse_mix, format_report
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_until(check, timeout, what):
+    deadline = monotonic() + timeout
+    while monotonic() < deadline:
+        try:
+            if check():
+                return
+        except OSError:
+            pass
+        sleep(0.1)
+    raise click.ClickException(f"{what} did not start in {timeout}s")
+
+
+def is_serving(url):
+    with urllib.request.urlopen(url, timeout=1) as response:
+        return response.status == 200
+
+
+def start_process(command, env, log_path):
+    log = open(log_path, 'wb')
+    return subprocess.Popen(command, cwd=SRC_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def stop_process(process):
+    process.terminate()
+    try:
+        process.wait(10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def make_environment(base_dir, docker_socket, self_id):
+    env = dict(os.environ)
+    env.update({
+        'HOSTNAME': self_id,
+        'MYAAS_BASE_DIR': base_dir,
+        'MYAAS_DOCKER_HOST': f'unix://{docker_socket}',
+        'MYAAS_STORAGE_DRIVER': 'benchmarks.fakestorage',
+        'PYTHONPATH': SRC_DIR,
+        'PROMETHEUS_MULTIPROC_DIR': os.path.join(base_dir, 'prometheus'),
+        # nothing runs, do not let admission control get in the way
+        'MYAAS_MEMORY_LIMIT': '1m',
+        'MYAAS_MEMORY_OVERCOMMIT': '1000',
+        'MYAAS_CONTAINER_TTL': '0',
+        'MYAAS_POOL_SIZE': '0',
+    })
+    return env
+
+
+@click.command()
+@click.option('-s', '--server', type=click.Choice(['flask', 'asyncio']), default='flask',
+              help='Server to benchmark.')
+@click.option('-w', '--workers', default=4, help='gunicorn workers of the flask server.')
+@click.option('-t', '--template', default='bench', help='Name of the template.')
+@click.option('-c', '--concurrency', default=20, help='Concurrent clients.')
+@click.option('-n', '--requests', default=1000, help='Requests to make.')
+@click.option('-d', '--databases', default=20, help='Databases created before measuring.')
+@click.option('-m', '--mix', default='create=2,inspect=6,list=1,delete=1',
+              help='Weights of the operations to run.')
+@click.option('--docker-latency', default=0.0, help='Seconds every docker API call takes.')
+@click.option('--snapshot-delay', default=0.0, help='Seconds every snapshot takes.')
+@click.option('--json', 'json_path', default=None, help='Write the results to this file.')
+@click.option('--keep', is_flag=True, help='Do not remove the temporary directory.')
+def main(server, workers, template, concurrency, requests, databases, mix,
+         docker_latency, snapshot_delay, json_path, keep):
+    mix = parse_mix(mix)
+    base_dir = tempfile.mkdtemp(prefix='myaas-bench-')
+    for name in ('data', 'dumps', 'state', 'metrics'):
+        os.makedirs(os.path.join(base_dir, name))
+    # the template volume, the fake daemon creates its container
+    os.makedirs(os.path.join(base_dir, 'data', f'myaas-{template}'))
+
+    docker_socket = os.path.join(base_dir, 'docker.sock')
+    self_id = uuid.uuid4().hex
+    env = make_environment(base_dir, docker_socket, self_id)
+    env['FAKE_STORAGE_DELAY'] = str(snapshot_delay)
+
+    processes = []
+    try:
+        processes.append(start_process(
+            [sys.executable, '-m', 'benchmarks.fakedocker', '--socket', docker_socket,
+             '--template', template, '--self-id', self_id, '--base-dir', base_dir,
+             '--latency', str(docker_latency)],
+            env, os.path.join(base_dir, 'fakedocker.log')))
+        wait_until(lambda: os.path.exists(docker_socket), 10, "fake docker daemon")
+
+        port = free_port()
+        if server == 'flask':
+            command = ['gunicorn', '-c', 'gunicorn.conf.py', '-b', f'127.0.0.1:{port}',
+                       '-w', str(workers), 'runserver:app']
+        else:
+            command = [sys.executable, '-m', 'myaas.aioserver',
+                       '--host', '127.0.0.1', '--port', str(port)]
+        processes.append(start_process(command, env, os.path.join(base_dir, 'server.log')))
+        url = f'http://127.0.0.1:{port}'
+        wait_until(lambda: is_serving(url + '/'), 30, "myaas server")
+
+        click.echo(f"{server} server, {requests} requests, {concurrency} clients, mix {mix}")
+        generator = LoadGenerator(url, template, concurrency, mix)
+        elapsed = asyncio.run(generator.run(requests, databases))
+        stats = generator.report(elapsed)
+        click.echo(format_report(stats))
+        click.echo(f"{elapsed:.1f}s")
+
+        if json_path:
+            with open(json_path, 'w') as f:
+                json.dump({
+                    'server': server, 'workers': workers, 'concurrency': concurrency,
+                    'requests': requests, 'databases': databases, 'mix': mix,
+                    'docker_latency': docker_latency, 'snapshot_delay': snapshot_delay,
+                    'elapsed': elapsed, 'stats': stats,
+                }, f, indent=2)
+    finally:
+        for process in reversed(processes):
+            stop_process(process)
+        if keep:
+            click.echo(f"logs and state kept in {base_dir}")
+        else:
+            shutil.rmtree(base_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,323 @@
+"""
+Stand-in for the docker daemon, serving on a unix socket the part of the
+Engine API myaas uses: listing, inspecting, creating, starting, stopping,
+renaming and removing containers, and the events stream.
+
+Containers are only records in memory, nothing is run. Every call can be
+delayed with `--latency` to resemble a loaded daemon.
+
+    python -m benchmarks.fakedocker --socket /tmp/docker.sock --template mytemplate
+
+Every `--template` is created as a stopped myaas template container. A
+container with id `--self-id` bind mounting `--base-dir` on itself stands
+for the myaas container, so the host paths of the volumes are the same.
+"""
+import asyncio
+import json
+import os
+import uuid
+from datetime import datetime, timezone
+
+import click
+from aiohttp import web
+
+API_VERSION = '1.22'
+
+
+def now():
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def matches_label(labels, wanted):
+    key, _, value = wanted.partition('=')
+    if key not in labels:
+        return False
+    return not value or labels[key] == value
+
+
+class FakeDocker(object):
+    def __init__(self, latency=0):
+        self.latency = latency
+        self.containers = {}  # id -> container record
+        self.subscribers = []
+
+    def find(self, ref):
+        if ref in self.containers:
+            return self.containers[ref]
+        for container in self.containers.values():
+            if container['Name'] == '/' + ref.lstrip('/') or container['Id'].startswith(ref):
+                return container
+        raise web.HTTPNotFound(text=json.dumps({'message': f'No such container: {ref}'}),
+                               content_type='application/json')
+
+    def create(self, name, config):
+        if any(c['Name'] == f'/{name}' for c in self.containers.values()):
+            raise web.HTTPConflict(text=json.dumps({'message': f'Conflict, {name} is in use'}),
+                                   content_type='application/json')
+        container_id = uuid.uuid4().hex + uuid.uuid4().hex
+        host_config = config.get('HostConfig') or {}
+        self.containers[container_id] = {
+            'Id': container_id,
+            'Name': f'/{name}',
+            'Created': now(),
+            'Image': config.get('Image', ''),
+            'Config': dict(config, Labels=config.get('Labels') or {}),
+            'HostConfig': host_config,
+            'State': {'Status': 'created', 'Running': False, 'ExitCode': 0,
+                      'StartedAt': '0001-01-01T00:00:00Z',
+                      'FinishedAt': '0001-01-01T00:00:00Z'},
+            'NetworkSettings': {'IPAddress': '', 'Ports': {}},
+            'Mounts': [{'Source': source, 'Destination': destination.split(':')[0], 'RW': True}
+                       for source, destination in (b.split(':', 1) for b in host_config.get('Binds') or [])],
+        }
+        self.emit('create', self.containers[container_id])
+        return self.containers[container_id]
+
+    def set_state(self, container, status):
+        state = container['State']
+        state['Status'] = status
+        state['Running'] = status == 'running'
+        if status == 'running':
+            state['StartedAt'] = now()
+            bindings = container['HostConfig'].get('PortBindings') or {}
+            container['NetworkSettings'] = {'IPAddress': '127.0.0.1', 'Ports': bindings}
+        else:
+            state['FinishedAt'] = now()
+            container['NetworkSettings'] = {'IPAddress': '', 'Ports': {}}
+
+    def summary(self, container):
+        """
+        The container as listed by GET /containers/json
+        """
+        state = container['State']['Status']
+        return {
+            'Id': container['Id'],
+            'Names': [container['Name']],
+            'Image': container['Image'],
+            'Command': '',
+            'Created': int(datetime.strptime(container['Created'][:19], '%Y-%m-%dT%H:%M:%S')
+                           .replace(tzinfo=timezone.utc).timestamp()),
+            'Labels': container['Config']['Labels'],
+            'State': state,
+            'Status': 'Up 1 second' if state == 'running' else 'Exited (0) 1 second ago',
+            'Ports': [],
+            'Mounts': container['Mounts'],
+        }
+
+    def list(self, show_all=False, filters=None):
+        filters = filters or {}
+        for container in self.containers.values():
+            if not show_all and not container['State']['Running']:
+                continue
+            labels = container['Config']['Labels']
+            if not all(matches_label(labels, label) for label in filters.get('label', [])):
+                continue
+            if filters.get('id') and not any(container['Id'].startswith(i) for i in filters['id']):
+                continue
+            if filters.get('name') and not any(n in container['Name'] for n in filters['name']):
+                continue
+            if filters.get('status') and container['State']['Status'] not in filters['status']:
+                continue
+            yield self.summary(container)
+
+    def emit(self, action, container, **attributes):
+        event = {
+            'status': action, 'id': container['Id'], 'from': container['Image'],
+            'Type': 'container', 'Action': action,
+            'Actor': {'ID': container['Id'],
+                      'Attributes': dict(container['Config']['Labels'],
+                                         name=container['Name'].lstrip('/'), **attributes)},
+            'time': int(datetime.now().timestamp()),
+        }
+        for queue in self.subscribers:
+            queue.put_nowait(event)
+
+
+routes = web.RouteTableDef()
+
+
+def get_filters(request):
+    filters = json.loads(request.query.get('filters') or '{}')
+    # docker accepts {"label": ["a"]} and {"label": {"a": true}}
+    return {k: list(v) for k, v in filters.items()}
+
+
+@routes.get('/_ping')
+async def ping(request):
+    return web.Response(text='OK')
+
+
+@routes.get('/version')
+async def version(request):
+    return web.json_response({'ApiVersion': API_VERSION, 'Version': 'fake'})
+
+
+@routes.get('/containers/json')
+async def list_containers(request):
+    docker = request.app['docker']
+    show_all = request.query.get('all') in ('1', 'True', 'true')
+    return web.json_response(list(docker.list(show_all, get_filters(request))))
+
+
+@routes.post('/containers/create')
+async def create_container(request):
+    docker = request.app['docker']
+    container = docker.create(request.query['name'], await request.json())
+    return web.json_response({'Id': container['Id'], 'Warnings': None}, status=201)
+
+
+@routes.get('/containers/{id}/json')
+async def inspect_container(request):
+    return web.json_response(request.app['docker'].find(request.match_info['id']))
+
+
+@routes.post('/containers/{id}/start')
+async def start_container(request):
+    docker = request.app['docker']
+    container = docker.find(request.match_info['id'])
+    if container['State']['Running']:
+        return web.Response(status=304)
+    docker.set_state(container, 'running')
+    docker.emit('start', container)
+    return web.Response(status=204)
+
+
+@routes.post('/containers/{id}/stop')
+async def stop_container(request):
+    docker = request.app['docker']
+    container = docker.find(request.match_info['id'])
+    if not container['State']['Running']:
+        return web.Response(status=304)
+    docker.set_state(container, 'exited')
+    docker.emit('die', container, exitCode='0')
+    docker.emit('stop', container)
+    return web.Response(status=204)
+
+
+@routes.post('/containers/{id}/kill')
+async def kill_container(request):
+    docker = request.app['docker']
+    container = docker.find(request.match_info['id'])
+    docker.set_state(container, 'exited')
+    docker.emit('kill', container)
+    docker.emit('die', container, exitCode='137')
+    return web.Response(status=204)
+
+
+@routes.post('/containers/{id}/wait')
+async def wait_container(request):
+    request.app['docker'].find(request.match_info['id'])
+    return web.json_response({'StatusCode': 0})
+
+
+@routes.post('/containers/{id}/update')
+async def update_container(request):
+    container = request.app['docker'].find(request.match_info['id'])
+    container['HostConfig'].update(await request.json())
+    return web.json_response({'Warnings': None})
+
+
+@routes.post('/containers/{id}/rename')
+async def rename_container(request):
+    docker = request.app['docker']
+    container = docker.find(request.match_info['id'])
+    old_name = container['Name']
+    container['Name'] = '/' + request.query['name']
+    docker.emit('rename', container, oldName=old_name)
+    return web.Response(status=204)
+
+
+@routes.delete('/containers/{id}')
+async def remove_container(request):
+    docker = request.app['docker']
+    container = docker.find(request.match_info['id'])
+    if container['State']['Running'] and request.query.get('force') not in ('1', 'True', 'true'):
+        return web.json_response({'message': 'container is running'}, status=409)
+    del docker.containers[container['Id']]
+    docker.emit('destroy', container)
+    return web.Response(status=204)
+
+
+@routes.get('/events')
+async def events(request):
+    docker = request.app['docker']
+    filters = get_filters(request)
+    response = web.StreamResponse(headers={'Content-Type': 'application/json'})
+    response.enable_chunked_encoding()
+    await response.prepare(request)
+
+    queue = asyncio.Queue()
+    docker.subscribers.append(queue)
+    try:
+        while True:
+            event = await queue.get()
+            labels = event['Actor']['Attributes']
+            if not all(matches_label(labels, label) for label in filters.get('label', [])):
+                continue
+            await response.write(json.dumps(event).encode() + b'\n')
+    finally:
+        docker.subscribers.remove(queue)
+
+
+@web.middleware
+async def latency_middleware(request, handler):
+    latency = request.app['docker'].latency
+    if latency and not request.path.endswith('/events'):
+        await asyncio.sleep(latency)
+    return await handler(request)
+
+
+def make_app(docker):
+    app = web.Application(middlewares=[latency_middleware])
+    app['docker'] = docker
+    for route in routes:
+        app.router.add_route(route.method, route.path, route.handler)
+        # docker-py prefixes every path with the API version, like /v1.22/
+        app.router.add_route(route.method, '/v{version}' + route.path, route.handler)
+    return app
+
+
+def add_template(docker, name, prefix='myaas-', image='fake/mysql'):
+    container = docker.create(f'{prefix}{name}', {
+        'Image': image,
+        'Labels': {
+            'com.myaas.is_template': 'True',
+            'com.myaas.provider': 'mysql',
+            'com.myaas.template': name,
+            'com.myaas.volume': f'{prefix}{name}',
+        },
+    })
+    docker.set_state(container, 'exited')
+    return container
+
+
+def add_self(docker, self_id, base_dir):
+    container = docker.create('myaas', {'Image': 'habitissimo/myaas'})
+    del docker.containers[container['Id']]
+    container['Id'] = self_id
+    container['Mounts'] = [{'Source': base_dir, 'Destination': base_dir, 'RW': True}]
+    docker.set_state(container, 'running')
+    docker.containers[self_id] = container
+    return container
+
+
+@click.command()
+@click.option('-s', '--socket', 'socket_path', required=True, help='Unix socket to listen on.')
+@click.option('-t', '--template', 'templates', multiple=True, help='Template container to create.')
+@click.option('--prefix', default='myaas-', help='Prefix of the myaas containers.')
+@click.option('--self-id', default=None, help='Id of the container standing for myaas.')
+@click.option('--base-dir', default='/myaas', help='Directory mounted in the myaas container.')
+@click.option('--latency', default=0.0, help='Seconds every API call takes.')
+def main(socket_path, templates, prefix, self_id, base_dir, latency):
+    docker = FakeDocker(latency)
+    for template in templates:
+        add_template(docker, template, prefix)
+    if self_id:
+        add_self(docker, self_id, base_dir)
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    web.run_app(make_app(docker), path=socket_path, print=None)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,28 @@
+"""
+Storage driver for the API benchmarks (`benchmarks.api`): snapshots only
+create an empty directory, so the results measure myaas and not the
+filesystem.
+
+`FAKE_STORAGE_DELAY` seconds (0 by default) are added to every snapshot,
+to resemble the time taken by a real driver.
+"""
+import os
+from time import sleep
+
+from myaas.storage.base import DirectoryDriver
+from myaas.storage.exceptions import VolumeNotFound, VolumeAlreadyExists
+
+
+class Driver(DirectoryDriver):
+    delay = float(os.environ.get('FAKE_STORAGE_DELAY', 0))
+
+    def snapshot(self, source, target):
+        if not self.exists(source):
+            raise VolumeNotFound(source)
+        if self.exists(target):
+            raise VolumeAlreadyExists(target)
+        sleep(self.delay)
+        os.mkdir(self.path(target))
+
+    def clone_file(self, source, target):
+        pass
@@ -0,0 +1,162 @@
+"""
+Load generator for the myaas HTTP API.
+
+Drives a weighted mix of operations against a running server from a number
+of concurrent clients and reports throughput and latency percentiles for
+every operation:
+
+    create   POST /db/<template>/<prefix>-<n>
+    inspect  GET /db/<template>/<name> of a database created by the run
+    list     GET /db
+    delete   DELETE /db/<template>/<name> of a database created by the run
+
+Databases left at the end of the run are removed, outside the measures.
+"""
+import asyncio
+import random
+import statistics
+from collections import defaultdict
+from time import perf_counter
+
+import aiohttp
+
+OPERATIONS = ('create', 'inspect', 'list', 'delete')
+
+
+def parse_mix(value):
+    """
+    Parses an operation mix like `inspect=8,create=1,delete=1`
+    """
+    mix = {}
+    for item in value.split(','):
+        operation, _, weight = item.partition('=')
+        if operation not in OPERATIONS:
+            raise ValueError(f"unknown operation {operation}")
+        mix[operation] = float(weight or 1)
+    return mix
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    if not values:
+        return 0
+    index = min(len(values) - 1, max(0, round(pct / 100 * len(values)) - 1))
+    return values[index]
+
+
+class LoadGenerator(object):
+    def __init__(self, base_url, template, concurrency, mix, prefix='bench', seed=0):
+        self.base_url = base_url.rstrip('/')
+        self.template = template
+        self.concurrency = concurrency
+        self.mix = mix
+        self.prefix = prefix
+        self.random = random.Random(seed)
+        self.results = defaultdict(list)  # operation -> [(seconds, status)]
+        self.live = []
+        self._created = 0
+
+    def _next_name(self):
+        self._created += 1
+        return f'{self.prefix}-{self._created}'
+
+    def _url(self, name=None):
+        if name is None:
+            return f'{self.base_url}/db'
+        return f'{self.base_url}/db/{self.template}/{name}'
+
+    def _pick_operation(self):
+        operations = list(self.mix)
+        operation = self.random.choices(operations, [self.mix[o] for o in operations])[0]
+        if operation in ('inspect', 'delete') and not self.live:
+            return 'create'
+        return operation
+
+    async def _request(self, session, method, url, operation=None):
+        start = perf_counter()
+        try:
+            async with session.request(method, url) as response:
+                await response.read()
+                status = response.status
+        except aiohttp.ClientError:
+            status = 0
+        if operation:
+            self.results[operation].append((perf_counter() - start, status))
+        return status
+
+    async def _do(self, session, operation):
+        if operation == 'create':
+            name = self._next_name()
+            status = await self._request(session, 'POST', self._url(name), operation)
+            if status == 201:
+                self.live.append(name)
+        elif operation == 'inspect':
+            await self._request(session, 'GET', self._url(self.random.choice(self.live)), operation)
+        elif operation == 'list':
+            await self._request(session, 'GET', self._url(), operation)
+        elif operation == 'delete':
+            name = self.live.pop(self.random.randrange(len(self.live)))
+            await self._request(session, 'DELETE', self._url(name), operation)
+
+    async def run(self, requests, databases=0):
+        """
+        Creates `databases` to start with, then runs `requests` operations,
+        returns the seconds the operations took.
+        """
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        timeout = aiohttp.ClientTimeout(total=600)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            for _ in range(databases):
+                name = self._next_name()
+                if await self._request(session, 'POST', self._url(name)) == 201:
+                    self.live.append(name)
+
+            pending = iter(range(requests))
+
+            async def client():
+                for _ in pending:
+                    await self._do(session, self._pick_operation())
+
+            start = perf_counter()
+            await asyncio.gather(*(client() for _ in range(self.concurrency)))
+            elapsed = perf_counter() - start
+
+            await asyncio.gather(*(self._request(session, 'DELETE', self._url(name))
+                                   for name in self.live))
+            self.live = []
+        return elapsed
+
+    def report(self, elapsed):
+        """
+        Returns the stats of every operation, plus the totals as `all`
+        """
+        stats = {}
+        everything = []
+        for operation, results in sorted(self.results.items()):
+            everything.extend(results)
+            stats[operation] = summarize(results, elapsed)
+        stats['all'] = summarize(everything, elapsed)
+        return stats
+
+
+def summarize(results, elapsed):
+    latencies = [seconds for seconds, status in results]
+    return {
+        'requests': len(results),
+        'errors': len([s for _, s in results if not 200 <= s < 400]),
+        'rps': len(results) / elapsed if elapsed else 0,
+        'mean': statistics.mean(latencies) if latencies else 0,
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+    }
+
+
+def format_report(stats):
+    lines = ["{:<10} {:>8} {:>7} {:>9} {:>9} {:>9} {:>9}".format(
+        'operation', 'requests', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms')]
+    for operation, s in stats.items():
+        lines.append("{:<10} {:>8} {:>7} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f}".format(
+            operation, s['requests'], s['errors'], s['rps'],
+            s['p50'] * 1000, s['p95'] * 1000, s['p99'] * 1000))
+    return '\n'.join(lines)
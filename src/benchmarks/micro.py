@@ -0,0 +1,218 @@
+"""
+Micro-benchmarks of the code run for every container or subvolume on every
+call: parsing `btrfs subvolume list` output, the label filters of
+`utils.database` and the reaper container filter.
+
+Every case runs on synthetic inputs of 100, 1k and 10k entries, reporting
+the time per entry (median of several runs) and the peak memory allocated
+(traced with tracemalloc).
+
+Run it from the `src` directory:
+
+    python -m benchmarks.micro                 # print the results
+    python -m benchmarks.micro --compare       # against the stored baseline
+    python -m benchmarks.micro --save          # replace the stored baseline
+
+Compare runs on the same machine, the baseline in the repo is only
+meaningful for the machine it was taken on (see its `machine` section).
+"""
+import os
+import sys
+import json
+import logging
+import platform
+import statistics
+import tracemalloc
+import uuid
+from random import Random
+from time import perf_counter, time
+
+import click
+
+from myaas.utils import btrfs
+from myaas.utils.database import (is_database_container, _is_template_container,
+                                  _get_database_name)
+from myaas.reaper import ContainerFilter
+
+SIZES = (100, 1000, 10000)
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines', 'micro.json')
+
+
+def make_subvolume_lines(count, seed=0):
+    rand = Random(seed)
+    lines = []
+    for i in range(count):
+        parent = str(uuid.UUID(int=rand.getrandbits(128))) if i % 10 else '-'
+        lines.append(f"ID {256 + i} gen {rand.randint(10, 99999)} top level 5 "
+                     f"parent_uuid {parent:<36} uuid {uuid.UUID(int=rand.getrandbits(128))} "
+                     f"path myaas-template{i % 20}-db{i}")
+    return lines
+
+
+def make_snapshot_lines(count, seed=0):
+    rand = Random(seed)
+    lines = []
+    for i in range(count):
+        lines.append(f"ID {256 + i} gen {rand.randint(10, 99999)} cgen {rand.randint(10, 99999)} "
+                     f"top level 5 otime 2024-01-{1 + i % 28:02d} 10:{i % 60:02d}:00 "
+                     f"parent_uuid {uuid.UUID(int=rand.getrandbits(128))} "
+                     f"uuid {uuid.UUID(int=rand.getrandbits(128))} path myaas-template{i % 20}-db{i}")
+    return lines
+
+
+def make_containers(count, seed=0):
+    """
+    Containers as listed by docker: one template for every 50 databases, a
+    few pool members and containers not created by myaas, in any state.
+    """
+    rand = Random(seed)
+    now = time()
+    containers = []
+    for i in range(count):
+        template = f'template{i % 20}'
+        kind = i % 50
+        if kind == 0:
+            labels = {'com.myaas.is_template': 'True', 'com.myaas.template': template,
+                      'com.myaas.provider': 'mysql', 'com.myaas.volume': f'myaas-{template}'}
+        elif kind == 1:
+            labels = {'com.example.app': 'other'}
+        else:
+            labels = {'com.myaas.is_template': 'False', 'com.myaas.template': template,
+                      'com.myaas.instance': f'db{i}', 'com.myaas.provider': 'mysql',
+                      'com.myaas.volume': f'myaas-{template}-db{i}',
+                      'com.myaas.username': 'root', 'com.myaas.password': 'secret',
+                      'com.myaas.expiresAt': str(now + rand.randint(-3600, 86400))}
+            if kind == 2:
+                labels['com.myaas.pool'] = 'True'
+        state = rand.choice(('running', 'running', 'running', 'exited'))
+        status = 'Up 2 hours' if state == 'running' else 'Exited (0) 3 minutes ago'
+        if state == 'running' and rand.random() < 0.05:
+            status += ' (unhealthy)'
+        containers.append({
+            'Id': uuid.UUID(int=rand.getrandbits(128)).hex * 2,
+            'Names': [f'/myaas-{template}-db{i}'],
+            'Labels': labels,
+            'State': state,
+            'Status': status,
+            'Created': int(now) - rand.randint(0, 86400),
+        })
+    return containers
+
+
+def list_databases(containers):
+    # what utils.database.list_databases does with the inventory
+    return [_get_database_name(c) for c in filter(is_database_container, containers)]
+
+
+def list_templates(containers):
+    return [_get_database_name(c) for c in filter(_is_template_container, containers)]
+
+
+def reap(containers):
+    return list(ContainerFilter(expired=True, dead=True, unhealthy=True).filter(containers))
+
+
+def expiry_times(containers):
+    container_filter = ContainerFilter(expired=True)
+    return [container_filter.expires_at(c) for c in containers if is_database_container(c)]
+
+
+CASES = {
+    'btrfs.parse_subvolume': (make_subvolume_lines,
+                              lambda lines: [btrfs.parse_subvolume(x) for x in lines]),
+    'btrfs.parse_snapshot': (make_snapshot_lines,
+                             lambda lines: [btrfs.parse_snapshot(x) for x in lines]),
+    'database.list_databases': (make_containers, list_databases),
+    'database.list_templates': (make_containers, list_templates),
+    'reaper.ContainerFilter.filter': (make_containers, reap),
+    'reaper.ContainerFilter.expires_at': (make_containers, expiry_times),
+}
+
+
+def measure(function, data, min_time=0.2, min_runs=5):
+    """
+    Runs function(data) at least `min_runs` times and `min_time` seconds,
+    returns the median seconds per run and the peak bytes allocated.
+    """
+    timings = []
+    started = perf_counter()
+    while len(timings) < min_runs or perf_counter() - started < min_time:
+        start = perf_counter()
+        function(data)
+        timings.append(perf_counter() - start)
+
+    tracemalloc.start()
+    function(data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return statistics.median(timings), peak
+
+
+def run_cases(names, sizes):
+    results = {}
+    for name in names:
+        make_input, function = CASES[name]
+        for size in sizes:
+            seconds, peak = measure(function, make_input(size))
+            results[f'{name}[{size}]'] = {
+                'ns_per_entry': round(seconds / size * 1e9, 1),
+                'peak_kb': round(peak / 1024, 1),
+            }
+    return results
+
+
+def machine_info():
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+    }
+
+
+@click.command()
+@click.option('-c', '--case', 'cases', multiple=True, type=click.Choice(sorted(CASES)),
+              help='Case to run, can be repeated (default: all).')
+@click.option('-s', '--size', 'sizes', multiple=True, type=int,
+              help='Entries to run every case with, can be repeated (default: 100, 1k, 10k).')
+@click.option('--save', is_flag=True, help='Store the results as the baseline.')
+@click.option('--compare', is_flag=True, help='Compare the results with the baseline.')
+@click.option('--threshold', default=1.5,
+              help='Slowdown (or memory growth) over the baseline reported as a regression.')
+def main(cases, sizes, save, compare, threshold):
+    # the reaper filter logs every container it selects
+    logging.getLogger('myaas-reaper').setLevel(logging.WARNING)
+
+    results = run_cases(cases or sorted(CASES), sizes or SIZES)
+    baseline = {}
+    if compare:
+        with open(BASELINE) as f:
+            baseline = json.load(f)['results']
+
+    regressions = []
+    print(f"{'case':<44} {'ns/entry':>10} {'peak KB':>10} {'vs baseline':>12}")
+    for key, result in results.items():
+        line = f"{key:<44} {result['ns_per_entry']:>10.1f} {result['peak_kb']:>10.1f}"
+        if key in baseline:
+            speed = result['ns_per_entry'] / baseline[key]['ns_per_entry']
+            memory = result['peak_kb'] / baseline[key]['peak_kb'] if baseline[key]['peak_kb'] else 1
+            line += f" {speed:>11.2f}x"
+            if speed > threshold or memory > threshold:
+                regressions.append(key)
+                line += '  REGRESSION'
+        print(line)
+
+    if save:
+        os.makedirs(os.path.dirname(BASELINE), exist_ok=True)
+        with open(BASELINE, 'w') as f:
+            json.dump({'machine': machine_info(), 'results': results}, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"\nbaseline saved to {BASELINE}")
+
+    if regressions:
+        print(f"\n{len(regressions)} regressions over {threshold}x the baseline")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""
+Compares the Flask server (gunicorn) with the asyncio one under the same
+concurrent load.
+
+Start both against the same docker daemon and data directory, eg:
+
+    gunicorn -c gunicorn.conf.py -b 127.0.0.1:5001 runserver:app
+    python -m myaas.aioserver --port 5002
+
+and run, from the `src` directory:
+
+    python -m benchmarks.servers -t mytemplate \\
+        -u flask=http://127.0.0.1:5001 -u asyncio=http://127.0.0.1:5002 \\
+        --concurrency 200 --requests 5000 --mix inspect=8,list=1,create=1
+
+The servers are benchmarked one after the other, every run creates its own
+databases (`--databases` to start with) and removes them at the end.
+"""
+import asyncio
+
+import click
+
+from .load import LoadGenerator, parse_mix, format_report
+
+
+@click.command()
+@click.option('-u', '--url', 'urls', multiple=True, required=True,
+              help='Server to benchmark, as label=url.')
+@click.option('-t', '--template', required=True, help='Template to create databases from.')
+@click.option('-c', '--concurrency', default=100, help='Concurrent clients.')
+@click.option('-n', '--requests', default=1000, help='Operations to run against every server.')
+@click.option('-d', '--databases', default=10, help='Databases created before measuring.')
+@click.option('-m', '--mix', default='inspect=8,list=1,create=1',
+              help='Weights of the operations to run.')
+def main(urls, template, concurrency, requests, databases, mix):
+    mix = parse_mix(mix)
+    summary = {}
+    for item in urls:
+        label, _, url = item.partition('=')
+        click.echo(f"- {label} ({url}): {requests} operations, {concurrency} clients")
+        generator = LoadGenerator(url, template, concurrency, mix, prefix=f'bench-{label}')
+        elapsed = asyncio.run(generator.run(requests, databases))
+        stats = generator.report(elapsed)
+        click.echo(format_report(stats))
+        click.echo(f"  {elapsed:.1f}s\n")
+        summary[label] = stats['all']
+
+    if len(summary) > 1:
+        baseline = next(iter(summary))
+        for label, stats in summary.items():
+            ratio = stats['rps'] / summary[baseline]['rps'] if summary[baseline]['rps'] else 0
+            click.echo(f"{label:<10} {stats['rps']:>9.1f} req/s  p99 {stats['p99'] * 1000:.1f}ms"
+                       f"  ({ratio:.2f}x {baseline})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Compares clone time and space used by the storage drivers.
+
+A synthetic datadir (a big shared tablespace and many small per table
+files) is created with every driver under `--path` and cloned a few times,
+reporting the time taken by every snapshot and the disk space it took,
+measured from the free space of the filesystem.
+
+Run it from the `src` directory, as root, on the filesystem you want to
+evaluate:
+
+    python -m benchmarks.storage --path /mnt/xfs/bench \\
+        -d myaas.storage.reflink -d myaas.storage.copy
+"""
+import os
+import importlib
+import statistics
+from time import perf_counter
+
+import click
+
+
+DRIVERS = (
+    'myaas.storage.btrfs',
+    'myaas.storage.reflink',
+    'myaas.storage.overlay',
+    'myaas.storage.copy',
+)
+
+MB = 1024 * 1024
+
+
+def used_space(path):
+    os.sync()
+    st = os.statvfs(path)
+    return (st.f_blocks - st.f_bfree) * st.f_frsize
+
+
+def write_file(path, size, chunk=os.urandom(MB)):
+    with open(path, 'wb') as f:
+        for _ in range(size // MB):
+            f.write(chunk)
+
+
+def make_datadir(driver, name, tables, table_size, tablespace_size):
+    driver.create(name)
+    path = driver.path(name)
+    write_file(os.path.join(path, 'ibdata1'), tablespace_size)
+    os.makedirs(os.path.join(path, 'default'))
+    for i in range(tables):
+        write_file(os.path.join(path, 'default', f't{i}.ibd'), table_size)
+
+
+def benchmark_driver(module, path, clones, tables, table_size, tablespace_size):
+    driver = importlib.import_module(module).Driver(path)
+    make_datadir(driver, 'template', tables, table_size, tablespace_size)
+
+    timings = []
+    space = []
+    try:
+        for i in range(clones):
+            before = used_space(path)
+            start = perf_counter()
+            driver.snapshot('template', f'clone-{i}')
+            timings.append(perf_counter() - start)
+            space.append(used_space(path) - before)
+        usage = driver.usage('clone-0')
+    finally:
+        for i in range(clones):
+            driver.delete(f'clone-{i}')
+        driver.delete('template')
+
+    return {
+        'mean': statistics.mean(timings),
+        'max': max(timings),
+        'space': statistics.mean(space),
+        'usage': usage,
+    }
+
+
+@click.command()
+@click.option('-p', '--path', required=True, help='Directory to run the benchmark in, on the filesystem to test.')
+@click.option('-d', '--driver', 'drivers', multiple=True, help='Storage driver module to test, can be repeated (default: all).')
+@click.option('-n', '--clones', default=5, help='Clones to take from the template.')
+@click.option('--tables', default=200, help='Files in the synthetic datadir.')
+@click.option('--table-size', default=4, help='Size of every table file, in MB.')
+@click.option('--tablespace-size', default=512, help='Size of the shared tablespace, in MB.')
+def main(path, drivers, clones, tables, table_size, tablespace_size):
+    total = tablespace_size + tables * table_size
+    print(f"datadir of {total} MB ({tables} tables), {clones} clones per driver\n")
+    print(f"{'driver':<24} {'clone avg':>10} {'clone max':>10} {'disk/clone':>12} {'usage':>12}")
+    for module in drivers or DRIVERS:
+        root = os.path.join(path, module.rsplit('.', 1)[-1])
+        os.makedirs(root, exist_ok=True)
+        try:
+            r = benchmark_driver(module, root, clones, tables, table_size * MB, tablespace_size * MB)
+        except Exception as e:
+            print(f"{module:<24} not available: {e}")
+            continue
+        finally:
+            if not os.listdir(root):
+                os.rmdir(root)
+        print(f"{module:<24} {r['mean'] * 1000:>8.1f}ms {r['max'] * 1000:>8.1f}ms "
+              f"{r['space'] / MB:>10.1f}MB {r['usage'] / MB:>10.1f}MB")
+
+
+if __name__ == '__main__':
+    main()
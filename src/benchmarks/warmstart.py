@@ -0,0 +1,107 @@
+"""
+Compares the latency of the first query run against a database cloned from
+a template with its pages in memory recorded (warm start, see
+`MYAAS_WARM_START`) with the one of a database cloned without them (cold).
+
+It needs a real docker daemon and an imported template, run it from the
+`src` directory where myaas runs (it connects to the databases by their
+internal IP), with the query your tests start with:
+
+    python -m benchmarks.warmstart -t mytemplate --runs 5 \\
+        -q "SELECT COUNT(*) FROM orders JOIN customers USING (customer_id)"
+
+Every run clones a warm and a cold database, the cold one has the file with
+the recorded pages removed from its datadir before starting. Once they
+accept connections, and after `--settle` seconds for the pages to be loaded
+in the background, the query is run twice: the first time shows the cost of
+a cold buffer pool, the second one what it costs once in memory.
+"""
+import os
+import statistics
+import uuid
+from contextlib import closing
+from time import sleep, perf_counter
+
+import click
+
+from myaas.utils.container import client
+from myaas.utils.database import get_enabled_backend
+from myaas.storage import get_storage_driver
+
+
+def connect(db):
+    if db.provider_name == 'mysql':
+        import pymysql
+        return pymysql.connect(host=db.internal_ip, port=db.service_port, user=db.user,
+                               passwd=db.password, db=db.database)
+    import psycopg2
+    return psycopg2.connect(host=db.internal_ip, port=db.service_port, user=db.user,
+                            password=db.password, dbname=db.database)
+
+
+def time_query(connection, query):
+    start = perf_counter()
+    with closing(connection.cursor()) as cursor:
+        cursor.execute(query)
+        cursor.fetchall()
+    return perf_counter() - start
+
+
+def measure(template_db, query, warm, settle):
+    """
+    Clones a database, warm or cold, and returns the seconds its first and
+    second run of `query` took.
+    """
+    name = f"_bench-{'warm' if warm else 'cold'}-{uuid.uuid4().hex[:8]}"
+    db = template_db.clone(name, ttl=3600)
+    try:
+        if not warm:
+            path = os.path.join(get_storage_driver().path(db.volume_name), db.WARM_START_FILE)
+            if os.path.exists(path):
+                os.remove(path)
+        db.start()
+        db.wait_for_service_listening()
+        sleep(settle)
+        with closing(connect(db)) as connection:
+            return time_query(connection, query), time_query(connection, query)
+    finally:
+        db.remove()
+
+
+@click.command()
+@click.option('-t', '--template', required=True, help='Template to clone databases from.')
+@click.option('-q', '--query', required=True, help='Query to time.')
+@click.option('-r', '--runs', default=3, help='Warm and cold databases to clone.')
+@click.option('--settle', default=5.0,
+              help='Seconds to wait once the database accepts connections.')
+def main(template, query, runs, settle):
+    backend = get_enabled_backend()
+    template_db = backend.Template(client, template)
+    if not os.path.exists(os.path.join(get_storage_driver().path(template_db.source_volume),
+                                       template_db.WARM_START_FILE)):
+        click.echo(f"warning: {template} has no {template_db.WARM_START_FILE}, "
+                   f"import it again with MYAAS_WARM_START enabled", err=True)
+
+    results = {'warm': [], 'cold': []}
+    for run in range(1, runs + 1):
+        # alternate, so both see the same host conditions
+        for kind in ('warm', 'cold'):
+            first, second = measure(template_db, query, kind == 'warm', settle)
+            results[kind].append((first, second))
+            click.echo(f"run {run} {kind}: first {first * 1000:.1f}ms, "
+                       f"second {second * 1000:.1f}ms")
+
+    click.echo(f"\n{'':<6} {'first query':>14} {'second query':>14}")
+    medians = {}
+    for kind, timings in results.items():
+        first = statistics.median(t[0] for t in timings)
+        second = statistics.median(t[1] for t in timings)
+        medians[kind] = first
+        click.echo(f"{kind:<6} {first * 1000:>12.1f}ms {second * 1000:>12.1f}ms")
+    if medians['warm']:
+        click.echo(f"\nthe first query is {medians['cold'] / medians['warm']:.1f}x "
+                   f"faster on a warm clone")
+
+
+if __name__ == '__main__':
+    main()
@@ -11,6 +11,15 @@ case $1 in
     python -m myaas.reaper $@
     exit 0
   ;;
+  "pool")
+    shift
+    python -m myaas.pool $@
+    exit 0
+  ;;
+  "aioserver")
+    shift
+    exec python -m myaas.aioserver $@
+  ;;
 esac
 
 if [ -z $MYAAS_HOSTNAME ]; then
@@ -1,3 +1,5 @@
+import os
+import shutil
 import multiprocessing
 
 bind = '0.0.0.0:80'
@@ -137,3 +139,17 @@ loglevel = 'info'
 errorlog = '-'
 accesslog = '-'
 access_log_format = '%(h)s %(l)s %(u)s %(t)s "%(r)s" %(s)s %(b)s "%(f)s" "%(a)s"'  # noqa
+#
+#   Metrics
+#
+#   Every worker keeps its prometheus metrics in files in this directory so
+#   /metrics can aggregate them, it has to be empty when the server starts.
+#
+prometheus_dir = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/myaas-prometheus')
+shutil.rmtree(prometheus_dir, ignore_errors=True)
+os.makedirs(prometheus_dir)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
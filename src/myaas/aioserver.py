@@ -0,0 +1,397 @@
+"""
+asyncio variant of `myaas.server`, with the same routes and responses.
+
+Lookups are served from the container inventory and containers are
+inspected with an async docker client, so a request waiting for the docker
+daemon does not hold a worker. Provisioning and removal (storage snapshots,
+container creation) use the sync backends, they run in a thread pool off
+the event loop.
+
+    python -m myaas.aioserver --port 80
+"""
+import asyncio
+import contextvars
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from time import time, monotonic
+
+import aiodocker
+import click
+from aiohttp import web
+from prometheus_client import CONTENT_TYPE_LATEST
+
+from . import settings
+from .settings import DEBUG, CONTAINER_TTL, ADMISSION_RETRY_AFTER
+from .serialization import describe_database, describe_bulk_results
+from .utils.container import client, parse_docker_time
+from .utils.database import get_enabled_backend
+from .utils.inventory import get_inventory
+from .backends.exceptions import (NonExistentDatabase, NonExistentTemplate,
+                                  ImportInProgress, InsufficientMemory,
+                                  DockerUnavailable)
+from .listing import (list_database_page, get_status, get_templates,
+                      cached_listing, InvalidCursor)
+from .pool import get_pool_status
+from .provisioning import provision_database
+from .bulk import get_bulk_names, create_databases, remove_databases, InvalidBulkRequest
+from .jobs import submit_job, get_job, QUEUED, RUNNING
+from .readiness import record_time_to_ready, get_readiness_stats
+from .metrics import render_metrics, start_call_counter, count_docker_call
+
+logger = logging.getLogger(__name__)
+
+routes = web.RouteTableDef()
+
+
+def docker_url(host):
+    # docker-py accepts unix://var/run/docker.sock, aiodocker needs the
+    # absolute path
+    if host.startswith('unix://'):
+        return 'unix:///' + host[len('unix://'):].lstrip('/')
+    return host
+
+
+async def run_sync(request, function, *args, **kwargs):
+    """
+    Runs a blocking function in the thread pool of the app, in a copy of the
+    context of the request.
+    """
+    loop = asyncio.get_event_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(request.app['executor'],
+                                      partial(context.run, function, *args, **kwargs))
+
+
+def json_status(status, code):
+    return web.json_response({'status': status}, status=code)
+
+
+def not_found():
+    return json_status("Not found", 404)
+
+
+def get_database(template, name):
+    """
+    Returns the backend of an existing database, or None. It only looks
+    at the inventory, it does not block.
+    """
+    try:
+        return get_enabled_backend().Database(client, template, name)
+    except NonExistentDatabase:
+        return None
+
+
+async def wait_until_ready(request, db, info, timeout):
+    """
+    Async version of `readiness.wait_for_database`, the checks run in the
+    thread pool but the backoff does not hold a thread.
+    """
+    if await run_sync(request, db.is_ready):
+        return True  # already was, nothing to record
+
+    start = monotonic()
+    delay = db.WAIT_MIN_DELAY
+    while True:
+        remaining = start + timeout - monotonic()
+        if remaining <= 0:
+            return False
+        await asyncio.sleep(min(delay, remaining))
+        delay = min(delay * 1.5, db.WAIT_MAX_DELAY)
+        if await run_sync(request, db.is_ready):
+            break
+
+    started_at = parse_docker_time(info['State']['StartedAt'])
+    record_time_to_ready(db.template, time() - started_at)
+    return True
+
+
+def listing_response(request, key, build):
+    """
+    Responds with a cached listing, or 304 if the client has it already
+    """
+    etag, body = cached_listing(key, build)
+    headers = {'ETag': f'"{etag}"'}
+    if_none_match = request.headers.get('If-None-Match', '')
+    if f'"{etag}"' in if_none_match or if_none_match.strip() == '*':
+        return web.Response(status=304, headers=headers)
+    return web.Response(body=body, content_type='application/json', headers=headers)
+
+
+@routes.get('/')
+async def hello_world(request):
+    return listing_response(request, ('status',), get_status)
+
+
+@routes.get('/db')
+async def show_databases(request):
+    template = request.query.get('template')
+    state = request.query.get('state')
+    cursor = request.query.get('cursor')
+    try:
+        limit = int(request.query['limit']) if 'limit' in request.query else None
+    except ValueError:
+        limit = None
+    if limit is not None and limit <= 0:
+        return json_status("limit must be a positive number", 400)
+
+    try:
+        return listing_response(request, ('db', template, state, limit, cursor),
+                                lambda: list_database_page(template, state, limit, cursor))
+    except InvalidCursor:
+        return json_status(f'Invalid cursor "{cursor}".', 400)
+
+
+@routes.get('/templates')
+async def show_templates(request):
+    return listing_response(request, ('templates',), get_templates)
+
+
+@routes.get('/pool')
+async def show_pool(request):
+    return web.json_response({'pool': await run_sync(request, get_pool_status)})
+
+
+@routes.get('/readiness')
+async def show_readiness(request):
+    return web.json_response({'readiness': await run_sync(request, get_readiness_stats)})
+
+
+@routes.get('/metrics')
+async def show_metrics(request):
+    body = await run_sync(request, render_metrics)
+    return web.Response(body=body, headers={'Content-Type': CONTENT_TYPE_LATEST})
+
+
+@routes.get('/db/{template}/{name}')
+async def inspect_database(request):
+    template = request.match_info['template']
+    name = request.match_info['name']
+    logger.debug(f'requested inspect DB for: "{template}" => "{name}"')
+    db = get_database(template, name)
+    if not db:
+        logger.debug(f'database not found "{template}" => "{name}"')
+        return not_found()
+
+    try:
+        count_docker_call('inspect_container')
+        container = request.app['docker'].containers.container(db.container['Id'])
+        timeout = settings.DOCKER_TIMEOUTS.get('inspect_container', settings.DOCKER_TIMEOUT)
+        info = await asyncio.wait_for(container.show(), timeout)
+    except aiodocker.DockerError as e:
+        if e.status == 404:
+            return not_found()
+        raise
+    except asyncio.TimeoutError:
+        raise DockerUnavailable("docker daemon not responding")
+
+    # optionally block until the database accepts logins, invalid or not
+    # positive values are ignored
+    wait = get_float(request, 'wait')
+    ready = None
+    if wait and wait > 0:
+        ready = await wait_until_ready(request, db, info, min(wait, db.WAIT_TIMEOUT))
+
+    if request.query.get('all'):
+        return web.json_response({'container': info})
+
+    return web.json_response(describe_database(db, info, ready))
+
+
+def get_float(request, name, default=None):
+    # like flask `request.args.get(name, type=float)`, invalid values are
+    # ignored
+    try:
+        return float(request.query[name])
+    except (KeyError, ValueError):
+        return default
+
+
+async def get_ttl(request):
+    ttl = None
+    if request.content_type == 'application/json':
+        try:
+            ttl = (await request.json() or {}).get('ttl')
+        except ValueError:
+            pass
+    else:
+        ttl = (await request.post()).get('ttl')
+    return int(ttl) if ttl else CONTAINER_TTL
+
+
+async def get_json(request):
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+# registered before the routes of single databases, they would match too
+@routes.post('/db/{template}/_bulk')
+async def create_databases_bulk(request):
+    template = request.match_info['template']
+    data = await get_json(request)
+    try:
+        names = get_bulk_names(data, template)
+    except InvalidBulkRequest as e:
+        return json_status(str(e), 400)
+    ttl = data.get('ttl')
+    ttl = int(ttl) if ttl else CONTAINER_TTL
+    logger.debug(f'requested create {len(names)} DBs from "{template}"')
+
+    try:
+        results = await run_sync(request, create_databases, template, names, ttl)
+    except NonExistentTemplate:
+        logger.error(f'requested template "{template}" not found')
+        return json_status(f'Template "{template}" does not exist.', 404)
+
+    return web.json_response(describe_bulk_results(results))
+
+
+@routes.delete('/db/{template}/_bulk')
+async def remove_databases_bulk(request):
+    template = request.match_info['template']
+    try:
+        names = get_bulk_names(await get_json(request), template, existing=True)
+    except InvalidBulkRequest as e:
+        return json_status(str(e), 400)
+    logger.debug(f'requested delete {len(names)} DBs of "{template}"')
+
+    results = await run_sync(request, remove_databases, template, names)
+    return web.json_response(describe_bulk_results(results))
+
+
+@routes.post('/db/{template}/{name}')
+async def create_database(request):
+    template = request.match_info['template']
+    name = request.match_info['name']
+    logger.debug(f'requested create DB from "{template}" as "{name}"')
+    ttl = await get_ttl(request)
+
+    if get_database(template, name):
+        logger.warning(f'already exists "{template}" as "{name}"')
+        return web.Response(status=304)  # not modified
+
+    if request.query.get('async'):
+        return await create_database_async(request, template, name, ttl)
+
+    try:
+        await run_sync(request, provision_database, template, name, ttl)
+    except ImportInProgress:
+        logger.error(f'requested template "{template}" not available, import in progress')
+        return json_status("Database not available, content is being imported.", 423)
+    except NonExistentTemplate:
+        logger.error(f'requested template "{template}" not found')
+        return json_status(f'Template "{template}" does not exist.', 404)
+    except InsufficientMemory as e:
+        logger.warning(f'not enough memory to create "{template}" => "{name}": {e}')
+        response = json_status(f'Not enough memory for a new database: {e}.', 503)
+        response.headers['Retry-After'] = str(ADMISSION_RETRY_AFTER)
+        return response
+
+    response = await inspect_database(request)
+    response.set_status(201)
+    return response
+
+
+async def create_database_async(request, template, name, ttl):
+    try:
+        get_enabled_backend().Template(client, template)
+    except NonExistentTemplate:
+        logger.error(f'requested template "{template}" not found')
+        return json_status(f'Template "{template}" does not exist.', 404)
+
+    job = await run_sync(request, submit_job, template, name, ttl)
+    logger.debug(f'queued job {job["id"]} to create "{template}" => "{name}"')
+    url = str(request.app.router['show_job'].url_for(job_id=job['id']))
+    return web.json_response({'job': job, 'url': url}, status=202,
+                             headers={'Location': url})
+
+
+@routes.get('/jobs/{job_id}', name='show_job')
+async def show_job(request):
+    wait = get_float(request, 'wait', default=0)
+    deadline = monotonic() + min(wait, settings.JOB_MAX_WAIT)
+    job = get_job(request.match_info['job_id'])
+    while job and job['status'] in (QUEUED, RUNNING) and monotonic() < deadline:
+        await asyncio.sleep(0.2)
+        job = get_job(request.match_info['job_id'])
+    if not job:
+        return not_found()
+
+    result = {'job': job}
+    if job['status'] == 'done':
+        result['database'] = f"/db/{job['template']}/{job['name']}"
+    return web.json_response(result)
+
+
+@routes.delete('/db/{template}/{name}')
+async def remove_database(request):
+    template = request.match_info['template']
+    name = request.match_info['name']
+    logger.debug(f'requested delete DB "{template}" => "{name}"')
+    db = get_database(template, name)
+    if not db:
+        logger.debug(f'database not found "{template}" => "{name}"')
+        return not_found()
+
+    await run_sync(request, db.remove)
+    logger.debug("removed")
+    return web.Response(status=204)
+
+
+@web.middleware
+async def docker_calls_middleware(request, handler):
+    counter = start_call_counter()
+    response = await handler(request)
+    response.headers['X-Docker-Calls'] = str(counter.calls)
+    return response
+
+
+@web.middleware
+async def error_middleware(request, handler):
+    try:
+        return await handler(request)
+    except web.HTTPNotFound:
+        return not_found()
+    except DockerUnavailable as e:
+        logger.error(f'docker unavailable: {e}')
+        response = json_status(f'Docker is not available: {e}.', 503)
+        response.headers['Retry-After'] = str(settings.DOCKER_CIRCUIT_RESET)
+        return response
+
+
+async def on_startup(app):
+    app['executor'] = ThreadPoolExecutor(max_workers=settings.ASYNC_SERVER_THREADS,
+                                         thread_name_prefix='myaas-aioserver')
+    app['docker'] = aiodocker.Docker(url=docker_url(settings.DOCKER_HOST))
+    # the first use of the inventory lists every container
+    await asyncio.get_event_loop().run_in_executor(app['executor'], get_inventory)
+
+
+async def on_cleanup(app):
+    await app['docker'].close()
+    app['executor'].shutdown(wait=True)
+
+
+def make_app():
+    app = web.Application(middlewares=[docker_calls_middleware, error_middleware])
+    app.add_routes(routes)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+@click.command()
+@click.option('--host', default='0.0.0.0', help='Address to listen on.')
+@click.option('--port', default=80, type=int, help='Port to listen on.')
+def serve(host, port):
+    logging.basicConfig(
+        format='%(asctime)s {:4} %(levelname)s: %(message)s'.format(os.getpid()),
+        level=logging.DEBUG if DEBUG else logging.WARNING)
+    web.run_app(make_app(), host=host, port=port)
+
+
+if __name__ == '__main__':
+    serve()
@@ -1,23 +1,29 @@
 import logging
+import threading
 import subprocess
 
 from abc import ABCMeta, abstractmethod, abstractproperty
-from os.path import isdir, join as join_path
-from time import sleep
-from datetime import datetime, timedelta
+from os.path import join as join_path
+from time import sleep, monotonic
 import docker
 
 from .. import settings
-from ..utils.container import (
-    find_container, translate_host_basedir,
-    get_random_cpuset, get_mapped_cpuset
-)
-from ..utils.socket import reserve_port, test_tcp_connection
-from ..utils.btrfs import FileSystem
+from ..utils.container import translate_host_basedir, parse_docker_time
+from ..utils.cpu import allocate_cpuset, release_cpuset, CPUSET_LABEL
+from ..utils.admission import MEMORY_LABEL
+from ..utils.memory import parse_size
+from ..utils.inventory import find_container, get_inventory
+from ..utils.database import make_container_name, expiry_labels
+from ..utils.labels import clear_label_overrides
+from ..utils.generations import get_current_generation, SOURCE_LABEL
+from ..utils.ports import allocate_ports, release_ports, PORTS_LABEL
+from ..utils.socket import test_tcp_connection
+from ..storage import get_storage_driver
+from ..metrics import time_step
 
 from .exceptions import (NonExistentDatabase, NonExistentTemplate,
                          NotReachableException, DBTimeoutException,
-                         ImportInProgress, ContainerRunning)
+                         ImportInProgress)
 
 
 logger = logging.getLogger(__name__)
@@ -26,11 +32,15 @@ logger = logging.getLogger(__name__)
 class ContainerService():
     """
     Convenience wrappers arround docker client API
+
+    The inspect output of the container is kept for the life of the object
+    (usually a request) and dropped whenever it is changed through it.
     """
     def __init__(self, client, container_name):
         self.client = client  # Docker client instance
         self.container = find_container(container_name)
         self.container_name = container_name
+        self._info = None
 
     @property
     def ports(self):
@@ -48,35 +58,51 @@ class ContainerService():
     def labels(self):
         return {}
 
-    @property
-    def cpuset(self):
-        if settings.CPU_MAP:
-            return get_mapped_cpuset()
-        if not settings.CPU_PINNING_INSTANCE_CORES == 0:
-            return get_random_cpuset(settings.CPU_PINNING_INSTANCE_CORES)
-        return None
+    def allocate_cpuset(self):
+        """
+        Places the container on a set of CPUs, recorded in a shared state
+        until released, so it is called once when the container is created.
+        """
+        return allocate_cpuset(self.volume_name)
 
     @property
     def memory_limit(self):
         return settings.MEMORY_LIMIT
 
+    @property
+    def command(self):
+        return None
+
     @property
     def restart_policy(self):
         return None
 
+    @property
+    def volume_name(self):
+        # containers handed out from the pool are renamed, but keep the
+        # volume created for them under their original name
+        if self.container and 'com.myaas.volume' in (self.container.get('Labels') or {}):
+            return self.container['Labels']['com.myaas.volume']
+        return self.container_name
+
     def start(self):
-        fs = FileSystem(settings.DATA_DIR)
-        subvolume = fs.find_subvolume_by_name(self.container_name)
-        if not subvolume:
-            fs.make_subvolume(self.container_name)
+        with time_step('start'):
+            storage = get_storage_driver()
+            if not storage.exists(self.volume_name):
+                storage.create(self.volume_name)
 
-        self.client.start(self.container)
+            self._info = None
+            self.client.start(self.container)
+            get_inventory().refresh(self.container['Id'])
 
     def stop(self):
+        self._info = None
         self.client.stop(self.container, timeout=5)
         self.client.wait(self.container)
+        get_inventory().refresh(self.container['Id'])
 
     def kill(self):
+        self._info = None
         self.client.kill(self.container)
 
     def running(self):
@@ -95,34 +121,60 @@ class ContainerService():
             # removal already in progress
             pass
 
+        release_ports(self.volume_name)
+        clear_label_overrides(self.container['Id'])
+        get_inventory().discard(self.container_name)
         self.container = None
+        self._info = None
 
-    def inspect(self):
-        return self.client.inspect_container(self.container)
+    def inspect(self, refresh=False):
+        """
+        Returns the inspect output of the container, the one taken before
+        unless `refresh` is given or the container was changed since.
+        """
+        if refresh or self._info is None:
+            self._info = self.client.inspect_container(self.container)
+        return self._info
 
     def make_host_config(self):
         return {
-            "port_bindings": {port: reserve_port() for port in self.ports},
-            "mem_limit": '11G',
+            "port_bindings": dict(zip(self.ports, allocate_ports(self.volume_name, len(self.ports)))),
+            "mem_limit": settings.MEMORY_HARD_LIMIT,
             "restart_policy": self.restart_policy,
             "oom_kill_disable": True,
         }
 
     def create_container(self, image):
-        host_config = self.make_host_config()
-        # remove empty properties from config dict
-        host_config = {k: v for k, v in host_config.items() if v}
-        container = self.client.create_container(
-            image=image,
-            name=self.container_name,
-            ports=self.ports,
-            volumes=self.volumes,
-            environment=self.environment,
-            labels=self.labels,
-            cpuset=self.cpuset,
-            host_config=self.client.create_host_config(**host_config))
-
-        self.client.update_container(container, mem_reservation=self.memory_limit)
+        with time_step('create_container'):
+            host_config = self.make_host_config()
+            # remove empty properties from config dict
+            host_config = {k: v for k, v in host_config.items() if v}
+            labels = dict(self.labels)
+            if host_config.get('port_bindings'):
+                labels[PORTS_LABEL] = ','.join(map(str, host_config['port_bindings'].values()))
+            cpuset = self.allocate_cpuset()
+            if cpuset:
+                labels[CPUSET_LABEL] = cpuset
+            labels[MEMORY_LABEL] = str(parse_size(self.memory_limit))
+            try:
+                container = self.client.create_container(
+                    image=image,
+                    name=self.container_name,
+                    command=self.command,
+                    ports=self.ports,
+                    volumes=self.volumes,
+                    environment=self.environment,
+                    labels=labels,
+                    cpuset=cpuset,
+                    host_config=self.client.create_host_config(**host_config))
+            except Exception:
+                release_ports(self.volume_name)
+                release_cpuset(self.volume_name)
+                raise
+
+            self.client.update_container(container, mem_reservation=self.memory_limit)
+            get_inventory().refresh(container['Id'])
+            self._info = None
 
         return container
 
@@ -132,27 +184,19 @@ class PersistentContainerService(ContainerService):
     def datadir(self):
         return "/tmp"
 
-    @property
-    def backup_name(self):
-        return 'backup-' + self.container_name
-
-    @property
-    def backup_path(self):
-        return join_path(settings.DATA_DIR, self.backup_name)
-
     @property
     def host_datadir(self):
-        return join_path(settings.DATA_DIR, self.container_name)
+        return join_path(settings.DATA_DIR, self.volume_name)
 
     @property
     def volumes(self):
         return [self.datadir]
 
     def remove(self):
-        super().remove()
-        if isdir(self.host_datadir):
-            fs = FileSystem(settings.DATA_DIR)
-            fs.delete_subvolume(self.container_name)
+        with time_step('remove'):
+            volume_name = self.volume_name
+            super().remove()
+            get_storage_driver().delete(volume_name)
 
     def make_bindings_config(self):
         # host_datadir needs to be translated as the docker daemon runs on the
@@ -165,48 +209,18 @@ class PersistentContainerService(ContainerService):
         config['binds'] = self.make_bindings_config()
         return config
 
-    def do_backup(self):
-        if self.running():
-            raise ContainerRunning()
-
-        # remove previous backup if exists
-        self.remove_backup()
-
-        if not isdir(self.host_datadir):
-            return  # nothing to backup
-
-        fs = FileSystem(settings.DATA_DIR)
-        subvolume = fs.find_subvolume_by_name(self.container_name)
-        subvolume.take_snapshot(self.backup_name)
-
-    def remove_backup(self):
-        if isdir(self.backup_path):
-            fs = FileSystem(settings.DATA_DIR)
-            subvolume = fs.delete_subvolume(self.backup_name)
-
-    def restore_backup(self):
-        if self.running():
-            raise ContainerRunning()
-
-        if not isdir(self.backup_path):
-            return False
-
-        fs = FileSystem(settings.DATA_DIR)
-        fs.delete_subvolume(self.container_name)
-        subvolume = fs.find_subvolume_by_name(self.backup_name)
-        subvolume.take_snapshot(self.container_name)
-        fs.delete_subvolume(self.backup_name)
-
-        return True
-
 
 class AbstractDatabase(PersistentContainerService, metaclass=ABCMeta):
     """Abstract implementation for a database backend"""
 
-    WAIT_MAX_TRIES = 30
+    # seconds to wait for the service to accept connections, checked with an
+    # exponential backoff going from WAIT_MIN_DELAY to WAIT_MAX_DELAY
+    WAIT_TIMEOUT = 150
+    WAIT_MIN_DELAY = 0.1
+    WAIT_MAX_DELAY = 0.5
     not_found_exception_class = NonExistentDatabase
 
-    def __init__(self, client, template, name, create=False, ttl=settings.CONTAINER_TTL):  # noqa
+    def __init__(self, client, template, name, create=False, ttl=settings.CONTAINER_TTL, labels=None):  # noqa
         container_name = self._make_container_name(template, name)
 
         super().__init__(client, container_name)
@@ -215,6 +229,7 @@ class AbstractDatabase(PersistentContainerService, metaclass=ABCMeta):
         self.name = name
         self.create = create
         self.ttl = int(ttl)
+        self.extra_labels = labels or {}
 
         if not self.container:
             if not self.create:
@@ -247,7 +262,11 @@ class AbstractDatabase(PersistentContainerService, metaclass=ABCMeta):
 
     @property
     def internal_ip(self):
-        return self.inspect()['NetworkSettings']['IPAddress']
+        info = self.inspect()
+        if not info['NetworkSettings']['IPAddress']:
+            # it was not running when inspected, it may be by now
+            info = self.inspect(refresh=True)
+        return info['NetworkSettings']['IPAddress']
 
     @property
     def restart_policy(self):
@@ -266,16 +285,23 @@ class AbstractDatabase(PersistentContainerService, metaclass=ABCMeta):
             'com.myaas.instance': self.name,
             'com.myaas.username': self.user,
             'com.myaas.password': self.password,
+            'com.myaas.volume': self.volume_name,
         }
-        if self.ttl and self.ttl > 0:
-            expire_at = datetime.now() + timedelta(seconds=self.ttl)
-            labels.update({'com.myaas.expiresAt': str(expire_at.timestamp())})
+        labels.update(expiry_labels(self.ttl))
+        labels.update(self.extra_labels)
         return labels
 
     @property
     def host_port(self):
+        return self.get_host_port(self.inspect())
+
+    def get_host_port(self, info):
+        """
+        Returns the host port bound to the service from the inspect output
+        of the container.
+        """
         port_name = f'{self.service_port}/tcp'
-        ports = self.inspect()['NetworkSettings']['Ports']
+        ports = info['NetworkSettings']['Ports']
         if not ports:
             return None
         elif port_name not in ports:
@@ -288,66 +314,110 @@ class AbstractDatabase(PersistentContainerService, metaclass=ABCMeta):
         """
         if not self.service_port:
             raise NotReachableException("Could not find container port")
-        if not self.internal_ip:
+        internal_ip = self.internal_ip
+        if not internal_ip:
             raise NotReachableException("Could not find container IP, is container running?")
 
-        return test_tcp_connection(self.internal_ip, self.service_port)
+        return test_tcp_connection(internal_ip, self.service_port)
 
-    def wait_for_service_listening(self):
-        tries = 0
-        while tries < self.WAIT_MAX_TRIES:
-            if self.test_connection():
-                return
-            sleep(5)
-            tries += 1
+    def is_ready(self):
+        try:
+            return self.test_connection()
+        except NotReachableException:
+            return False  # container still starting
+
+    def wait_for_service_listening(self, timeout=None):
+        """
+        Waits for the service to accept connections, returns the seconds it
+        had to wait.
+        """
+        timeout = self.WAIT_TIMEOUT if timeout is None else timeout
+        start = monotonic()
+        delay = self.WAIT_MIN_DELAY
+        while not self.is_ready():
+            remaining = start + timeout - monotonic()
+            if remaining <= 0:
+                raise DBTimeoutException("Could not connect with database, max wait time reached")
+            sleep(min(delay, remaining))
+            delay = min(delay * 1.5, self.WAIT_MAX_DELAY)
+
+        return monotonic() - start
 
-        raise DBTimeoutException("Could not connect with database, max retries reached")
+    @property
+    def started_at(self):
+        """
+        Timestamp of the last time the container was started
+        """
+        return parse_docker_time(self.inspect()['State']['StartedAt'])
 
     def _make_container_name(self, template, name):
-        container_name = settings.CONTAINER_PREFIX + template
-        if name:
-            container_name += '-' + name
-        return container_name
+        return make_container_name(template, name)
 
 
 class AbstractDatabaseTemplate(AbstractDatabase):
     """
     Abstract implementation of a template database
     """
-    WAIT_MAX_TRIES = 60
+    WAIT_TIMEOUT = 300
+    STREAM_CHUNK_SIZE = 1024 * 1024
 
     not_found_exception_class = NonExistentTemplate
 
     def __init__(self, docker_client, template, create=False):
         super().__init__(docker_client, template, None, create, ttl=0)
 
-    def clone(self, name, ttl=None):
-        if self.running():
-            raise ImportInProgress
-
+    @property
+    def source_volume(self):
+        """
+        Volume databases are cloned from: the generation published by the
+        last import, or the datadir of the template if it was imported before
+        generations existed.
+        """
+        return get_current_generation(self.template) or self.volume_name
+
+    def clone(self, name, ttl=None, labels=None):
+        source = self.source_volume
+        if source == self.volume_name:
+            if self.running():
+                # nothing published yet, the datadir is being imported
+                raise ImportInProgress
+            if not get_storage_driver().exists(source):
+                # its first import failed
+                raise NonExistentTemplate()
+
+        labels = dict(labels or {}, **{SOURCE_LABEL: source})
         database = self.database_backend(
             self.client, self.template,
-            name, create=True, ttl=ttl)
+            name, create=True, ttl=ttl, labels=labels)
 
-        fs = FileSystem(settings.DATA_DIR)
-
-        pre_existent_volume = fs.find_subvolume_by_name(database.container_name)
-        if pre_existent_volume:
-            pre_existent_volume.delete()
-
-        subvolume = fs.find_subvolume_by_name(self.container_name)
-        subvolume.take_snapshot(database.host_datadir)
+        storage = get_storage_driver()
+        with time_step('snapshot'):
+            # remove leftovers from a previous database with the same name
+            storage.delete(database.volume_name)
+            storage.snapshot(source, database.volume_name)
 
         return database
 
     @abstractmethod
     def import_data(self, sql_file):
+        """
+        Imports a dump file (optionally compressed), returns the bytes of
+        uncompressed data imported.
+        """
         pass
 
     @abstractmethod
     def get_engine_status(self):
         pass
 
+    def save_warm_start(self):
+        """
+        Records the pages in memory to a file in the datadir, for the
+        databases cloned from it to load them when they start. Returns False
+        when not supported.
+        """
+        return False
+
     @abstractproperty
     def database_backend(self):
         pass
@@ -358,6 +428,7 @@ class AbstractDatabaseTemplate(AbstractDatabase):
             'com.myaas.is_template': 'True',
             'com.myaas.provider': self.provider_name,
             'com.myaas.template': self.template,
+            'com.myaas.volume': self.volume_name,
         }
 
     @property
@@ -373,3 +444,45 @@ class AbstractDatabaseTemplate(AbstractDatabase):
                                 env=env)
         out, err = proc.communicate()
         return (out, err)
+
+    def _stream_command(self, command, source, env=None):
+        """
+        Runs `command` writing the contents of `source` (a binary file like
+        object) to its standard input in chunks, so memory use does not
+        depend on its size. Returns its output and the bytes written.
+        """
+        proc = subprocess.Popen(command,
+                                stdin=subprocess.PIPE,
+                                stderr=subprocess.PIPE,
+                                stdout=subprocess.PIPE,
+                                env=env)
+        # drain the outputs while we write, or the command could block
+        output = {}
+
+        def drain(name, stream):
+            output[name] = stream.read()
+
+        readers = [threading.Thread(target=drain, args=('out', proc.stdout)),
+                   threading.Thread(target=drain, args=('err', proc.stderr))]
+        for reader in readers:
+            reader.start()
+
+        written = 0
+        try:
+            for chunk in iter(lambda: source.read(self.STREAM_CHUNK_SIZE), b''):
+                proc.stdin.write(chunk)
+                written += len(chunk)
+        except BrokenPipeError:
+            pass  # the command died, its stderr will tell why
+        finally:
+            try:
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass
+            proc.wait()
+            for reader in readers:
+                reader.join()
+
+        return (output['out'].decode('utf-8', 'replace'),
+                output['err'].decode('utf-8', 'replace'),
+                written)
@@ -18,9 +18,21 @@ class ImportDataError(Exception):
     pass
 
 
+class WarmStartError(Exception):
+    pass
+
+
 class NotReachableException(Exception):
     pass
 
 
 class ContainerRunning(Exception):
     pass
+
+
+class InsufficientMemory(Exception):
+    pass
+
+
+class DockerUnavailable(Exception):
+    pass
@@ -1,12 +1,27 @@
+import io
+import logging
+import tempfile
+from time import sleep, monotonic
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+
 import pymysql
 
 from .. import settings
+from ..utils.dumps import open_dump, DUMP_EXTENSIONS
+from ..utils.memory import parse_size
+from ..utils.mysqldump import MysqlDumpSplitter, ChainReader, UnsupportedDump
 
 from .base import AbstractDatabase, AbstractDatabaseTemplate
-from .exceptions import ImportDataError
+from .exceptions import ImportDataError, WarmStartError
+
+logger = logging.getLogger(__name__)
 
 
 class Database(AbstractDatabase):
+    # written by Template.save_warm_start, relative to the datadir
+    WARM_START_FILE = 'ib_buffer_pool'
+
     @property
     def provider_name(self):
         return "mysql"
@@ -27,6 +42,18 @@ class Database(AbstractDatabase):
     def service_port(self):
         return 3306
 
+    @property
+    def command(self):
+        if not settings.WARM_START:
+            return None
+        # replaces the CMD of the image, keep the options of the bundled one
+        # (extras/mysql). ib_buffer_pool in the datadir is the one of the
+        # template, do not overwrite it
+        return ["mysqld",
+                "--innodb-doublewrite=0",
+                "--innodb-buffer-pool-load-at-startup=ON",
+                "--innodb-buffer-pool-dump-at-shutdown=OFF"]
+
     @property
     def user(self):
         return settings.DB_USERNAME
@@ -47,7 +74,8 @@ class Database(AbstractDatabase):
                 port=self.service_port,
                 user=self.user,
                 passwd=self.password,
-                db=self.database)
+                db=self.database,
+                connect_timeout=2)
             conn.close()
         except pymysql.OperationalError:
             return False
@@ -60,12 +88,92 @@ class Template(Database, AbstractDatabaseTemplate):
     def database_backend(self):
         return Database
 
+    @property
+    def import_threads(self):
+        return settings.MYSQL_IMPORT_THREADS_PER_TEMPLATE.get(
+            self.template, settings.MYSQL_IMPORT_THREADS)
+
     def import_data(self, sql_file):
+        if self.import_threads > 1:
+            try:
+                return self._import_parallel(sql_file, self.import_threads)
+            except UnsupportedDump as e:
+                logger.warning(f"can not split {sql_file} ({e}), importing it serially")
+
         mysql_command = self._build_mysql_command()
-        with open(sql_file, 'r') as f:
-            out, err = self._run_command(mysql_command, stdin=f)
+        with open_dump(sql_file) as f:
+            out, err, size = self._stream_command(mysql_command, f)
             if err:
                 raise ImportDataError(err)
+        return size
+
+    def _import_parallel(self, sql_file, threads):
+        """
+        Loads every table (schema and data) over its own connection, `threads`
+        at a time. Foreign keys are added once all the tables are loaded,
+        followed by triggers, views and routines.
+        """
+        mysql_command = self._build_mysql_command()
+        # plain dumps are read again by the loaders, compressed ones spooled
+        path = sql_file if sql_file.endswith(DUMP_EXTENSIONS[0]) else None
+        errors = []
+
+        def load(dump, table):
+            try:
+                with closing(ChainReader(io.BytesIO(dump.header), table.open())) as source:
+                    out, err, size = self._stream_command(mysql_command, source)
+            finally:
+                table.release()
+            if err:
+                errors.append(f"{table.name}: {err}")
+
+        with tempfile.TemporaryDirectory(prefix='myaas-import-') as spool_dir, \
+                open_dump(sql_file) as f, \
+                ThreadPoolExecutor(max_workers=threads) as executor:
+            dump = MysqlDumpSplitter(f, path=path, spool_dir=spool_dir,
+                                     max_spool=parse_size(settings.MYSQL_IMPORT_SPOOL_SIZE))
+            futures = []
+            for table in dump.tables():
+                if errors:
+                    break
+                futures.append(executor.submit(load, dump, table))
+            for future in futures:
+                future.result()
+
+        if errors:
+            raise ImportDataError('\n'.join(errors))
+
+        final = io.BytesIO(dump.header + b''.join(dump.constraints) + dump.post)
+        out, err, size = self._stream_command(mysql_command, final)
+        if err:
+            raise ImportDataError(err)
+        return dump.size
+
+    def save_warm_start(self, timeout=300):
+        """
+        Dumps the list of pages in the InnoDB buffer pool to `ib_buffer_pool`
+        in the datadir, waiting up to `timeout` seconds for it.
+        """
+        out, err = self._run_sql("SET GLOBAL innodb_buffer_pool_dump_pct = 100; "
+                                 "SET GLOBAL innodb_buffer_pool_dump_now = ON;")
+        if err:
+            raise WarmStartError(err)
+
+        deadline = monotonic() + timeout
+        while True:
+            out, err = self._run_sql("SHOW STATUS LIKE 'Innodb_buffer_pool_dump_status';")
+            if err:
+                raise WarmStartError(err)
+            if 'completed' in out:
+                return True
+            if monotonic() > deadline:
+                raise WarmStartError(f"buffer pool dump not completed in {timeout}s: {out}")
+            sleep(0.5)
+
+    def _run_sql(self, sql):
+        mysql_command = self._build_mysql_command()
+        mysql_command += ["--batch", "--skip-column-names", "-e", sql]
+        return self._run_command(mysql_command)
 
     def get_engine_status(self):
         mysql_command = self._build_mysql_command()
@@ -1,11 +1,17 @@
 import os
 
+import psycopg2
+
 from .. import settings
+from ..utils.dumps import open_dump
 from .base import AbstractDatabase, AbstractDatabaseTemplate
-from .exceptions import ImportDataError
+from .exceptions import ImportDataError, WarmStartError
 
 
 class Database(AbstractDatabase):
+    # written by Template.save_warm_start, relative to the datadir
+    WARM_START_FILE = 'autoprewarm.blocks'
+
     @property
     def provider_name(self):
         return "postgres"
@@ -26,6 +32,14 @@ class Database(AbstractDatabase):
     def service_port(self):
         return 5432
 
+    @property
+    def command(self):
+        if not settings.WARM_START:
+            return None
+        # the autoprewarm worker (postgres 11+) loads autoprewarm.blocks from
+        # the datadir at startup
+        return ["postgres", "-c", "shared_preload_libraries=pg_prewarm"]
+
     @property
     def user(self):
         return "postgres"
@@ -38,6 +52,22 @@ class Database(AbstractDatabase):
     def database(self):
         return settings.POSTGRES_ENVIRONMENT['POSTGRES_DB']
 
+    def test_connection(self):
+        super().test_connection()
+        try:
+            conn = psycopg2.connect(
+                host=self.internal_ip,
+                port=self.service_port,
+                user=self.user,
+                password=self.password,
+                dbname=self.database,
+                connect_timeout=2)
+            conn.close()
+        except psycopg2.OperationalError:
+            return False
+
+        return True
+
 
 class Template(Database, AbstractDatabaseTemplate):
     @property
@@ -48,10 +78,42 @@ class Template(Database, AbstractDatabaseTemplate):
         command = self._build_pg_command()
         env = os.environ.copy()
         env['PGPASSWORD'] = self.password
-        with open(pg_dump, 'r') as f:
-            out, err = self._run_command(command, stdin=f, env=env)
+        with open_dump(pg_dump) as f:
+            out, err, size = self._stream_command(command, f, env=env)
             if err:
                 raise ImportDataError(err)
+        return size
+
+    def save_warm_start(self):
+        """
+        Writes the blocks in shared buffers to `autoprewarm.blocks` in the
+        datadir, returns False on servers without autoprewarm (before 11).
+
+        pg_prewarm is created in a transaction rolled back once the file is
+        written, so the template database is left as imported.
+        """
+        out, err = self._run_sql("SHOW server_version_num;")
+        try:
+            version = int(out.strip())
+        except ValueError:
+            raise WarmStartError(err or out)
+        if version < 110000:
+            return False
+
+        out, err = self._run_sql("BEGIN; "
+                                 "CREATE EXTENSION IF NOT EXISTS pg_prewarm; "
+                                 "SELECT autoprewarm_dump_now(); "
+                                 "ROLLBACK;")
+        if 'ERROR' in err:
+            raise WarmStartError(err)
+        return True
+
+    def _run_sql(self, sql):
+        command = self._build_pg_command()
+        command += ["--quiet", "--tuples-only", "--no-align", f"--command={sql}"]
+        env = os.environ.copy()
+        env['PGPASSWORD'] = self.password
+        return self._run_command(command, env=env)
 
     def get_engine_status(self):
         pass
@@ -0,0 +1,140 @@
+"""
+Creation and removal of many databases of a template in a single request,
+for CI pipelines fanning out test shards.
+
+The template is looked up once and the databases are created (or removed)
+by a bounded number of threads, every one reporting its own status with the
+HTTP code a single request would have got.
+"""
+import re
+import logging
+from contextvars import copy_context
+from concurrent.futures import ThreadPoolExecutor
+
+from . import settings
+from .utils.container import client
+from .utils.database import get_enabled_backend, get_myaas_containers
+from .backends.exceptions import (NonExistentDatabase, NonExistentTemplate,
+                                  ImportInProgress, InsufficientMemory)
+from .provisioning import provision_database
+
+logger = logging.getLogger(__name__)
+
+# docker container names allow these, and the name is part of ours
+NAME_PATTERN = re.compile(r'^[a-zA-Z0-9][a-zA-Z0-9_.-]*$')
+
+
+class InvalidBulkRequest(ValueError):
+    pass
+
+
+def get_bulk_names(data, template, existing=False):
+    """
+    Returns the database names requested with `{"names": [...]}` or
+    `{"count": 20, "prefix": "shard"}` (shard-1 to shard-20). With `existing`,
+    a prefix alone selects every database of `template` named after it.
+    """
+    if not isinstance(data, dict):
+        raise InvalidBulkRequest("a JSON object is required")
+    if 'names' in data:
+        names = data['names']
+        if not isinstance(names, list) or not all(isinstance(n, str) for n in names):
+            raise InvalidBulkRequest("names must be a list of strings")
+    elif 'prefix' in data:
+        prefix = str(data['prefix'])
+        if 'count' in data:
+            try:
+                count = int(data['count'])
+            except (TypeError, ValueError):
+                raise InvalidBulkRequest("count must be a number")
+            if not 0 < count <= settings.BULK_MAX_SIZE:
+                raise InvalidBulkRequest(f"count must be between 1 and {settings.BULK_MAX_SIZE}")
+            names = [f'{prefix}-{i}' for i in range(1, count + 1)]
+        elif existing:
+            names = [c['Labels']['com.myaas.instance'] for c in get_myaas_containers()
+                     if c['Labels']['com.myaas.template'] == template and
+                     c['Labels']['com.myaas.instance'].startswith(f'{prefix}-')]
+        else:
+            raise InvalidBulkRequest("count is required with a prefix")
+    else:
+        raise InvalidBulkRequest("names or a prefix are required")
+
+    if len(names) > settings.BULK_MAX_SIZE:
+        raise InvalidBulkRequest(f"at most {settings.BULK_MAX_SIZE} databases per request")
+    invalid = [n for n in names if not NAME_PATTERN.match(n)]
+    if invalid:
+        raise InvalidBulkRequest(f"invalid names: {', '.join(invalid)}")
+    # keep the order, but do every database once
+    return list(dict.fromkeys(names))
+
+
+def _run(function, names):
+    if not names:
+        return []
+    workers = min(settings.BULK_CONCURRENCY, len(names))
+    # every item runs in a copy of our context, for the docker calls to be
+    # counted in the request
+    contexts = [copy_context() for _ in names]
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='myaas-bulk') as executor:
+        return list(executor.map(lambda context, name: context.run(function, name),
+                                 contexts, names))
+
+
+def _failed(name, status, error):
+    return {'name': name, 'status': status, 'error': error}
+
+
+def create_databases(template, names, ttl):
+    """
+    Creates and starts databases `names` from `template`. Returns, in order,
+    a dict for every one with its `name` and `status`: 201 with the
+    database (`db`) and its inspect output (`info`) when created, 304 when it
+    already existed, or an error code and message.
+
+    Raises NonExistentTemplate if the template does not exist.
+    """
+    backend = get_enabled_backend()
+    template_db = backend.Template(client, template)
+
+    def create(name):
+        try:
+            backend.Database(client, template, name)
+            return {'name': name, 'status': 304}
+        except NonExistentDatabase:
+            pass
+
+        try:
+            db = provision_database(template, name, ttl, template_db)
+            return {'name': name, 'status': 201, 'db': db, 'info': db.inspect()}
+        except NonExistentTemplate:
+            return _failed(name, 404, "Template not found.")
+        except ImportInProgress:
+            return _failed(name, 423, "Database not available, content is being imported.")
+        except InsufficientMemory as e:
+            return _failed(name, 503, f"Not enough memory for a new database: {e}.")
+        except Exception as e:
+            logger.exception(f'could not create "{template}" => "{name}"')
+            return _failed(name, 500, str(e))
+
+    return _run(create, names)
+
+
+def remove_databases(template, names):
+    """
+    Removes databases `names` of `template`. Returns, in order, a dict for
+    every one with its `name` and `status`: 204 when removed, 404 when it did
+    not exist, or 500 and an error message.
+    """
+    database_class = get_enabled_backend().Database
+
+    def remove(name):
+        try:
+            database_class(client, template, name).remove()
+            return {'name': name, 'status': 204}
+        except NonExistentDatabase:
+            return _failed(name, 404, "Not found")
+        except Exception as e:
+            logger.exception(f'could not remove "{template}" => "{name}"')
+            return _failed(name, 500, str(e))
+
+    return _run(remove, names)
@@ -0,0 +1,162 @@
+import os
+import uuid
+import logging
+import threading
+from time import time, sleep
+from concurrent.futures import ThreadPoolExecutor
+
+from . import settings
+from .utils.state import state_path, read_state, write_state
+from .provisioning import provision_database
+from .readiness import wait_for_database
+from .backends.exceptions import (NonExistentTemplate, ImportInProgress,
+                                  DBTimeoutException, InsufficientMemory)
+
+logger = logging.getLogger(__name__)
+
+JOBS_DIR = 'jobs'
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+LOST = 'lost'
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    Returns the provisioning executor of the current process, created on
+    first use so every forked worker gets its own threads.
+    """
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.PROVISIONING_CONCURRENCY,
+                thread_name_prefix='myaas-provisioning')
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def _job_state(job_id):
+    return os.path.join(JOBS_DIR, f'{job_id}.json')
+
+
+def save_job(job):
+    job['updated_at'] = time()
+    write_state(_job_state(job['id']), job)
+
+
+def get_job(job_id):
+    """
+    Returns a job, from any worker, or None if it does not exist.
+    """
+    job = read_state(_job_state(job_id), default=False)
+    if not job:
+        return None
+    if job['status'] in (QUEUED, RUNNING) and not _is_alive(job['pid']):
+        # the worker running it died, it will not finish
+        job['status'] = LOST
+    return job
+
+
+def wait_for_job(job_id, timeout):
+    """
+    Returns the job once it has finished or `timeout` seconds have passed.
+    """
+    deadline = time() + min(timeout, settings.JOB_MAX_WAIT)
+    job = get_job(job_id)
+    while job and job['status'] in (QUEUED, RUNNING) and time() < deadline:
+        sleep(0.2)
+        job = get_job(job_id)
+    return job
+
+
+def submit_job(template, name, ttl):
+    """
+    Queues the creation of database `name` from `template`, the returned job
+    is updated as it progresses and finishes once the database accepts
+    connections.
+    """
+    job = {
+        'id': uuid.uuid4().hex,
+        'template': template,
+        'name': name,
+        'ttl': ttl,
+        'status': QUEUED,
+        'error': None,
+        'created_at': time(),
+        'pid': os.getpid(),
+    }
+    save_job(job)
+    get_executor().submit(run_job, job)
+    _purge_jobs()
+    return job
+
+
+def provision_when_admitted(job):
+    """
+    Provisions the database of `job`, waiting queued while the host does not
+    have memory for it, up to ADMISSION_QUEUE_TIMEOUT seconds.
+    """
+    deadline = time() + settings.ADMISSION_QUEUE_TIMEOUT
+    while True:
+        try:
+            return provision_database(job['template'], job['name'], job['ttl'])
+        except InsufficientMemory as e:
+            if time() + settings.ADMISSION_RETRY_AFTER > deadline:
+                raise
+            job.update(status=QUEUED, error=f'Waiting for memory: {e}.')
+            save_job(job)
+            sleep(settings.ADMISSION_RETRY_AFTER)
+            job.update(status=RUNNING, error=None)
+            save_job(job)
+
+
+def run_job(job):
+    job['status'] = RUNNING
+    save_job(job)
+    try:
+        db = provision_when_admitted(job)
+        if not wait_for_database(db):
+            raise DBTimeoutException("Could not connect with database, max wait time reached")
+    except NonExistentTemplate:
+        job.update(status=FAILED, error=f'Template "{job["template"]}" does not exist.')
+    except ImportInProgress:
+        job.update(status=FAILED, error="Database not available, content is being imported.")
+    except InsufficientMemory as e:
+        job.update(status=FAILED, error=f'Not enough memory for a new database: {e}.')
+    except Exception as e:
+        logger.exception(f'job {job["id"]} failed')
+        job.update(status=FAILED, error=str(e) or e.__class__.__name__)
+    else:
+        job['status'] = DONE
+    save_job(job)
+
+
+def _purge_jobs():
+    """
+    Removes the jobs finished more than JOB_RETENTION seconds ago
+    """
+    jobs_dir = state_path(JOBS_DIR)
+    expired = time() - settings.JOB_RETENTION
+    for entry in os.scandir(jobs_dir):
+        try:
+            if entry.stat().st_mtime < expired:
+                os.unlink(entry.path)
+        except FileNotFoundError:
+            pass  # purged by another worker
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
@@ -0,0 +1,107 @@
+"""
+Responses of the listing endpoints (`/`, `/db`, `/templates`).
+
+Dashboards poll them every few seconds, so every response is built once per
+change of the container inventory and kept, with an ETag derived from its
+contents (the same in every worker), answering requests with a matching
+If-None-Match with 304 Not Modified.
+"""
+import json
+import base64
+import hashlib
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+
+from .utils.database import get_myaas_containers, list_databases, list_database_templates
+from .utils.inventory import get_inventory
+
+# responses kept for the current inventory generation, for different
+# filters and pages
+MAX_CACHED = 64
+
+_cache = OrderedDict()  # key -> (etag, body)
+_cache_generation = None
+_cache_lock = threading.Lock()
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def describe_container(container):
+    db = {
+        'template': container['Labels']['com.myaas.template'],
+        'name': container['Labels']['com.myaas.instance'],
+        'state': container['Status'],
+        'created': container['Created'],
+    }
+    if 'com.myaas.expiresAt' in container['Labels']:
+        db.update({'expires_at': container['Labels']['com.myaas.expiresAt']})
+    return db
+
+
+def encode_cursor(database):
+    key = json.dumps([database['template'], database['name']]).encode()
+    return base64.urlsafe_b64encode(key).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        template, name = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise InvalidCursor(cursor)
+    return (template, name)
+
+
+def list_database_page(template=None, state=None, limit=None, cursor=None):
+    """
+    Databases sorted by template and name, optionally filtered, `limit` of
+    them after `cursor` (the `next_cursor` of the previous page).
+    """
+    databases = sorted((describe_container(c) for c in get_myaas_containers(template, state)),
+                       key=lambda d: (d['template'], d['name']))
+    if cursor:
+        keys = [(d['template'], d['name']) for d in databases]
+        databases = databases[bisect_right(keys, decode_cursor(cursor)):]
+
+    result = {'databases': databases}
+    if limit and len(databases) > limit:
+        result['databases'] = databases[:limit]
+        result['next_cursor'] = encode_cursor(databases[limit - 1])
+    return result
+
+
+def get_status():
+    return dict(status="Service is running",
+                templates=list_database_templates(),
+                databases=list_databases())
+
+
+def get_templates():
+    return dict(templates=list_database_templates())
+
+
+def cached_listing(key, build):
+    """
+    Returns the ETag and JSON body of the listing identified by `key`, built
+    calling `build()` unless the inventory did not change since it was.
+    """
+    global _cache_generation
+    generation = get_inventory().generation
+    with _cache_lock:
+        if generation != _cache_generation:
+            _cache.clear()
+            _cache_generation = generation
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+
+    body = json.dumps(build(), sort_keys=True).encode()
+    etag = hashlib.sha1(body).hexdigest()
+    with _cache_lock:
+        if generation == _cache_generation:
+            _cache[key] = (etag, body)
+            while len(_cache) > MAX_CACHED:
+                _cache.popitem(last=False)
+    return etag, body
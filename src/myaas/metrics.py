@@ -0,0 +1,182 @@
+import os
+import glob
+import threading
+from contextvars import ContextVar
+from time import monotonic
+
+from prometheus_client import (REGISTRY, CollectorRegistry, Counter, Gauge,
+                               Histogram, generate_latest, write_to_textfile)
+from prometheus_client.parser import text_string_to_metric_families
+from prometheus_client import multiprocess
+
+from . import settings
+
+STEP_BUCKETS = (.05, .1, .25, .5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+STEP_DURATION = Histogram(
+    'myaas_step_duration_seconds',
+    'Time spent on every step of creating and removing databases',
+    ['step'], buckets=STEP_BUCKETS)
+
+DOCKER_CALLS = Counter(
+    'myaas_docker_calls_total', 'Docker API calls', ['method'])
+DOCKER_FAILURES = Counter(
+    'myaas_docker_failures_total', 'Docker API calls that failed', ['method'])
+DOCKER_DURATION = Histogram(
+    'myaas_docker_call_duration_seconds', 'Time spent on docker API calls',
+    ['method'], buckets=STEP_BUCKETS)
+DOCKER_REJECTED = Counter(
+    'myaas_docker_rejected_total',
+    'Docker API calls not made, the daemon was not responding or too busy', ['reason'])
+
+IMPORT_BYTES = Counter(
+    'myaas_import_bytes_total', 'Uncompressed bytes imported into templates',
+    ['template'])
+IMPORT_THROUGHPUT = Gauge(
+    'myaas_import_bytes_per_second', 'Throughput of the last import of every template',
+    ['template'], multiprocess_mode='max')
+
+REAPER_CYCLE_DURATION = Histogram(
+    'myaas_reaper_cycle_duration_seconds', 'Time spent on every reaper cycle',
+    buckets=STEP_BUCKETS)
+REAPER_REMOVED = Counter(
+    'myaas_reaper_removed_total', 'Databases removed by the reaper')
+REAPER_FAILED = Counter(
+    'myaas_reaper_failed_total', 'Databases the reaper gave up removing')
+REAPER_IN_PROGRESS = Gauge(
+    'myaas_reaper_removals_in_progress', 'Removals queued or running in the reaper',
+    multiprocess_mode='livesum')
+REAPER_RECLAIMED = Counter(
+    'myaas_reaper_reclaimed_bytes_total',
+    'Disk and memory reservations freed by the reaper', ['resource'])
+
+
+class time_step(object):
+    """
+    Context manager observing its duration as `step` in STEP_DURATION
+    """
+    def __init__(self, step):
+        self.step = step
+
+    def __enter__(self):
+        self.start = monotonic()
+        return self
+
+    def __exit__(self, *args):
+        STEP_DURATION.labels(step=self.step).observe(monotonic() - self.start)
+
+
+class CallCounter(object):
+    """
+    Docker API calls made while handling a request, from any thread
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def add(self):
+        with self._lock:
+            self.calls += 1
+
+
+_call_counter = ContextVar('myaas_docker_call_counter', default=None)
+
+
+def start_call_counter():
+    """
+    Counts the docker API calls made from now on in the current context (the
+    request being handled, and the threads it runs work in with a copy of
+    it), returns the counter.
+    """
+    counter = CallCounter()
+    _call_counter.set(counter)
+    return counter
+
+
+def count_docker_call(method):
+    DOCKER_CALLS.labels(method=method).inc()
+    counter = _call_counter.get()
+    if counter is not None:
+        counter.add()
+
+
+class InstrumentedClient(object):
+    """
+    Proxy of a docker client counting and timing every API call
+    """
+    # helpers building parameters, no request is made
+    LOCAL_METHODS = ('create_host_config', 'create_networking_config',
+                     'create_endpoint_config')
+
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr) or name.startswith('_') or name in self.LOCAL_METHODS:
+            return attr
+
+        def call(*args, **kwargs):
+            count_docker_call(name)
+            start = monotonic()
+            try:
+                return attr(*args, **kwargs)
+            except Exception:
+                DOCKER_FAILURES.labels(method=name).inc()
+                raise
+            finally:
+                DOCKER_DURATION.labels(method=name).observe(monotonic() - start)
+        return call
+
+
+_textfile_lock = threading.Lock()
+
+
+def write_textfile(component):
+    """
+    Saves the metrics of this process to `METRICS_DIR`, for processes other
+    than the server (updater, reaper, pool) to have them exposed by it.
+    """
+    with _textfile_lock:
+        os.makedirs(settings.METRICS_DIR, exist_ok=True)
+        path = os.path.join(settings.METRICS_DIR, component + '.prom')
+        write_to_textfile(path, REGISTRY)
+
+
+class ServerCollector(object):
+    """
+    Collects the metrics of every server worker and the ones written by the
+    other processes with `write_textfile`, labeled with their component.
+    """
+    def __init__(self):
+        if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+            self.registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(self.registry)
+        else:
+            self.registry = REGISTRY
+
+    def collect(self):
+        families = {}
+        for family in self.registry.collect():
+            families[family.name] = family
+
+        for path in sorted(glob.glob(os.path.join(settings.METRICS_DIR, '*.prom'))):
+            component = os.path.basename(path)[:-len('.prom')]
+            with open(path) as f:
+                text = f.read()
+            for family in text_string_to_metric_families(text):
+                if family.name.endswith('_created'):
+                    continue  # creation times of the other processes series
+                samples = [s._replace(labels=dict(s.labels, component=component))
+                           for s in family.samples]
+                if family.name in families:
+                    families[family.name].samples.extend(samples)
+                else:
+                    family.samples = samples
+                    families[family.name] = family
+
+        return families.values()
+
+
+def render_metrics():
+    return generate_latest(ServerCollector())
@@ -0,0 +1,202 @@
+import uuid
+import logging
+from time import sleep
+
+import click
+import docker
+
+from . import settings
+from .settings import DEBUG
+from .utils.container import client
+from .utils.database import (get_enabled_backend, make_container_name,
+                             expiry_labels, list_database_templates)
+from .utils.inventory import get_inventory
+from .utils.generations import SOURCE_LABEL
+from .utils.labels import (get_label_overrides, set_label_overrides,
+                           clear_label_overrides)
+from .utils.signals import SignalHandler
+from .utils.state import state_lock, locked_state, read_state
+from .utils.admission import admit, release_admission
+from .metrics import write_textfile
+from .backends.exceptions import (NonExistentTemplate, ImportInProgress,
+                                  NotReachableException, InsufficientMemory)
+
+
+logger = logging.getLogger(__name__)
+
+POOL_LABEL = 'com.myaas.pool'
+READY_LABEL = 'com.myaas.pool.ready'
+
+CLAIMS_LOCK = 'pool'
+STATS_STATE = 'pool-stats.json'
+
+
+def pool_size(template):
+    return settings.POOL_SIZES.get(template, settings.POOL_SIZE)
+
+
+def get_pool_members(template):
+    """
+    Returns the containers in the pool of `template`, oldest first.
+    """
+    members = [c for c in get_inventory().containers()
+               if c['Labels'].get(POOL_LABEL) == 'True'
+               and c['Labels'].get('com.myaas.template') == template]
+    return sorted(members, key=lambda c: c['Created'])
+
+
+def is_running(container):
+    return container['Status'].startswith('Up')
+
+
+def is_ready(container):
+    return is_running(container) and container['Labels'].get(READY_LABEL) == 'True'
+
+
+def claim(template, name, ttl):
+    """
+    Hands out a ready database from the pool of `template` renaming it to
+    `name`, returns False if there was none available.
+
+    The container labels can not be changed, the new ones are stored as label
+    overrides before renaming it, so every process sees them as soon as the
+    rename event arrives.
+    """
+    target = make_container_name(template, name)
+    labels = {POOL_LABEL: 'False', 'com.myaas.instance': name}
+    labels.update(expiry_labels(ttl))
+
+    with state_lock(CLAIMS_LOCK):
+        overrides = get_label_overrides()
+        for container in filter(is_ready, get_pool_members(template)):
+            previous = overrides.get(container['Id'], {})
+            if previous.get(POOL_LABEL) == 'False':
+                continue  # already claimed, our inventory is not updated yet
+
+            set_label_overrides(container['Id'], labels)
+            try:
+                client.rename(container['Id'], target)
+            except docker.errors.APIError:
+                logger.exception(f'could not claim {container["Id"]} from pool')
+                clear_label_overrides(container['Id'])
+                if previous:
+                    set_label_overrides(container['Id'], previous)
+                continue
+
+            get_inventory().refresh(container['Id'])
+            record_claim(template, hit=True)
+            return True
+
+    record_claim(template, hit=False)
+    return False
+
+
+def record_claim(template, hit):
+    with locked_state(STATS_STATE) as stats:
+        counters = stats.setdefault(template, {'hits': 0, 'misses': 0})
+        counters['hits' if hit else 'misses'] += 1
+
+
+def get_pool_status():
+    stats = read_state(STATS_STATE)
+    status = {}
+    for template in set(stats) | set(list_database_templates()):
+        members = get_pool_members(template)
+        counters = stats.get(template, {})
+        status[template] = {
+            'size': pool_size(template),
+            'ready': len(list(filter(is_ready, members))),
+            'starting': len([c for c in members if not is_ready(c)]),
+            'hits': counters.get('hits', 0),
+            'misses': counters.get('misses', 0),
+        }
+    return status
+
+
+def remove_member(container):
+    backend = get_enabled_backend().Database
+    labels = container['Labels']
+    try:
+        backend(client, labels['com.myaas.template'], labels['com.myaas.instance']).remove()
+    except Exception:
+        logger.exception(f'failed to remove pool member {labels["com.myaas.instance"]}')
+
+
+def fill_pool(template, size):
+    """
+    Brings the pool of `template` to `size` members, removing the ones not
+    running or cloned from a previous import of the template.
+    """
+    backend = get_enabled_backend()
+    try:
+        template_db = backend.Template(client, template)
+    except NonExistentTemplate:
+        return
+
+    source = template_db.source_volume
+    members = []
+    for container in get_pool_members(template):
+        if not is_running(container) or container['Labels'].get(SOURCE_LABEL) != source:
+            logger.info(f'removing stale pool member {container["Labels"]["com.myaas.instance"]}')
+            remove_member(container)
+        else:
+            members.append(container)
+
+    for container in members[size:]:
+        remove_member(container)
+
+    for container in members[:size]:
+        if is_ready(container):
+            continue
+        instance = container['Labels']['com.myaas.instance']
+        try:
+            ready = backend.Database(client, template, instance).test_connection()
+        except NotReachableException:
+            ready = False
+        if ready:
+            logger.info(f'pool member {instance} is ready')
+            set_label_overrides(container['Id'], {READY_LABEL: 'True'})
+            get_inventory().refresh(container['Id'])
+
+    for _ in range(size - len(members)):
+        instance = '_pool-' + uuid.uuid4().hex[:8]
+        container_name = make_container_name(template, instance)
+        try:
+            admit(container_name)
+        except InsufficientMemory as e:
+            logger.info(f'not growing the pool of {template}: {e}')
+            return
+        logger.info(f'adding {instance} to the pool of {template}')
+        try:
+            db = template_db.clone(instance, ttl=0, labels={POOL_LABEL: 'True'})
+        except ImportInProgress:
+            release_admission(container_name)
+            return
+        except Exception:
+            release_admission(container_name)
+            raise
+        db.start()  # readiness is checked on the next rounds
+
+
+@click.command()
+def fill():
+    logging.basicConfig(
+        format='%(asctime)s %(name)s %(levelname)s: %(message)s',
+        level=logging.DEBUG if DEBUG else logging.INFO)
+
+    logger.info("Starting myaas pool filler...")
+    sighandler = SignalHandler()
+    while not sighandler.exit:
+        for template in list_database_templates():
+            try:
+                fill_pool(template, pool_size(template))
+            except Exception:
+                logger.exception(f'failed to fill the pool of {template}')
+        write_textfile('pool')
+        sleep(settings.POOL_FILL_INTERVAL)
+
+    logger.info("Stopped")
+
+
+if __name__ == '__main__':
+    fill()
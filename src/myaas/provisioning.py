@@ -0,0 +1,38 @@
+import logging
+
+from .utils.admission import admit, release_admission
+from .utils.container import client
+from .utils.database import get_enabled_backend, make_container_name
+from .pool import pool_size, claim
+
+logger = logging.getLogger(__name__)
+
+
+def provision_database(template, name, ttl, template_db=None):
+    """
+    Creates and starts database `name` from `template`, handing it out from
+    the pool when possible. `template_db` saves looking the template up when
+    creating many databases.
+
+    Raises NonExistentTemplate and ImportInProgress when the template can not
+    be used, and InsufficientMemory when the host can not hold one more
+    database.
+    """
+    backend = get_enabled_backend()
+    if pool_size(template) and claim(template, name, ttl):
+        logger.debug(f'handed out "{template}" => "{name}" from the pool')
+        return backend.Database(client, template, name)
+
+    if template_db is None:
+        template_db = backend.Template(client, template)
+    logger.debug(f'found template "{template}"')
+    container_name = make_container_name(template, name)
+    admit(container_name)
+    try:
+        db = template_db.clone(name, ttl=ttl)
+    except Exception:
+        release_admission(container_name)
+        raise
+    logger.debug(f'starting database "{template}" => "{name}"')
+    db.start()
+    return db
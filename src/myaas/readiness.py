@@ -0,0 +1,53 @@
+import logging
+from time import time
+
+from .utils.state import locked_state, read_state
+from .metrics import STEP_DURATION
+from .backends.exceptions import DBTimeoutException
+
+logger = logging.getLogger(__name__)
+
+STATS_STATE = 'readiness-stats.json'
+
+
+def wait_for_database(db, timeout=None):
+    """
+    Waits up to `timeout` seconds for `db` to accept logins, returns whether
+    it does.
+
+    When the database was not ready yet, the time it took since its
+    container was started is recorded for its template.
+    """
+    if db.is_ready():
+        return True  # already was, nothing to record
+
+    try:
+        db.wait_for_service_listening(timeout)
+    except DBTimeoutException:
+        return False
+
+    record_time_to_ready(db.template, time() - db.started_at)
+    return True
+
+
+def record_time_to_ready(template, seconds):
+    logger.debug(f'database from "{template}" ready in {seconds:.2f}s')
+    STEP_DURATION.labels(step='ready').observe(seconds)
+    with locked_state(STATS_STATE) as stats:
+        s = stats.setdefault(template, {'count': 0, 'total': 0, 'max': 0})
+        s['count'] += 1
+        s['total'] += seconds
+        s['max'] = max(s['max'], seconds)
+        s['last'] = seconds
+
+
+def get_readiness_stats():
+    return {
+        template: {
+            'count': s['count'],
+            'mean': s['total'] / s['count'],
+            'max': s['max'],
+            'last': s['last'],
+        }
+        for template, s in read_state(STATS_STATE).items()
+    }
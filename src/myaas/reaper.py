@@ -1,13 +1,25 @@
-import signal
+import heapq
 import logging
-from time import sleep
-from datetime import datetime
+import threading
+import functools
+from time import time, monotonic
+from concurrent.futures import ThreadPoolExecutor
 
 import click
 
+from . import settings
 from .settings import DEBUG
-from .utils.database import get_myaas_containers, get_enabled_backend
-from .utils.container import client
+from .utils.database import (get_myaas_containers, get_enabled_backend,
+                             is_database_container)
+from .utils.container import client, get_container_name
+from .utils.inventory import get_inventory
+from .utils.retry import RetryPolicy
+from .utils.generations import collect_generations
+from .utils.signals import SignalHandler
+from .storage import get_storage_driver
+from .backends.exceptions import NonExistentDatabase
+from .metrics import (REAPER_CYCLE_DURATION, REAPER_REMOVED, REAPER_FAILED,
+                      REAPER_IN_PROGRESS, REAPER_RECLAIMED, write_textfile)
 
 
 logging.basicConfig(
@@ -17,24 +29,6 @@ logging.basicConfig(
 logger = logging.getLogger("myaas-reaper")
 
 
-def get_container_name(container):
-    return container['Names'][0].lstrip('/')
-
-
-class SignalHandler:
-    def __init__(self):
-        self.__killed = False
-        signal.signal(signal.SIGTERM, self.stop)
-        signal.signal(signal.SIGINT, self.stop)
-
-    @property
-    def exit(self):
-        return self.__killed
-
-    def stop(self, signum, frame):
-        self.__killed = True
-
-
 class ContainerFilter(object):
     def __init__(self, expired=False, dead=False, unhealthy=False):
         self._expired = expired
@@ -48,9 +42,9 @@ class ContainerFilter(object):
             logger.info('* Filtering exited')
         if self._unhealthy:
             logger.info('* Filtering unhealthy')
-        return filter(self._is_removable, containers)
+        return filter(self.is_removable, containers)
 
-    def _is_removable(self, container):
+    def is_removable(self, container):
         name = get_container_name(container)
         if self._expired and self._is_expired(container):
             logger.info("%s is expired, queued for deletion", name)
@@ -66,14 +60,20 @@ class ContainerFilter(object):
 
         return False
 
-    def _is_expired(self, container):
+    def expires_at(self, container):
+        """
+        Timestamp when `container` is to be removed for being expired, None
+        if expired containers are not removed.
+        """
+        if not self._expired:
+            return None
         if 'com.myaas.expiresAt' in container['Labels']:
-            expiry_ts = round(float(container['Labels']['com.myaas.expiresAt']))  # noqa
-        else:
-            # asume a 24 hours TTL
-            expiry_ts = int(container['Created']) + 86400
+            return round(float(container['Labels']['com.myaas.expiresAt']))
+        # asume a 24 hours TTL
+        return int(container['Created']) + 86400
 
-        return datetime.utcnow() >= datetime.utcfromtimestamp(expiry_ts)
+    def _is_expired(self, container):
+        return time() >= self.expires_at(container)
 
     def _is_dead(self, container):
         return container['State'] == 'exited'
@@ -82,16 +82,176 @@ class ContainerFilter(object):
         return 'unhealthy' in container['Status']
 
 
+def get_volume_name(container):
+    return container['Labels'].get('com.myaas.volume', get_container_name(container))
+
+
+def is_volume_in_use(volume_name):
+    return any(get_volume_name(c) == volume_name for c in get_inventory().containers())
+
+
 def remove_database(container):
+    """
+    Removes the database of `container`, accounting the disk (when
+    REAPER_MEASURE_DISK) and memory reservation it frees.
+    """
     template = container['Labels']['com.myaas.template']
     name = container['Labels']['com.myaas.instance']
+    volume_name = get_volume_name(container)
+    storage = get_storage_driver()
+    backend = get_enabled_backend().Database
     try:
-        logger.info(f'removing {name}')
-        backend = get_enabled_backend().Database
-        backend(client, template, name).remove()
-    except Exception as e:
-        logger.exception(
-            f"Failed to remove database {template} {name}")
+        db = backend(client, template, name)
+    except NonExistentDatabase:
+        # removed by someone else, or by a previous try that failed deleting
+        # its volume, unless a new database with the same name took it
+        if not is_volume_in_use(volume_name):
+            storage.delete(volume_name)
+        return
+
+    if db.container['Id'] != container['Id']:
+        return  # removed and created again with the same name
+
+    logger.info(f'removing {name}')
+    disk = 0
+    if settings.REAPER_MEASURE_DISK and storage.exists(volume_name):
+        disk = storage.usage(volume_name)
+    memory = db.inspect()['HostConfig'].get('MemoryReservation') or 0
+    db.remove()
+
+    REAPER_REMOVED.inc()
+    REAPER_RECLAIMED.labels(resource='disk').inc(disk)
+    REAPER_RECLAIMED.labels(resource='memory').inc(memory)
+
+
+class Reaper(object):
+    """
+    Removes databases as soon as they expire, die or become unhealthy.
+
+    Expiry times are kept in a heap, updated from the changes reported by
+    the container inventory (which follows the docker events stream), so
+    the reaper sleeps until the next expiry or change instead of polling.
+
+    Removals run in a pool of `REAPER_CONCURRENCY` threads, every one retried
+    on its own, and a database is never removed twice at the same time.
+
+    Template generations no database is cloned from anymore are deleted
+    too, at most once every COLLECT_INTERVAL seconds.
+    """
+    REMOVE_TRIES = 3
+    RETRY_DELAY = 2
+    COLLECT_INTERVAL = 60
+
+    def __init__(self, container_filter, inventory):
+        self.filter = container_filter
+        self.inventory = inventory
+        self.wakeup = threading.Event()
+        self._executor = ThreadPoolExecutor(max_workers=settings.REAPER_CONCURRENCY)
+        self._removing = set()  # names queued or being removed
+        self._deadlines = {}  # name -> expiry timestamp
+        self._heap = []  # (expiry timestamp, name), may hold stale entries
+        self._changed = set()
+        self._lock = threading.Lock()
+        self._collected_at = None
+
+    def start(self):
+        self.inventory.subscribe(self.notify)
+        for container in get_myaas_containers():
+            self.notify(get_container_name(container))
+
+    def notify(self, name):
+        with self._lock:
+            self._changed.add(name)
+        self.wakeup.set()
+
+    def run_once(self):
+        # cleared before looking at the changes, so the ones notified while
+        # we process them wake up the next wait
+        self.wakeup.clear()
+        self._process_changes()
+        self._process_expired()
+        self._collect_generations()
+
+    def stop(self):
+        """
+        Waits for the removals in progress
+        """
+        self._executor.shutdown(wait=True)
+
+    def wait(self):
+        """
+        Sleeps until the next expiry or until something changes
+        """
+        timeout = max(0, self._heap[0][0] - time()) if self._heap else None
+        self.wakeup.wait(timeout)
+
+    def _process_changes(self):
+        with self._lock:
+            changed, self._changed = self._changed, set()
+
+        for name in changed:
+            container = self.inventory.get(name)
+            if not container or not is_database_container(container) or self._is_removing(name):
+                self._deadlines.pop(name, None)
+                continue
+
+            if self.filter.is_removable(container):
+                self._deadlines.pop(name, None)
+                self._remove(name, container)
+                continue
+
+            expires_at = self.filter.expires_at(container)
+            if expires_at is None:
+                self._deadlines.pop(name, None)
+            elif expires_at != self._deadlines.get(name):
+                self._deadlines[name] = expires_at
+                heapq.heappush(self._heap, (expires_at, name))
+
+    def _process_expired(self):
+        now = time()
+        while self._heap and self._heap[0][0] <= now:
+            expires_at, name = heapq.heappop(self._heap)
+            if self._deadlines.get(name) != expires_at:
+                continue  # rescheduled or already gone
+            del self._deadlines[name]
+            container = self.inventory.get(name)
+            if container and self.filter.is_removable(container):
+                self._remove(name, container)
+
+    def _collect_generations(self):
+        if self._collected_at and monotonic() - self._collected_at < self.COLLECT_INTERVAL:
+            return
+        self._collected_at = monotonic()
+        try:
+            for volume in collect_generations():
+                logger.info(f"Deleted unused template generation {volume}")
+        except Exception:
+            logger.exception("Failed to collect template generations")
+
+    def _is_removing(self, name):
+        with self._lock:
+            return name in self._removing
+
+    def _remove(self, name, container):
+        with self._lock:
+            if name in self._removing:
+                return
+            self._removing.add(name)
+        REAPER_IN_PROGRESS.inc()
+        self._executor.submit(self._remove_with_retries, name, container)
+
+    def _remove_with_retries(self, name, container):
+        retry = RetryPolicy(self.REMOVE_TRIES, delay=self.RETRY_DELAY)
+        try:
+            retry(functools.partial(remove_database, container))
+        except Exception:
+            # given up until the next inventory resync tells us about it
+            REAPER_FAILED.inc()
+            logger.exception(f"Failed to remove database {name}")
+        finally:
+            with self._lock:
+                self._removing.discard(name)
+            REAPER_IN_PROGRESS.dec()
 
 
 @click.command()
@@ -114,12 +274,17 @@ def cleanup(expired, dead, unhealthy, dry_run):
         return
 
     logger.info("Starting myaas ttl reaper...")
-    sighandler = SignalHandler()
+    reaper = Reaper(cf, get_inventory())
+    sighandler = SignalHandler(on_exit=reaper.wakeup.set)
+    reaper.start()
     while not sighandler.exit:
-        databases = cf.filter(get_myaas_containers())
-        for d in databases:
-            remove_database(d)
-        sleep(1)
+        start = monotonic()
+        reaper.run_once()
+        REAPER_CYCLE_DURATION.observe(monotonic() - start)
+        write_textfile('reaper')
+        reaper.wait()
+
+    reaper.stop()
 
     logger.info("Stopped")
 
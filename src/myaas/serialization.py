@@ -0,0 +1,44 @@
+"""
+Representation of databases in the responses of both servers.
+"""
+from .settings import HOSTNAME
+
+
+def describe_database(db, info, ready=None):
+    """
+    Details of a database, `info` is the inspect output of its container
+    """
+    result = dict(
+        database=db.database,
+        host=HOSTNAME,
+        name=db.name,
+        port=db.get_host_port(info),
+        user=db.user,
+        password=db.password,
+        running=info['State']['Running'],
+        status=db.container['Status'],
+        created=db.container['Created'],
+    )
+
+    if 'com.myaas.expiresAt' in db.container['Labels']:
+        result.update({'expires_at': db.container['Labels']['com.myaas.expiresAt']})
+
+    if ready is not None:
+        result.update({'ready': ready})
+
+    return result
+
+
+def describe_bulk_results(results):
+    """
+    Response of a bulk request, from the results of `bulk.create_databases`
+    or `bulk.remove_databases`
+    """
+    databases = []
+    for result in results:
+        db, info = result.pop('db', None), result.pop('info', None)
+        if db:
+            result['database'] = describe_database(db, info)
+        databases.append(result)
+    failed = [r for r in databases if r['status'] >= 400]
+    return dict(databases=databases, failed=len(failed))
@@ -1,14 +1,25 @@
 import logging
 import os
 
-from flask import Flask, Response, request, jsonify, abort
+from flask import Flask, Response, request, jsonify, abort, url_for, g
+from prometheus_client import CONTENT_TYPE_LATEST
 
-from .settings import HOSTNAME, DEBUG, CONTAINER_TTL
+from .settings import (DEBUG, CONTAINER_TTL, ADMISSION_RETRY_AFTER,
+                       DOCKER_CIRCUIT_RESET)
 from .utils.container import client
-from .utils.database import (get_myaas_containers, get_enabled_backend,
-                             list_databases, list_database_templates)
+from .utils.database import get_enabled_backend
 from .backends.exceptions import (NonExistentDatabase, NonExistentTemplate,
-                                  ImportInProgress)
+                                  ImportInProgress, InsufficientMemory,
+                                  DockerUnavailable)
+from .listing import (list_database_page, get_status, get_templates,
+                      cached_listing, InvalidCursor)
+from .pool import get_pool_status
+from .provisioning import provision_database
+from .serialization import describe_database, describe_bulk_results
+from .bulk import get_bulk_names, create_databases, remove_databases, InvalidBulkRequest
+from .jobs import submit_job, wait_for_job
+from .readiness import wait_for_database, get_readiness_stats
+from .metrics import render_metrics, start_call_counter
 
 app = Flask(__name__)
 
@@ -18,34 +29,71 @@ logger.basicConfig(
     level=logging.DEBUG if DEBUG else logging.WARNING)
 
 
+@app.before_request
+def count_docker_calls():
+    g.docker_calls = start_call_counter()
+
+
+@app.after_request
+def add_docker_calls_header(response):
+    if 'docker_calls' in g:
+        response.headers['X-Docker-Calls'] = str(g.docker_calls.calls)
+    return response
+
+
+def listing_response(key, build):
+    """
+    Responds with a cached listing, or 304 if the client has it already
+    """
+    etag, body = cached_listing(key, build)
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    return response.make_conditional(request)
+
+
 @app.route('/', methods=['get'])
 def hello_world():
-    return jsonify(
-        status="Service is running",
-        templates=list_database_templates(),
-        databases=list_databases())
+    return listing_response(('status',), get_status)
 
 
 @app.route('/db', methods=['get'])
 def show_databases():
-    databases = []
-    for c in get_myaas_containers():
-        db = {
-            'template': c['Labels']['com.myaas.template'],
-            'name': c['Labels']['com.myaas.instance'],
-            'state': c['Status'],
-            'created': c['Created'],
-        }
-        if 'com.myaas.expiresAt' in c['Labels']:
-            db.update({'expires_at': c['Labels']['com.myaas.expiresAt']})
-        databases.append(db)
+    template = request.args.get('template')
+    state = request.args.get('state')
+    limit = request.args.get('limit', type=int)
+    cursor = request.args.get('cursor')
+    if limit is not None and limit <= 0:
+        response = jsonify(status="limit must be a positive number")
+        response.status_code = 400
+        return response
 
-    return jsonify(databases=databases)
+    try:
+        return listing_response(('db', template, state, limit, cursor),
+                                lambda: list_database_page(template, state, limit, cursor))
+    except InvalidCursor:
+        response = jsonify(status=f'Invalid cursor "{cursor}".')
+        response.status_code = 400
+        return response
 
 
 @app.route('/templates', methods=['get'])
 def show_templates():
-    return jsonify(templates=list_database_templates())
+    return listing_response(('templates',), get_templates)
+
+
+@app.route('/pool', methods=['get'])
+def show_pool():
+    return jsonify(pool=get_pool_status())
+
+
+@app.route('/readiness', methods=['get'])
+def show_readiness():
+    return jsonify(readiness=get_readiness_stats())
+
+
+@app.route('/metrics', methods=['get'])
+def show_metrics():
+    return Response(render_metrics(), content_type=CONTENT_TYPE_LATEST)
 
 
 @app.route('/db/<template>/<name>', methods=['get'])
@@ -58,25 +106,53 @@ def inspect_database(template, name):
         logger.debug(f'database not found "{template}" => "{name}"')
         abort(404)
 
+    # optionally block until the database accepts logins, invalid or not
+    # positive values are ignored
+    wait = request.args.get('wait', type=float)
+    ready = wait_for_database(db, min(wait, db.WAIT_TIMEOUT)) if wait and wait > 0 else None
+
+    info = db.inspect()
     if request.args.get('all'):
-        return jsonify(container=db.inspect())
-
-    result = dict(
-        database=db.database,
-        host=HOSTNAME,
-        name=db.name,
-        port=db.host_port,
-        user=db.user,
-        password=db.password,
-        running=db.running(),
-        status=db.container['Status'],
-        created=db.container['Created'],
-    )
-
-    if 'com.myaas.expiresAt' in db.container['Labels']:
-        result.update({'expires_at': db.container['Labels']['com.myaas.expiresAt']})
+        return jsonify(container=info)
 
-    return jsonify(result)
+    return jsonify(describe_database(db, info, ready))
+
+
+@app.route('/db/<template>/_bulk', methods=['post'])
+def create_databases_bulk(template):
+    data = request.get_json(silent=True)
+    try:
+        names = get_bulk_names(data, template)
+    except InvalidBulkRequest as e:
+        response = jsonify(status=str(e))
+        response.status_code = 400
+        return response
+    ttl = data.get('ttl')
+    ttl = int(ttl) if ttl else CONTAINER_TTL
+    logger.debug(f'requested create {len(names)} DBs from "{template}"')
+
+    try:
+        results = create_databases(template, names, ttl)
+    except NonExistentTemplate:
+        logger.error(f'requested template "{template}" not found')
+        response = jsonify(status=f'Template "{template}" does not exist.')
+        response.status_code = 404
+        return response
+
+    return jsonify(describe_bulk_results(results))
+
+
+@app.route('/db/<template>/_bulk', methods=['delete'])
+def remove_databases_bulk(template):
+    try:
+        names = get_bulk_names(request.get_json(silent=True), template, existing=True)
+    except InvalidBulkRequest as e:
+        response = jsonify(status=str(e))
+        response.status_code = 400
+        return response
+    logger.debug(f'requested delete {len(names)} DBs of "{template}"')
+
+    return jsonify(describe_bulk_results(remove_databases(template, names)))
 
 
 @app.route('/db/<template>/<name>', methods=['post'])
@@ -97,13 +173,11 @@ def create_database(template, name):
     except NonExistentDatabase:
         pass
 
-    template_class = get_enabled_backend().Template
+    if request.args.get('async'):
+        return create_database_async(template, name, ttl)
+
     try:
-        template_db = template_class(client, template)
-        logger.debug(f'found template "{template}"')
-        db = template_db.clone(name, ttl=ttl)
-        logger.debug(f'starting database "{template}" => "{name}"')
-        db.start()
+        provision_database(template, name, ttl)
     except ImportInProgress:
         logger.error(f'requested template "{template}" not available, import in progress')
         response = jsonify(status="Database not available, content is being imported.")
@@ -114,12 +188,49 @@ def create_database(template, name):
         response = jsonify(status=f'Template "{template}" does not exist.')
         response.status_code = 404
         return response
+    except InsufficientMemory as e:
+        logger.warning(f'not enough memory to create "{template}" => "{name}": {e}')
+        response = jsonify(status=f'Not enough memory for a new database: {e}.')
+        response.status_code = 503
+        response.headers['Retry-After'] = str(ADMISSION_RETRY_AFTER)
+        return response
 
     response = inspect_database(template, name)
     response.status_code = 201
     return response
 
 
+def create_database_async(template, name, ttl):
+    try:
+        get_enabled_backend().Template(client, template)
+    except NonExistentTemplate:
+        logger.error(f'requested template "{template}" not found')
+        response = jsonify(status=f'Template "{template}" does not exist.')
+        response.status_code = 404
+        return response
+
+    job = submit_job(template, name, ttl)
+    logger.debug(f'queued job {job["id"]} to create "{template}" => "{name}"')
+    url = url_for('show_job', job_id=job['id'])
+    response = jsonify(job=job, url=url)
+    response.status_code = 202
+    response.headers['Location'] = url
+    return response
+
+
+@app.route('/jobs/<job_id>', methods=['get'])
+def show_job(job_id):
+    wait = request.args.get('wait', type=float, default=0)
+    job = wait_for_job(job_id, wait)
+    if not job:
+        abort(404)
+
+    result = dict(job=job)
+    if job['status'] == 'done':
+        result['database'] = url_for('inspect_database', template=job['template'], name=job['name'])
+    return jsonify(result)
+
+
 @app.route('/db/<template>/<name>', methods=['delete'])
 def remove_database(template, name):
     logger.debug(f'requested delete DB "{template}" => "{name}"')
@@ -137,6 +248,15 @@ def remove_database(template, name):
     return response
 
 
+@app.errorhandler(DockerUnavailable)
+def docker_unavailable(e):
+    logger.error(f'docker unavailable: {e}')
+    response = jsonify(status=f'Docker is not available: {e}.')
+    response.status_code = 503
+    response.headers['Retry-After'] = str(DOCKER_CIRCUIT_RESET)
+    return response
+
+
 @app.errorhandler(404)
 def page_not_found(e):
     response = jsonify(status="Not found")
@@ -1,10 +1,34 @@
 from decouple import config
 
+
+def template_map(value):
+    """
+    Parses per template settings, like `template1:4,template2:8`
+    """
+    items = (item.split(':') for item in value.split(',') if item)
+    return {template.strip(): int(number) for template, number in items}
+
+
+def method_map(value):
+    """
+    Parses per docker client method seconds, like `containers:10,inspect_container:2.5`
+    """
+    items = (item.split(':') for item in value.split(',') if item)
+    return {method.strip(): float(seconds) for method, seconds in items}
+
+
 # Backend to enable, valid choices are:
 # "myaas.backends.mysql"
 # "myaas.backends.postgres"
 BACKEND = config("MYAAS_BACKEND", default="myaas.backends.mysql")
 
+# Storage driver for the datadirs of templates and databases, valid choices:
+# "myaas.storage.btrfs": btrfs subvolumes and snapshots
+# "myaas.storage.reflink": per file reflinks (XFS with reflink=1, btrfs)
+# "myaas.storage.overlay": overlayfs mounts on top of the template
+# "myaas.storage.copy": full copies, for tests only
+STORAGE_DRIVER = config("MYAAS_STORAGE_DRIVER", default="myaas.storage.btrfs")
+
 
 # Controls the debug mode of the application
 DEBUG = config('MYAAS_DEBUG', default=False, cast=bool)
@@ -15,10 +39,34 @@ DOCKER_HOST = config('MYAAS_DOCKER_HOST',
                      default=config('DOCKER_HOST',
                                     default="unix://var/run/docker.sock"))
 
+# Seconds docker API calls can take, and per method overrides, eg:
+# `containers:10,inspect_container:10`
+DOCKER_TIMEOUT = config('MYAAS_DOCKER_TIMEOUT', cast=int, default=60)
+DOCKER_TIMEOUTS = config('MYAAS_DOCKER_TIMEOUTS', cast=method_map,
+                         default='containers:15,inspect_container:15')
+# Docker API calls made at the same time by each process (every gunicorn
+# worker has its own limit), and seconds a call waits for its turn before
+# failing
+DOCKER_MAX_CONCURRENCY = config('MYAAS_DOCKER_MAX_CONCURRENCY', cast=int, default=16)
+DOCKER_QUEUE_TIMEOUT = config('MYAAS_DOCKER_QUEUE_TIMEOUT', cast=int, default=30)
+# After this many calls in a row time out or can not connect, calls fail
+# right away for DOCKER_CIRCUIT_RESET seconds
+DOCKER_FAILURE_THRESHOLD = config('MYAAS_DOCKER_FAILURE_THRESHOLD', cast=int, default=5)
+DOCKER_CIRCUIT_RESET = config('MYAAS_DOCKER_CIRCUIT_RESET', cast=int, default=30)
+
+# Seconds between full resyncs of the in-memory container inventory, changes
+# are followed from the docker events stream, this is only a safety net
+INVENTORY_RESYNC_INTERVAL = config('MYAAS_INVENTORY_RESYNC_INTERVAL', cast=int, default=60)
+
 # All containers created by this service will have this prefix in their name
 CONTAINER_PREFIX = config('MYAAS_PREFIX', default='myaas-')
 # Default time that a container stays up, in seconds.
 CONTAINER_TTL = config('MYAAS_CONTAINER_TTL', cast=int, default=86400)
+# Databases removed at the same time by the reaper
+REAPER_CONCURRENCY = config('MYAAS_REAPER_CONCURRENCY', cast=int, default=4)
+# Measure the disk used by every database removed (myaas_reaper_reclaimed_bytes_total),
+# it walks the whole volume with most storage drivers
+REAPER_MEASURE_DISK = config('MYAAS_REAPER_MEASURE_DISK', cast=bool, default=False)
 
 # Default docker imgage for the mysql backend
 # Currently tested with:
@@ -28,6 +76,10 @@ CONTAINER_TTL = config('MYAAS_CONTAINER_TTL', cast=int, default=86400)
 MYSQL_IMAGE = config("MYAAS_MYSQL_IMAGE", default="habitissimo/myaas-mysql:10.1.23")
 POSTGRES_IMAGE = config("MYAAS_POSTGRES_IMAGE", default="postgres:9.4")
 
+# Record the pages in memory of every template once imported, and load them
+# when its databases start (InnoDB buffer pool dump, pg_prewarm autoprewarm)
+WARM_START = config('MYAAS_WARM_START', cast=bool, default=True)
+
 DB_DATABASE = config("MYAAS_DB_DATABASE", default='default')
 DB_USERNAME = config("MYAAS_DB_USERNAME", default='myaas')
 DB_PASSWORD = config("MYAAS_DB_PASSWORD", default='myaas')
@@ -47,18 +99,83 @@ POSTGRES_ENVIRONMENT = {
 }
 
 
+# Host ports handed out to containers, as `first-last`
+PORT_RANGE = config('MYAAS_PORT_RANGE', default='20000-29999')
+
 # Memory limit to apply to every container (with docker syntax, eg: `2g`)
 MEMORY_LIMIT = config('MYAAS_MEMORY_LIMIT', default='2g')
+# Hard memory limit of every container, MEMORY_LIMIT is only reserved
+MEMORY_HARD_LIMIT = config('MYAAS_MEMORY_HARD_LIMIT', default='11g')
+# New databases are admitted while the memory reserved by all of them stays
+# below the host memory times this ratio (and the host has it available)
+MEMORY_OVERCOMMIT = config('MYAAS_MEMORY_OVERCOMMIT', cast=float, default=1.0)
+# Seconds clients are told to wait when a database is not admitted
+ADMISSION_RETRY_AFTER = config('MYAAS_ADMISSION_RETRY_AFTER', cast=int, default=30)
+# Seconds an `?async=1` creation waits queued for memory before failing
+ADMISSION_QUEUE_TIMEOUT = config('MYAAS_ADMISSION_QUEUE_TIMEOUT', cast=int, default=300)
 # How many CPUs to assign to every container
 CPU_PINNING_INSTANCE_CORES = config("MYAAS_CPU_PINNING_CORES", cast=int, default=2)
 
 # Internal settings
 HOSTNAME = config('MYAAS_HOSTNAME', default='localhost')
 BASE_DIR = config('MYAAS_BASE_DIR', default='/myaas')
+# Host directory mounted as BASE_DIR, found inspecting the myaas container
+# when not set
+HOST_BASE_DIR = config('MYAAS_HOST_BASE_DIR', default='')
 
 DATA_DIR = BASE_DIR + "/data"
 DUMP_DIR = BASE_DIR + "/dumps"
+# State shared between the server workers, the reaper and the updater
+STATE_DIR = BASE_DIR + "/state"
+# Metrics of the updater, the reaper and the pool daemon, exposed by the
+# server at /metrics
+METRICS_DIR = BASE_DIR + "/metrics"
+
+# Max templates imported at the same time by the updater, further bounded
+# by the available cores (CPU_PINNING_INSTANCE_CORES for every template) and
+# the memory budget (MEMORY_LIMIT for every template)
+UPDATE_CONCURRENCY = config('MYAAS_UPDATE_CONCURRENCY', cast=int, default=4)
+# Memory the updater can reserve for templates being imported (with docker
+# syntax, eg: `16g`), half of the host memory by default
+UPDATE_MEMORY_BUDGET = config('MYAAS_UPDATE_MEMORY_BUDGET', default='')
+
+# Connections used to import every mysql template, with more than one the
+# dump is split at table boundaries and tables are loaded in parallel
+MYSQL_IMPORT_THREADS = config('MYAAS_MYSQL_IMPORT_THREADS', cast=int, default=1)
+# Per template import connections, overriding MYSQL_IMPORT_THREADS, eg: `big:8`
+MYSQL_IMPORT_THREADS_PER_TEMPLATE = config('MYAAS_MYSQL_IMPORT_THREADS_PER_TEMPLATE',
+                                           cast=template_map, default='')
+# Max table data decompressed to disk waiting to be loaded when importing
+# compressed dumps in parallel (with docker syntax, eg: `2g`)
+MYSQL_IMPORT_SPOOL_SIZE = config('MYAAS_MYSQL_IMPORT_SPOOL_SIZE', default='2g')
 
 SENTRY_DSN = config('SENTRY_DSN', cast=str, default='')
 
 CPU_MAP = config('MYAAS_CPU_MAP', default=None)
+# Weight of recent core usage when placing containers, 0 places them only by
+# the number of containers pinned to every core, 1 counts a fully busy core
+# as one more container
+CPU_LOAD_WEIGHT = config('MYAAS_CPU_LOAD_WEIGHT', cast=float, default=0)
+
+# Started databases kept ready to be handed out for every template, filled by
+# the pool daemon (`python -m myaas.pool`), 0 disables the pool
+POOL_SIZE = config('MYAAS_POOL_SIZE', cast=int, default=0)
+# Per template pool sizes, overriding POOL_SIZE, eg: `big:0,small:4`
+POOL_SIZES = config('MYAAS_POOL_SIZES', cast=template_map, default='')
+# Seconds between checks of the pool daemon
+POOL_FILL_INTERVAL = config('MYAAS_POOL_FILL_INTERVAL', cast=int, default=10)
+
+# Databases created at the same time by every server worker for requests
+# made with `?async=1`
+PROVISIONING_CONCURRENCY = config('MYAAS_PROVISIONING_CONCURRENCY', cast=int, default=2)
+# Databases created or removed at the same time by a bulk request
+# (`/db/<template>/_bulk`), and max databases a single request can ask for
+BULK_CONCURRENCY = config('MYAAS_BULK_CONCURRENCY', cast=int, default=8)
+BULK_MAX_SIZE = config('MYAAS_BULK_MAX_SIZE', cast=int, default=100)
+# Threads of the asyncio server (`python -m myaas.aioserver`) running the
+# blocking work: provisioning, removals and readiness checks
+ASYNC_SERVER_THREADS = config('MYAAS_ASYNC_SERVER_THREADS', cast=int, default=32)
+# Seconds a finished provisioning job is kept
+JOB_RETENTION = config('MYAAS_JOB_RETENTION', cast=int, default=3600)
+# Max seconds a request can wait for a job to finish
+JOB_MAX_WAIT = config('MYAAS_JOB_MAX_WAIT', cast=int, default=60)
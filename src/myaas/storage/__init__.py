@@ -0,0 +1,11 @@
+import importlib
+
+from .. import settings
+
+
+def get_storage_driver():
+    """
+    Returns an instance of the storage driver enabled in settings, managing
+    the volumes in `settings.DATA_DIR`.
+    """
+    return importlib.import_module(settings.STORAGE_DRIVER).Driver(settings.DATA_DIR)
@@ -0,0 +1,126 @@
+import os
+import shutil
+import stat
+
+from abc import ABCMeta, abstractmethod
+
+from .exceptions import VolumeNotFound, VolumeAlreadyExists
+
+
+class StorageDriver(metaclass=ABCMeta):
+    """
+    Manages the volumes holding the datadirs of templates and databases.
+
+    Volumes are identified by name and live as directories in `root`, so the
+    container bindings do not depend on the driver in use.
+    """
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def exists(self, name):
+        return os.path.isdir(self.path(name))
+
+    @abstractmethod
+    def create(self, name):
+        """Creates an empty volume"""
+        pass
+
+    @abstractmethod
+    def snapshot(self, source, target):
+        """Creates `target` volume as a copy on write clone of `source`"""
+        pass
+
+    @abstractmethod
+    def delete(self, name):
+        """Deletes a volume, does nothing if it does not exist"""
+        pass
+
+    @abstractmethod
+    def list(self):
+        """Returns the name of every volume"""
+        pass
+
+    @abstractmethod
+    def usage(self, name):
+        """Returns the bytes of disk used by a volume"""
+        pass
+
+
+class DirectoryDriver(StorageDriver):
+    """
+    Base for drivers storing every volume as a plain directory in `root`,
+    snapshots are taken copying the source tree file by file with
+    `clone_file`.
+    """
+    def create(self, name):
+        if self.exists(name):
+            raise VolumeAlreadyExists(name)
+        os.makedirs(self.path(name))
+
+    def snapshot(self, source, target):
+        if not self.exists(source):
+            raise VolumeNotFound(source)
+        if self.exists(target):
+            raise VolumeAlreadyExists(target)
+
+        try:
+            self._copy_tree(self.path(source), self.path(target))
+        except Exception:
+            shutil.rmtree(self.path(target), ignore_errors=True)
+            raise
+
+    def delete(self, name):
+        shutil.rmtree(self.path(name), ignore_errors=True)
+
+    def list(self):
+        return [entry.name for entry in os.scandir(self.root)
+                if entry.is_dir(follow_symlinks=False)
+                and not entry.name.startswith('.')]
+
+    def usage(self, name):
+        return disk_usage(self.path(name))
+
+    @abstractmethod
+    def clone_file(self, source, target):
+        pass
+
+    def _copy_tree(self, source, target):
+        os.mkdir(target)
+        for entry in os.scandir(source):
+            src = entry.path
+            dst = os.path.join(target, entry.name)
+            if entry.is_symlink():
+                os.symlink(os.readlink(src), dst)
+            elif entry.is_dir():
+                self._copy_tree(src, dst)
+                continue
+            elif entry.is_file():
+                self.clone_file(src, dst)
+            else:
+                continue  # sockets, fifos, devices: nothing worth copying
+            copy_metadata(src, dst)
+        copy_metadata(source, target)
+
+
+def copy_metadata(source, target):
+    # the datadirs belong to the user running the database inside the
+    # container, ownership must be preserved along with permissions
+    st = os.lstat(source)
+    os.lchown(target, st.st_uid, st.st_gid)
+    if not stat.S_ISLNK(st.st_mode):
+        shutil.copystat(source, target)
+
+
+def disk_usage(path):
+    """
+    Returns the bytes allocated by the files in `path`, extents shared with
+    other files are counted in full.
+    """
+    total = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for name in dirnames + filenames:
+            total += os.lstat(os.path.join(dirpath, name)).st_blocks * 512
+    return total
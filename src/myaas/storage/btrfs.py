@@ -0,0 +1,56 @@
+import sh
+
+from ..utils.btrfs import FileSystem
+from .base import StorageDriver
+from .exceptions import VolumeNotFound, VolumeAlreadyExists
+
+
+def parse_filesystem_du(output):
+    # header line followed by: total, exclusive, set shared, filename
+    components = output.splitlines()[-1].split()
+    return {
+        'total': int(components[0]),
+        'exclusive': int(components[1]),
+    }
+
+
+class Driver(StorageDriver):
+    """
+    Every volume is a btrfs subvolume and snapshots are btrfs snapshots,
+    `root` must be the top level of a btrfs filesystem.
+    """
+    def __init__(self, root):
+        super().__init__(root)
+        self.fs = FileSystem(root)
+
+    def exists(self, name):
+        return self.fs.find_subvolume_by_name(name) is not None
+
+    def create(self, name):
+        if self.exists(name):
+            raise VolumeAlreadyExists(name)
+        self.fs.make_subvolume(name)
+
+    def snapshot(self, source, target):
+        subvolume = self.fs.find_subvolume_by_name(source)
+        if not subvolume:
+            raise VolumeNotFound(source)
+        if self.exists(target):
+            raise VolumeAlreadyExists(target)
+        subvolume.take_snapshot(target)
+
+    def delete(self, name):
+        subvolume = self.fs.find_subvolume_by_name(name)
+        if subvolume:
+            subvolume.delete()
+
+    def list(self):
+        return [s.name for s in self.fs.subvolumes if '/' not in s.name]
+
+    def usage(self, name):
+        """
+        Returns the bytes exclusively used by the subvolume, the ones shared
+        with its template are not counted.
+        """
+        result = sh.btrfs.filesystem.du('-s', '--raw', self.path(name))
+        return parse_filesystem_du(result.stdout.decode('utf-8'))['exclusive']
@@ -0,0 +1,14 @@
+import shutil
+
+from .base import DirectoryDriver
+
+
+class Driver(DirectoryDriver):
+    """
+    Volumes are plain directories and snapshots are full copies.
+
+    Slow and space hungry, but works on any filesystem, meant for tests and
+    development machines.
+    """
+    def clone_file(self, source, target):
+        shutil.copyfile(source, target)
@@ -0,0 +1,10 @@
+class StorageError(Exception):
+    pass
+
+
+class VolumeNotFound(StorageError):
+    pass
+
+
+class VolumeAlreadyExists(StorageError):
+    pass
@@ -0,0 +1,164 @@
+import os
+import json
+import shutil
+import uuid
+
+import sh
+
+from .base import DirectoryDriver, disk_usage
+from .exceptions import StorageError, VolumeNotFound, VolumeAlreadyExists
+
+
+class Driver(DirectoryDriver):
+    """
+    Volumes created from scratch are plain directories, snapshots are
+    overlayfs mounts using the source as lower layer, so only the files
+    modified by the clone take space.
+
+    The layers of every overlay are kept in `root/.overlay/<name>`. When a
+    volume being used as a lower layer by others is deleted its data is
+    moved to `root/.overlay/.orphans` and kept until nobody references it.
+
+    Overlay mounts do not survive a reboot, volumes found unmounted are
+    mounted again when checked with `exists` (as done before starting a
+    container or snapshotting it), `mount_all` mounts all of them.
+
+    When myaas runs in a container the volume with `root` has to be bind
+    mounted with shared propagation for the mounts to be visible to the
+    database containers.
+    """
+    def __init__(self, root):
+        super().__init__(root)
+        self.meta_dir = os.path.join(root, '.overlay')
+        self.orphans_dir = os.path.join(self.meta_dir, '.orphans')
+
+    def exists(self, name):
+        if not super().exists(name):
+            return False
+        if self._is_overlay(name) and not os.path.ismount(self.path(name)):
+            self._remount(name)
+        return True
+
+    def snapshot(self, source, target):
+        if not self.exists(source):
+            raise VolumeNotFound(source)
+        if self.exists(target):
+            raise VolumeAlreadyExists(target)
+
+        if self._is_overlay(source):
+            lowers = [self._upper_dir(source)] + self._read_lowers(source)
+        else:
+            lowers = [self.path(source)]
+
+        os.makedirs(self._upper_dir(target))
+        os.makedirs(self._work_dir(target))
+        self._write_lowers(target, lowers)
+        os.makedirs(self.path(target))
+        try:
+            self._mount(target)
+        except Exception:
+            os.rmdir(self.path(target))
+            shutil.rmtree(self._layer_dir(target))
+            raise
+
+    def delete(self, name):
+        if not super().exists(name):
+            return
+
+        if self._is_overlay(name):
+            if os.path.ismount(self.path(name)):
+                sh.umount(self.path(name))
+            os.rmdir(self.path(name))
+            self._release(self._upper_dir(name))
+            shutil.rmtree(self._layer_dir(name))
+        else:
+            self._release(self.path(name))
+            shutil.rmtree(self.path(name), ignore_errors=True)
+
+        self._collect_orphans()
+
+    def usage(self, name):
+        if self._is_overlay(name):
+            return disk_usage(self._upper_dir(name))
+        return super().usage(name)
+
+    def mount_all(self):
+        for name in self.list():
+            self.exists(name)
+
+    def clone_file(self, source, target):
+        raise StorageError("overlay volumes are not copied")
+
+    def _mount(self, name):
+        options = "lowerdir={},upperdir={},workdir={}".format(
+            ':'.join(self._read_lowers(name)),
+            self._upper_dir(name),
+            self._work_dir(name))
+        try:
+            sh.mount('-t', 'overlay', 'overlay', '-o', options, self.path(name))
+        except sh.ErrorReturnCode as e:
+            raise StorageError(e.stderr.decode('utf-8'))
+
+    def _remount(self, name):
+        try:
+            self._mount(name)
+        except StorageError:
+            # another process may have just mounted it
+            if not os.path.ismount(self.path(name)):
+                raise
+
+    def _release(self, layer):
+        """
+        Moves `layer` away if other overlays are still using it
+        """
+        users = [n for n in self._overlays() if layer in self._read_lowers(n)]
+        if not users:
+            return
+
+        os.makedirs(self.orphans_dir, exist_ok=True)
+        orphan = os.path.join(self.orphans_dir, uuid.uuid4().hex)
+        # mounted overlays keep working after the rename, the new location
+        # is only needed to mount them again
+        os.rename(layer, orphan)
+        for name in users:
+            lowers = self._read_lowers(name)
+            self._write_lowers(name, [orphan if l == layer else l for l in lowers])
+
+    def _collect_orphans(self):
+        if not os.path.isdir(self.orphans_dir):
+            return
+
+        in_use = set()
+        for name in self._overlays():
+            in_use.update(self._read_lowers(name))
+        for entry in os.scandir(self.orphans_dir):
+            if entry.path not in in_use:
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+    def _overlays(self):
+        if not os.path.isdir(self.meta_dir):
+            return []
+        return [e.name for e in os.scandir(self.meta_dir)
+                if not e.name.startswith('.')]
+
+    def _is_overlay(self, name):
+        return os.path.isdir(self._layer_dir(name))
+
+    def _layer_dir(self, name):
+        return os.path.join(self.meta_dir, name)
+
+    def _upper_dir(self, name):
+        return os.path.join(self._layer_dir(name), 'upper')
+
+    def _work_dir(self, name):
+        return os.path.join(self._layer_dir(name), 'work')
+
+    def _read_lowers(self, name):
+        with open(os.path.join(self._layer_dir(name), 'lowers.json')) as f:
+            return json.load(f)
+
+    def _write_lowers(self, name, lowers):
+        path = os.path.join(self._layer_dir(name), 'lowers.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(lowers, f)
+        os.rename(path + '.tmp', path)
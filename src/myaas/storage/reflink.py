@@ -0,0 +1,23 @@
+import fcntl
+
+from .base import DirectoryDriver
+from .exceptions import StorageError
+
+# ioctl to share the extents of a file with another one, from linux/fs.h
+FICLONE = 0x40049409
+
+
+class Driver(DirectoryDriver):
+    """
+    Volumes are plain directories and snapshots copy every file as a reflink,
+    sharing its extents with the source until any of them is modified.
+
+    Requires a filesystem supporting `FICLONE`, like XFS (formatted with
+    `reflink=1`) or btrfs.
+    """
+    def clone_file(self, source, target):
+        with open(source, 'rb') as src, open(target, 'wb') as dst:
+            try:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            except OSError as e:
+                raise StorageError(f"Could not reflink {source}: {e.strerror}")
@@ -1,8 +1,13 @@
 import os
 import sys
+import hashlib
 import traceback
 import functools
+from time import time, monotonic
+from multiprocessing import cpu_count
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
+import click
 from docker.errors import NotFound as ImageNotFound
 from sentry_sdk import init, capture_message, configure_scope
 
@@ -10,13 +15,37 @@ from . import settings
 from .utils.container import client
 from .utils.database import get_enabled_backend
 from .utils.filesystem import is_empty
+from .utils.memory import parse_size, format_size, host_memory
+from .utils.dumps import is_dump_file, get_template_name
 from .utils.retry import RetryPolicy
-from .backends.exceptions import NonExistentTemplate, ImportDataError
+from .utils.state import read_state, locked_state
+from .utils.generations import (get_current_generation, publish_generation,
+                                collect_generations)
+from .storage import get_storage_driver
+from .metrics import IMPORT_BYTES, IMPORT_THROUGHPUT, write_textfile
+from .backends.exceptions import NonExistentTemplate, ImportDataError, WarmStartError
+
+# dumps imported by previous runs, keyed by template
+MANIFEST_STATE = 'update-manifest.json'
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class MissingImage(Exception):
+    pass
+
+
+class ImportFailed(Exception):
+    pass
 
 
 def list_dump_files():
-    files_in_dir = os.listdir(settings.DUMP_DIR)
-    return filter(lambda x: x.endswith('.sql'), files_in_dir)
+    dumps = {}
+    # the same template could be there compressed and uncompressed, keep the
+    # most recent one
+    for entry in sorted(os.scandir(settings.DUMP_DIR), key=lambda e: e.stat().st_mtime):
+        if entry.is_file() and is_dump_file(entry.name):
+            dumps[get_template_name(entry.name)] = entry.name
+    return list(dumps.values())
 
 
 def indent(string, level=1):
@@ -24,16 +53,90 @@ def indent(string, level=1):
     return spacing + string
 
 
-def remove_recreate_database(template):
+def report(db_name, string, level=1, file=sys.stdout):
+    # several templates are imported at once, tag every line with its own
+    print(f"[{db_name}] " + indent(string, level), file=file)
+
+
+def import_concurrency():
+    """
+    Templates that can be imported at the same time within the cpu and
+    memory budget, every template database takes CPU_PINNING_INSTANCE_CORES
+    cores and reserves MEMORY_LIMIT.
+    """
+    cores = settings.CPU_PINNING_INSTANCE_CORES or 1
+    by_cpu = cpu_count() // cores
+
+    budget = settings.UPDATE_MEMORY_BUDGET
+    budget = parse_size(budget) if budget else host_memory() // 2
+    by_memory = budget // parse_size(settings.MEMORY_LIMIT)
+
+    return max(1, min(settings.UPDATE_CONCURRENCY, by_cpu, by_memory))
+
+
+def file_digest(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def dump_fingerprint(path, previous=None):
+    """
+    Returns the size, mtime and sha256 of a dump file. The hash in the
+    `previous` fingerprint is reused when size and mtime did not change, so
+    unchanged dumps are not read.
+    """
+    stat = os.stat(path)
+    fingerprint = {'size': stat.st_size, 'mtime': stat.st_mtime}
+    if previous and all(previous.get(k) == v for k, v in fingerprint.items()):
+        fingerprint['sha256'] = previous['sha256']
+    else:
+        fingerprint['sha256'] = file_digest(path)
+    return fingerprint
+
+
+def is_up_to_date(template, dump, fingerprint, entry):
+    """
+    Tells if `template` was imported from this very dump by a previous run
+    and still exists.
+    """
+    if not entry or entry['dump'] != dump or entry['sha256'] != fingerprint['sha256']:
+        return False
+    try:
+        get_enabled_backend().Template(client, template, False)
+    except NonExistentTemplate:
+        return False
+    return True
+
+
+def record_import(template, dump, fingerprint):
+    with locked_state(MANIFEST_STATE) as manifest:
+        manifest[template] = dict(fingerprint, dump=dump, template=template,
+                                  imported_at=time())
+
+
+def prepare_template_database(template):
     """
-    find existing database, remove it, then recreate
+    Returns the template database stopped and with an empty datadir to
+    import into, creating it (or recreating it when its image changed) if
+    needed. Databases keep being cloned from its current generation.
     """
     backend = get_enabled_backend().Template
     try:
         db = backend(client, template, False)
         if db.running():
             db.stop()
-        db.do_backup()
+        storage = get_storage_driver()
+        if get_current_generation(template) is None and storage.exists(db.volume_name):
+            # imported before generations existed (failed first imports
+            # delete their datadir), databases are cloned from it, keep it as
+            # the current generation
+            publish_generation(template, db.volume_name)
+        if db.inspect()['Config']['Image'] == db.image:
+            storage.delete(db.volume_name)
+            return db
         db.remove()
     except NonExistentTemplate:
         pass  # this means this database is being imported for the first time
@@ -41,71 +144,154 @@ def remove_recreate_database(template):
     try:
         database = backend(client, template, True)
     except ImageNotFound as e:
-        import sys
-        print("\n### ERROR ###", file=sys.stderr)
-        print(e.explanation.decode(), file=sys.stderr)
-        print("Pull the image and try again.", file=sys.stderr)
-        sys.exit(1)
+        # templates are imported in worker threads, report it to main
+        raise MissingImage(f"{e.explanation.decode()}, pull the image and try again") from e
 
     return database
 
 
 def start_template_database(db_name):
-    print(f"- Creating database {db_name}")
-    db = remove_recreate_database(db_name)
+    report(db_name, "- Preparing database", level=0)
+    db = prepare_template_database(db_name)
 
-    print(indent("* Starting database..."))
+    report(db_name, "* Starting database...")
     db.start()
-    print(indent("* Started"))
-    print(indent("* Waiting for database to accept connections"))
+    report(db_name, "* Started")
+    report(db_name, "* Waiting for database to accept connections")
     try:
         db.wait_for_service_listening()
         return db
     except Exception as e:
-        print(indent(
-            f"* Max time waiting for database exceeded"
-            ", retrying..."
-        ))
+        report(db_name, "* Max time waiting for database exceeded, retrying...")
         db.stop()
-        db.restore_backup()
-        print_exception()
+        traceback.print_exc()
         raise e
 
 
-def main():
-    dumps = list_dump_files()
-    for dump in dumps:
-        db_name,_ = os.path.splitext(dump)
-        sql_file = os.path.join(settings.DUMP_DIR, dump)
+def import_template(dump, force=False):
+    """
+    Imports a dump file into its template database, returns the seconds
+    it took, or None when it was skipped. Raises ImportFailed when it could
+    not be imported (the errors are reported as they happen).
+
+    Dumps already imported by a previous run are skipped, unless `force`.
+    """
+    start = monotonic()
+    db_name = get_template_name(dump)
+    sql_file = os.path.join(settings.DUMP_DIR, dump)
+
+    if is_empty(sql_file):
+        report(db_name, f"- Skipping: {sql_file} is empty", level=0)
+        return None
 
-        if is_empty(sql_file):
-            print(f"- Skipping: {sql_file} is empty")
-            continue
+    entry = read_state(MANIFEST_STATE).get(db_name)
+    fingerprint = dump_fingerprint(sql_file, entry if entry and entry['dump'] == dump else None)
+    if not force and is_up_to_date(db_name, dump, fingerprint, entry):
+        report(db_name, f"- Skipping: {dump} did not change since the last import", level=0)
+        return None
 
-        start_db_func = functools.partial(start_template_database, db_name)
-        db = RetryPolicy(5, delay=2)(start_db_func)
-        if not db:
-            continue  # skip to next database to import
+    start_db_func = functools.partial(start_template_database, db_name)
+    db = RetryPolicy(5, delay=2)(start_db_func)
+    if not db:
+        raise ImportFailed("the template database did not start")
 
-        print(indent("* Importing data..."))
+    report(db_name, "* Importing data...")
+    imported = False
+    try:
+        import_start = monotonic()
+        size = db.import_data(sql_file)
+        import_time = monotonic() - import_start
+        throughput = size / max(import_time, 0.001)
+        report(db_name, f"* Imported {format_size(size)} in {import_time:.0f}s "
+                        f"({format_size(throughput)}/s)")
+        IMPORT_BYTES.labels(template=db_name).inc(size)
+        IMPORT_THROUGHPUT.labels(template=db_name).set(throughput)
+        write_textfile('update')
+        imported = True
+    except (ImportDataError, Exception) as e:
+        with configure_scope() as scope:
+            scope.set_extra("engine_status", db.get_engine_status())
+            scope.set_tag('database', db_name)
+            capture_message(e)
+        report(db_name, "* An error happened, debug information:", level=2)
+        print(db.get_engine_status(), file=sys.stderr)
+        report(db_name, "* Databases keep being cloned from the previous import", level=2)
+
+    if imported and settings.WARM_START:
+        report(db_name, "* Saving pages in memory for warm starts...")
         try:
-            db.import_data(sql_file)
-        except (ImportDataError, Exception) as e:
-            with configure_scope() as scope:
-                scope.set_extra("engine_status", db.get_engine_status())
-                scope.set_tag('database', db_name)
+            if not db.save_warm_start():
+                report(db_name, "* Not supported by this server, databases will start cold",
+                       level=2)
+        except WarmStartError as e:
+            # databases will start cold, but they are fine
+            report(db_name, f"* Could not save them: {e}", level=2)
+
+    report(db_name, "* Stopping database...")
+    db.stop()
+    report(db_name, "* Stopped")
+    if imported:
+        generation = publish_generation(db_name, db.volume_name)
+        report(db_name, f"* Published {generation}")
+        record_import(db_name, dump, fingerprint)
+    elif get_current_generation(db_name) is None:
+        # nothing to clone until an import succeeds, not even this half
+        # loaded datadir
+        get_storage_driver().delete(db.volume_name)
+    if not imported:
+        raise ImportFailed("the dump could not be imported")
+    return monotonic() - start
+
+
+@click.command()
+@click.option('--force', is_flag=True, default=False,
+              help="Import every dump, even the ones that did not change.")
+def main(force):
+    start = monotonic()
+    # the biggest dumps take longer, start them first so they do not end up
+    # running alone at the end
+    dumps = sorted(list_dump_files(),
+                   key=lambda d: os.path.getsize(os.path.join(settings.DUMP_DIR, d)),
+                   reverse=True)
+
+    workers = import_concurrency()
+    print(f"- Importing {len(dumps)} templates, {workers} at a time")
+    durations = []
+    skipped = 0
+    failed = 0
+    missing_image = False
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(import_template, dump, force): dump for dump in dumps}
+        for future in as_completed(futures):
+            try:
+                duration = future.result()
+                if duration is None:
+                    skipped += 1
+                else:
+                    durations.append(duration)
+            except MissingImage as e:
+                print(f"- Failed to import {futures[future]}: {e}", file=sys.stderr)
+                failed += 1
+                missing_image = True
+            except ImportFailed as e:
+                print(f"- Failed to import {futures[future]}: {e}", file=sys.stderr)
+                failed += 1
+            except Exception as e:
                 capture_message(e)
-            print(indent("* An error happened, debug information:", level=2))
-            print(db.get_engine_status(), file=sys.stderr)
-            print(indent("* Restoring previous database", level=2))
-            db.stop()
-            db.restore_backup()
-        finally:
-            db.remove_backup()
+                print(f"- Failed to import {futures[future]}", file=sys.stderr)
+                traceback.print_exc()
+                failed += 1
 
-        print(indent("* Stopping database..."))
-        db.stop()
-        print(indent("* Stopped"))
+    for volume in collect_generations():
+        print(f"- Deleted unused generation {volume}")
+
+    elapsed = monotonic() - start
+    serial = sum(durations)
+    print(f"- Finished in {elapsed:.0f}s, {serial:.0f}s importing one "
+          f"template at a time ({max(serial - elapsed, 0):.0f}s saved)")
+    print(f"- {len(durations)} templates imported, {skipped} skipped, {failed} failed")
+    if missing_image:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,78 @@
+from time import time
+
+from .. import settings
+from ..backends.exceptions import InsufficientMemory
+from .container import get_container_owner
+from .cpu import ACTIVE_STATES
+from .inventory import get_inventory
+from .memory import parse_size, format_size, read_meminfo
+from .state import locked_state
+
+ADMISSIONS_STATE = 'memory-admissions.json'
+# memory reserved by every container, in bytes
+MEMORY_LABEL = 'com.myaas.memory'
+
+# admissions of containers that never showed up are forgotten after this
+# many seconds, it covers processes dying between admitting and creating them
+ADMISSION_TIMEOUT = 300
+
+
+def get_container_memory(container):
+    labels = container['Labels'] or {}
+    if MEMORY_LABEL in labels:
+        return int(labels[MEMORY_LABEL])
+    return parse_size(settings.MEMORY_LIMIT)
+
+
+def get_reserved_memory(admissions):
+    """
+    Returns the memory reserved by active containers, and the one admitted
+    for containers not created yet. Forgets those admissions once their
+    container shows up.
+    """
+    reserved = 0
+    owners = set()
+    for container in get_inventory().containers():
+        owners.add(get_container_owner(container))
+        if container.get('State') in ACTIVE_STATES:
+            reserved += get_container_memory(container)
+
+    pending = 0
+    now = time()
+    for owner, admission in list(admissions.items()):
+        if owner in owners or now - admission['admitted_at'] > ADMISSION_TIMEOUT:
+            del admissions[owner]
+        else:
+            pending += admission['memory']
+    return reserved, pending
+
+
+def admit(owner, memory=None):
+    """
+    Reserves `memory` bytes (MEMORY_LIMIT by default) for a new container,
+    raises InsufficientMemory when the reservations of all the containers
+    would go over MEMORY_OVERCOMMIT times the host memory, or the host does
+    not have that much memory available.
+    """
+    memory = memory or parse_size(settings.MEMORY_LIMIT)
+    meminfo = read_meminfo()
+    budget = meminfo['MemTotal'] * settings.MEMORY_OVERCOMMIT
+
+    with locked_state(ADMISSIONS_STATE) as state:
+        admissions = state.setdefault('admissions', {})
+        reserved, pending = get_reserved_memory(admissions)
+        if reserved + pending + memory > budget:
+            raise InsufficientMemory(
+                f"{format_size(reserved + pending)} of {format_size(budget)} already reserved")
+        if meminfo['MemAvailable'] - pending < memory:
+            raise InsufficientMemory(
+                f"only {format_size(meminfo['MemAvailable'] - pending)} available")
+        admissions[owner] = {'memory': memory, 'admitted_at': time()}
+
+
+def release_admission(owner):
+    """
+    Forgets the admission of a container that could not be created
+    """
+    with locked_state(ADMISSIONS_STATE) as state:
+        state.setdefault('admissions', {}).pop(owner, None)
@@ -1,4 +1,7 @@
 import os
+import threading
+from collections import defaultdict
+
 import sh
 
 
@@ -43,6 +46,168 @@ def get_snapshots(path):
     return [parse_snapshot(x) for x in output.splitlines()]
 
 
+def parse_subvolume_show(output):
+    fields = {}
+    for line in output.splitlines()[1:]:
+        key, _, value = line.partition(':')
+        fields[key.strip()] = value.strip()
+
+    parent_uid = fields['Parent UUID'] if fields['Parent UUID'] != '-' else None
+    return {
+        'uid': fields['UUID'],
+        'parent_uid': parent_uid,
+        'otime': ' '.join(fields['Creation time'].split()[:2]),
+    }
+
+
+def get_subvolume_info(path):
+    result = sh.btrfs.subvolume.show(path)
+    output = result.stdout.decode('utf-8')
+
+    return parse_subvolume_show(output)
+
+
+class SubvolumeCatalog(object):
+    """
+    Index of the subvolumes in a filesystem by name, uid and parent uid.
+
+    The catalog is filled listing every subvolume once and then updated by
+    `FileSystem` and `Subvolume` whenever they create, snapshot or delete a
+    subvolume, so lookups do not need to call `btrfs subvolume list`.
+
+    Other processes may also change the filesystem, the mtime of the
+    mountpoint directory is used as a generation marker (it changes whenever
+    a subvolume is created or deleted under it) and the catalog is synced
+    again when it does not match the one seen on the last sync.
+    """
+    def __init__(self, mountpoint):
+        self.mountpoint = mountpoint
+        self._lock = threading.RLock()
+        self._generation = None
+        self._by_name = {}
+        self._by_uid = {}
+        self._by_parent_uid = defaultdict(set)
+        self._by_dir = defaultdict(set)
+
+    @property
+    def generation(self):
+        return os.stat(self.mountpoint).st_mtime_ns
+
+    def sync(self):
+        with self._lock:
+            generation = self.generation
+            otimes = {s['uid']: s['otime'] for s in get_snapshots(self.mountpoint)}
+            subvolumes = get_subvolumes(self.mountpoint)
+
+            self._by_name.clear()
+            self._by_uid.clear()
+            self._by_parent_uid.clear()
+            self._by_dir.clear()
+            for subvolume in subvolumes:
+                subvolume['otime'] = otimes.get(subvolume['uid'])
+                self._index(subvolume)
+            self._generation = generation
+
+    def check(self):
+        """
+        Syncs the catalog if another process changed the filesystem
+        """
+        with self._lock:
+            if self._generation != self.generation:
+                self.sync()
+
+    def all(self):
+        self.check()
+        return list(self._by_name.values())
+
+    def get_by_name(self, name):
+        self.check()
+        name = self._relative_name(name)
+        subvolume = self._by_name.get(name)
+        # the generation marker only covers the mountpoint directory, confirm
+        # the answer against the directory tree before trusting it
+        if bool(subvolume) != os.path.isdir(os.path.join(self.mountpoint, name)):
+            self.sync()
+            subvolume = self._by_name.get(name)
+        return subvolume
+
+    def get_by_uid(self, uid):
+        self.check()
+        return self._by_uid.get(uid)
+
+    def get_by_parent_uid(self, parent_uid):
+        self.check()
+        return [self._by_uid[uid] for uid in self._by_parent_uid.get(parent_uid, ())]
+
+    def get_descendants(self, name):
+        """
+        Returns the subvolumes nested inside `name`
+        """
+        self.check()
+        found = []
+        pending = [self._relative_name(name)]
+        while pending:
+            children = self._by_dir.get(pending.pop(), ())
+            found.extend(self._by_name[child] for child in children)
+            pending.extend(children)
+        return found
+
+    def add(self, name):
+        """
+        Adds a subvolume just created by this process to the catalog
+        """
+        with self._lock:
+            up_to_date = self._generation == self.generation
+            name = self._relative_name(name)
+            subvolume = get_subvolume_info(os.path.join(self.mountpoint, name))
+            subvolume['name'] = name
+            self._index(subvolume)
+            if up_to_date:
+                self._generation = self.generation
+            return subvolume
+
+    def remove(self, name):
+        """
+        Removes a subvolume just deleted by this process from the catalog
+        """
+        with self._lock:
+            up_to_date = self._generation == self.generation
+            name = self._relative_name(name)
+            subvolume = self._by_name.pop(name, None)
+            if subvolume:
+                del self._by_uid[subvolume['uid']]
+                self._by_parent_uid[subvolume['parent_uid']].discard(subvolume['uid'])
+                self._by_dir[os.path.dirname(name)].discard(name)
+            if up_to_date:
+                self._generation = self.generation
+
+    def _index(self, subvolume):
+        name = subvolume['name']
+        self._by_name[name] = subvolume
+        self._by_uid[subvolume['uid']] = subvolume
+        self._by_parent_uid[subvolume['parent_uid']].add(subvolume['uid'])
+        self._by_dir[os.path.dirname(name)].add(name)
+
+    def _relative_name(self, name):
+        if os.path.isabs(name):
+            return os.path.relpath(name, self.mountpoint)
+        return name
+
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+def get_catalog(mountpoint):
+    """
+    Returns the catalog for `mountpoint`, shared by the whole process.
+    """
+    with _catalogs_lock:
+        if mountpoint not in _catalogs:
+            _catalogs[mountpoint] = SubvolumeCatalog(mountpoint)
+        return _catalogs[mountpoint]
+
+
 class BtrfsError(Exception):
     pass
 
@@ -62,44 +227,39 @@ class TargetPathAlreadyExists(SubvolumeCreationFailed):
 class FileSystem(object):
     def __init__(self, mountpoint):
         self.mountpoint = mountpoint
+        self.catalog = get_catalog(mountpoint)
 
     @property
     def subvolumes(self):
-        return [
-            Subvolume(s['uid'], s['name'], s['parent_uid'], self)
-            for s in get_subvolumes(self.mountpoint)]
+        return [self._subvolume(s) for s in self.catalog.all()]
 
     @property
     def snapshots(self):
-        return [
-            Snapshot(s['otime'], s['uid'], s['name'], s['parent_uid'], self)
-            for s in get_snapshots(self.mountpoint)]
+        return [self._snapshot(s) for s in self.catalog.all() if s['parent_uid']]
+
+    def sync(self):
+        self.catalog.sync()
 
     def find_subvolume_by_name(self, name):
-        for subvolume in self.subvolumes:
-            if subvolume.name == name:
-                return subvolume
-        return None
+        subvolume = self.catalog.get_by_name(name)
+        return self._subvolume(subvolume) if subvolume else None
 
     def find_subvolume_by_prefix(self, prefix):
-        found = []
-        for subvolume in self.subvolumes:
-            if subvolume.name.startswith(prefix):
-                found.append(subvolume)
-
-        return found
+        return [self._subvolume(s) for s in self.catalog.all()
+                if s['name'].startswith(prefix)]
 
     def find_subvolume_by_uid(self, uid):
-        for subvolume in self.subvolumes:
-            if subvolume.uid == uid:
-                return subvolume
-        return None
+        subvolume = self.catalog.get_by_uid(uid)
+        return self._subvolume(subvolume) if subvolume else None
+
+    def find_subvolumes_by_parent_uid(self, parent_uid):
+        return [self._subvolume(s) for s in self.catalog.get_by_parent_uid(parent_uid)]
 
     def find_snapshot_by_name(self, name):
-        for snapshot in self.snapshots:
-            if snapshot.name == name:
-                return snapshot
-        return None
+        snapshot = self.catalog.get_by_name(name)
+        if not snapshot or not snapshot['parent_uid']:
+            return None
+        return self._snapshot(snapshot)
 
     def make_subvolume(self, name):
         path = os.path.join(self.mountpoint, name)
@@ -113,7 +273,7 @@ class FileSystem(object):
                 raise TargetPathAlreadyExists(stderr)
             raise BtrfsError(stderr)
 
-        return self.find_subvolume_by_name(name)
+        return self._subvolume(self.catalog.add(name))
 
     def delete_subvolume(self, name):
         path = os.path.join(self.mountpoint, name)
@@ -122,8 +282,16 @@ class FileSystem(object):
         except sh.ErrorReturnCode_1 as e:
             stderr = e.stderr.decode('utf-8')
             if 'No such file or directory' in stderr:
+                self.catalog.remove(name)
                 return
             raise BtrfsError(stderr)
+        self.catalog.remove(name)
+
+    def _subvolume(self, s):
+        return Subvolume(s['uid'], s['name'], s['parent_uid'], self)
+
+    def _snapshot(self, s):
+        return Snapshot(s['otime'], s['uid'], s['name'], s['parent_uid'], self)
 
 
 class Subvolume(object):
@@ -161,10 +329,11 @@ class Subvolume(object):
 
     @property
     def subvolumes(self):
-        return self.fs.find_subvolume_by_prefix(f"{self.name}/")
+        return [self.fs._subvolume(s) for s in self.fs.catalog.get_descendants(self.name)]
 
     def delete(self):
-        for vol in self.subvolumes:
+        # nested subvolumes have to be deleted first, deepest ones first
+        for vol in reversed(self.subvolumes):
             vol.delete()
 
         try:
@@ -172,11 +341,12 @@ class Subvolume(object):
         except sh.ErrorReturnCode_1 as e:
             stderr = e.stderr.decode('utf-8')
             raise BtrfsError(stderr)
+        self.fs.catalog.remove(self.name)
 
     def take_snapshot(self, name):
         path = os.path.join(self.fs.mountpoint, name)
         sh.btrfs.subvolume.snapshot(self.path, path)
-        return self.fs.find_snapshot_by_name(name)
+        return self.fs._snapshot(self.fs.catalog.add(name))
 
 
 class Snapshot(Subvolume):
@@ -1,57 +1,70 @@
-import docker
 from os import getenv
-from multiprocessing import cpu_count
-from random import sample as random_sample
-from collections import Counter
+from datetime import datetime, timezone
 
 from .. import settings
+from ..metrics import InstrumentedClient
+from .dockerclient import GuardedClient
 
-client = docker.Client(base_url=settings.DOCKER_HOST)
+client = InstrumentedClient(GuardedClient(settings.DOCKER_HOST))
 
 
-def find_container(name):
-    # prepend / to name
-    name = f'/{name}'
-    containers = client.containers(all=True)
-    containers = [c for c in containers if name in c['Names']]
-    if not containers:
-        return None
-    return containers[0]
+def get_container_name(container):
+    # containers linked to others are also listed with their aliases, like
+    # /other/alias, the main name is the one without a nested path
+    for name in container['Names']:
+        if name.count('/') == 1:
+            return name.lstrip('/')
+    return container['Names'][0].lstrip('/')
 
 
-def list_containers(all=True):
-    client = docker.Client()
-    return client.containers(all=all)
+def get_container_owner(container):
+    """
+    Name resources (ports, cores) are reserved by, the volume name does not
+    change when pool members are renamed.
+    """
+    labels = container['Labels'] or {}
+    return labels.get('com.myaas.volume') or get_container_name(container)
 
 
-def translate_host_basedir(path):
-    # TODO: if container is created with a custom hostname this will not work
-    # improve self id detection in the future.
-    self_id = getenv('HOSTNAME')
-    self_container = client.containers(filters={'id': self_id})[0]
-    mount_config = client.inspect_container(self_container)['Mounts']
-    for mount in mount_config:
-        if mount['Destination'] == settings.BASE_DIR:
-            break
+def parse_docker_time(value):
+    """
+    Converts a docker timestamp (RFC 3339 with nanoseconds) to an epoch
+    """
+    date, _, fraction = value.rstrip('Z').partition('.')
+    parsed = datetime.strptime(date, '%Y-%m-%dT%H:%M:%S').replace(tzinfo=timezone.utc)
+    return parsed.timestamp() + float('0.' + (fraction or '0'))
 
-    if mount['Destination'] != settings.BASE_DIR:
-        raise KeyError("Could not find %s mountpoint" % settings.BASE_DIR)
 
-    return path.replace(mount['Destination'], mount['Source'], 1)
+def list_containers(all=True):
+    return client.containers(all=all)
+
 
+_host_basedir = None
 
-def get_random_cpuset(cores_to_assign):
-    available_cores = cpu_count()
-    random_cores = random_sample(range(available_cores), cores_to_assign)
-    return ",".join(map(str, random_cores))
 
-def get_mapped_cpuset():
-    # fake a static variable
-    if 'cnt' not in get_mapped_cpuset.__dict__:
-        cpu_map = settings.CPU_MAP.split(':')
-        get_mapped_cpuset.cnt = Counter(cpu_map)
+def get_host_basedir():
+    """
+    Returns the host directory mounted as BASE_DIR in the myaas container,
+    HOST_BASE_DIR when set, otherwise it is looked up inspecting our own
+    container once per process.
+    """
+    global _host_basedir
+    if settings.HOST_BASE_DIR:
+        return settings.HOST_BASE_DIR
+    if _host_basedir is None:
+        # TODO: if container is created with a custom hostname this will not work
+        # improve self id detection in the future.
+        self_id = getenv('HOSTNAME')
+        self_container = client.containers(filters={'id': self_id})[0]
+        mount_config = client.inspect_container(self_container)['Mounts']
+        for mount in mount_config:
+            if mount['Destination'] == settings.BASE_DIR:
+                break
+        else:
+            raise KeyError("Could not find %s mountpoint" % settings.BASE_DIR)
+        _host_basedir = mount['Source']
+    return _host_basedir
 
-    least_used = get_mapped_cpuset.cnt.most_common()[-1][0]
-    get_mapped_cpuset.cnt[least_used] += 1
 
-    return least_used
+def translate_host_basedir(path):
+    return path.replace(settings.BASE_DIR, get_host_basedir(), 1)
@@ -0,0 +1,183 @@
+import re
+import glob
+from time import time
+from collections import Counter
+from multiprocessing import cpu_count
+
+from .. import settings
+from .container import client, get_container_owner
+from .inventory import get_inventory
+from .state import locked_state
+
+PLACEMENTS_STATE = 'cpu-placements.json'
+# cores pinned to every container
+CPUSET_LABEL = 'com.myaas.cpuset'
+
+# placements of containers that never showed up are forgotten after this
+# many seconds, it covers processes dying between placing and creating them
+PLACEMENT_TIMEOUT = 300
+
+# containers taking their cores, created ones are about to be started
+ACTIVE_STATES = ('created', 'running', 'restarting')
+
+# cpusets of containers created before they were labeled, by container id
+_inspected_cpusets = {}
+
+
+def parse_cpuset(value):
+    """
+    Converts a cpuset with docker syntax (eg: `0-3,8`) to a list of cores
+    """
+    cores = []
+    for item in value.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        first, _, last = item.partition('-')
+        cores.extend(range(int(first), int(last or first) + 1))
+    return cores
+
+
+def format_cpuset(cores):
+    return ",".join(map(str, sorted(cores)))
+
+
+def get_numa_nodes():
+    """
+    Returns the cores of every NUMA node, all of them as a single node when
+    the topology is not available.
+    """
+    paths = glob.glob('/sys/devices/system/node/node[0-9]*/cpulist')
+    paths.sort(key=lambda p: int(re.search(r'node(\d+)/cpulist$', p).group(1)))
+    nodes = []
+    for path in paths:
+        with open(path) as f:
+            cores = parse_cpuset(f.read())
+        if cores:
+            nodes.append(cores)
+    return nodes or [list(range(cpu_count()))]
+
+
+def read_cpu_times():
+    """
+    Returns the busy and total jiffies of every core from /proc/stat
+    """
+    times = {}
+    with open('/proc/stat') as f:
+        for line in f:
+            fields = line.split()
+            if not re.match(r'cpu\d+$', fields[0]):
+                continue
+            values = list(map(int, fields[1:]))
+            idle = values[3] + (values[4] if len(values) > 4 else 0)  # idle + iowait
+            times[int(fields[0][3:])] = [sum(values) - idle, sum(values)]
+    return times
+
+
+def get_container_cpuset(container):
+    labels = container['Labels'] or {}
+    if CPUSET_LABEL in labels:
+        return parse_cpuset(labels[CPUSET_LABEL])
+    if container['Id'] not in _inspected_cpusets:
+        host_config = client.inspect_container(container['Id'])['HostConfig']
+        _inspected_cpusets[container['Id']] = host_config.get('CpusetCpus') or ''
+    return parse_cpuset(_inspected_cpusets[container['Id']])
+
+
+def get_core_usage(placements):
+    """
+    Counts the active containers pinned to every core, including the ones
+    just placed and not created yet. Forgets those placements once their
+    container shows up.
+    """
+    usage = Counter()
+    owners = set()
+    for container in get_inventory().containers():
+        owners.add(get_container_owner(container))
+        if container.get('State') in ACTIVE_STATES:
+            usage.update(get_container_cpuset(container))
+
+    now = time()
+    for owner, placement in list(placements.items()):
+        if owner in owners or now - placement['placed_at'] > PLACEMENT_TIMEOUT:
+            del placements[owner]
+        else:
+            usage.update(parse_cpuset(placement['cpuset']))
+    return usage
+
+
+def get_recent_busy(state):
+    """
+    Returns the fraction of time every core was busy since the previous
+    placement, the sample is kept in `state` so every process agrees.
+    """
+    current = read_cpu_times()
+    previous = state.get('cpu_times', {})
+    state['cpu_times'] = current
+
+    busy = {}
+    for core, (busy_time, total) in current.items():
+        before = previous.get(str(core))
+        if before and total > before[1]:
+            busy[core] = (busy_time - before[0]) / (total - before[1])
+    return busy
+
+
+def pick_cores(loads, groups, size):
+    """
+    Picks the least loaded cores, all of them from the same group (NUMA
+    node) when possible. Ties are broken by core id, so the same loads
+    always give the same cpuset.
+    """
+    candidates = [g for g in groups if len(g) >= size] or [sorted(set().union(*groups))]
+    best = None
+    for group in candidates:
+        cores = sorted(group, key=lambda core: (loads.get(core, 0), core))[:size]
+        score = sum(loads.get(core, 0) for core in cores)
+        if best is None or score < best[0]:
+            best = (score, cores)
+    return best[1]
+
+
+def allocate_cpuset(owner):
+    """
+    Places a new container on the least loaded cores of the host, returns
+    its cpuset, or None when pinning is disabled.
+
+    Load is the number of active containers pinned to every core, plus
+    `CPU_LOAD_WEIGHT` times the fraction of time it was recently busy.
+    With `CPU_MAP` one of its groups is picked as a whole, otherwise
+    `CPU_PINNING_INSTANCE_CORES` cores from the same NUMA node.
+
+    Placements are done under a lock shared by every myaas process, so all
+    of them see the same loads.
+    """
+    if not settings.CPU_MAP and not settings.CPU_PINNING_INSTANCE_CORES:
+        return None
+
+    with locked_state(PLACEMENTS_STATE) as state:
+        placements = state.setdefault('placements', {})
+        loads = dict(get_core_usage(placements))
+        if settings.CPU_LOAD_WEIGHT:
+            for core, busy in get_recent_busy(state).items():
+                loads[core] = loads.get(core, 0) + settings.CPU_LOAD_WEIGHT * busy
+
+        if settings.CPU_MAP:
+            groups = [parse_cpuset(g) for g in settings.CPU_MAP.split(':')]
+            scores = [(sum(loads.get(core, 0) for core in g), i) for i, g in enumerate(groups)]
+            cores = groups[min(scores)[1]]
+        else:
+            cores = pick_cores(loads, get_numa_nodes(), settings.CPU_PINNING_INSTANCE_CORES)
+
+        cpuset = format_cpuset(cores)
+        placements[owner] = {'cpuset': cpuset, 'placed_at': time()}
+
+    return cpuset
+
+
+def release_cpuset(owner):
+    """
+    Forgets the placement of a container that could not be created
+    """
+    with locked_state(PLACEMENTS_STATE) as state:
+        state.setdefault('placements', {}).pop(owner, None)
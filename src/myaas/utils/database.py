@@ -1,8 +1,9 @@
 import logging
 import importlib
+from datetime import datetime, timedelta
 
 from .. import settings
-from .container import list_containers
+from .inventory import get_inventory
 
 logger = logging.getLogger(__name__)
 
@@ -11,27 +12,53 @@ def get_enabled_backend():
     return importlib.import_module(settings.BACKEND)
 
 
-def get_myaas_containers():
-    return filter(_is_database_container, list_containers())
+def make_container_name(template, name):
+    container_name = settings.CONTAINER_PREFIX + template
+    if name:
+        container_name += '-' + name
+    return container_name
+
+
+def expiry_labels(ttl):
+    if not ttl or ttl <= 0:
+        return {}
+    expire_at = datetime.now() + timedelta(seconds=ttl)
+    return {'com.myaas.expiresAt': str(expire_at.timestamp())}
+
+
+def get_myaas_containers(template=None, state=None):
+    """
+    Returns the database containers, optionally only those of `template` or
+    in `state` (running, exited...)
+    """
+    containers = filter(is_database_container, get_inventory().containers())
+    if template:
+        containers = (c for c in containers if c['Labels']['com.myaas.template'] == template)
+    if state:
+        containers = (c for c in containers if c.get('State') == state)
+    return containers
 
 
 def list_databases():
-    containers = filter(_is_database_container, list_containers())
+    containers = filter(is_database_container, get_inventory().containers())
     return [_get_database_name(c) for c in containers]
 
 
 def list_database_templates():
-    containers = filter(_is_template_container, list_containers())
+    containers = filter(_is_template_container, get_inventory().containers())
     return [_get_database_name(c) for c in containers]
 
 
-def _is_database_container(container):
+def is_database_container(container):
     if not container['Labels']:
         return False
 
     if 'com.myaas.instance' not in container['Labels']:
         return False
 
+    if container['Labels'].get('com.myaas.pool') == 'True':
+        return False  # not handed out yet
+
     return container['Labels'].get('com.myaas.instance') != ''
 
 
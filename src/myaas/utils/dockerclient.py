@@ -0,0 +1,181 @@
+import os
+import threading
+from time import monotonic
+
+import docker
+import requests
+from docker.unixconn import unixconn
+from urllib3.connectionpool import HTTPConnectionPool
+
+from .. import settings
+from ..backends.exceptions import DockerUnavailable
+from ..metrics import DOCKER_REJECTED
+
+
+class UnixConnectionPool(unixconn.UnixHTTPConnectionPool):
+    def __init__(self, base_url, socket_path, timeout, maxsize):
+        HTTPConnectionPool.__init__(self, 'localhost', timeout=timeout, maxsize=maxsize)
+        self.base_url = base_url
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+
+class UnixAdapter(unixconn.UnixAdapter):
+    """
+    docker-py keeps a single idle connection to the unix socket, every
+    concurrent call beyond the first opens and then drops its own. Keep up to
+    `maxsize` of them.
+    """
+    def __init__(self, socket_url, timeout, maxsize):
+        super().__init__(socket_url, timeout)
+        self.maxsize = maxsize
+
+    def get_connection(self, url, proxies=None):
+        with self.pools.lock:
+            pool = self.pools.get(url)
+            if not pool:
+                pool = UnixConnectionPool(url, self.socket_path, self.timeout, self.maxsize)
+                self.pools[url] = pool
+        return pool
+
+
+class Client(docker.Client):
+    """
+    docker client keeping a connection for every concurrent call, and taking
+    the timeout of every call from `call_timeout` (set for the calling
+    thread) instead of the one of the client.
+    """
+    def __init__(self, base_url, timeout, maxsize):
+        super().__init__(base_url=base_url, timeout=timeout)
+        self._local = threading.local()
+        if self.base_url == 'http+docker://localunixsocket':
+            self._custom_adapter = UnixAdapter(self._custom_adapter.socket_path, timeout, maxsize)
+            self.mount('http+docker://', self._custom_adapter)
+        elif self.base_url.startswith('http://'):
+            self.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=maxsize))
+
+    @property
+    def call_timeout(self):
+        return getattr(self._local, 'timeout', None) or self.timeout
+
+    @call_timeout.setter
+    def call_timeout(self, value):
+        self._local.timeout = value
+
+    def _set_request_timeout(self, kwargs):
+        kwargs.setdefault('timeout', self.call_timeout)
+        return kwargs
+
+
+class CircuitBreaker(object):
+    """
+    Fails calls right away for `reset_timeout` seconds once `threshold`
+    calls in a row failed, then lets a single call through to check if the
+    daemon is back.
+    """
+    def __init__(self, threshold, reset_timeout):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    @property
+    def is_open(self):
+        return self._opened_at is not None
+
+    def before_call(self):
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if self._probing or monotonic() - self._opened_at < self.reset_timeout:
+                raise DockerUnavailable("docker daemon not responding, failing fast")
+            self._probing = True
+
+    def succeeded(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def failed(self):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self._failures >= self.threshold:
+                self._opened_at = monotonic()
+
+
+class GuardedClient(object):
+    """
+    Proxy of the docker client shared by every thread of the process.
+
+    Calls are given the timeout configured for their method, at most
+    DOCKER_MAX_CONCURRENCY of them run at the same time, and once the daemon
+    stops answering (timeouts, connection errors) a circuit breaker fails
+    further calls with DockerUnavailable until it recovers, instead of
+    piling up requests waiting for it.
+    """
+    # helpers building parameters, no request is made
+    LOCAL_METHODS = ('create_host_config', 'create_networking_config',
+                     'create_endpoint_config')
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def _setup(self):
+        # forked processes can not share connections, nor locks
+        with self._lock:
+            if self._pid != os.getpid():
+                self._client = Client(self.base_url, settings.DOCKER_TIMEOUT,
+                                      settings.DOCKER_MAX_CONCURRENCY)
+                self._semaphore = threading.BoundedSemaphore(settings.DOCKER_MAX_CONCURRENCY)
+                self._breaker = CircuitBreaker(settings.DOCKER_FAILURE_THRESHOLD,
+                                               settings.DOCKER_CIRCUIT_RESET)
+                self._pid = os.getpid()
+
+    @property
+    def client(self):
+        if self._pid != os.getpid():
+            self._setup()
+        return self._client
+
+    def __getattr__(self, name):
+        client = self.client
+        attr = getattr(client, name)
+        if not callable(attr) or name.startswith('_') or name in self.LOCAL_METHODS:
+            return attr
+
+        timeout = settings.DOCKER_TIMEOUTS.get(name, settings.DOCKER_TIMEOUT)
+
+        def call(*args, **kwargs):
+            # take a slot first, a probe let through by the breaker has to
+            # reach the daemon or it would stay open for good
+            if not self._semaphore.acquire(timeout=settings.DOCKER_QUEUE_TIMEOUT):
+                DOCKER_REJECTED.labels(reason='busy').inc()
+                raise DockerUnavailable("too many concurrent calls to the docker daemon")
+            try:
+                self._breaker.before_call()
+            except DockerUnavailable:
+                self._semaphore.release()
+                DOCKER_REJECTED.labels(reason='circuit_open').inc()
+                raise
+            try:
+                client.call_timeout = timeout
+                result = attr(*args, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                self._breaker.failed()
+                raise DockerUnavailable(f"docker daemon not responding: {e}") from e
+            except Exception:
+                # the daemon answered, even if with an error
+                self._breaker.succeeded()
+                raise
+            finally:
+                client.call_timeout = None
+                self._semaphore.release()
+            self._breaker.succeeded()
+            return result
+        return call
@@ -0,0 +1,57 @@
+import gzip
+import lzma
+import subprocess
+
+# dump files the updater imports, the template is named after the file
+DUMP_EXTENSIONS = ('.sql', '.sql.gz', '.sql.xz', '.sql.zst')
+
+
+def is_dump_file(filename):
+    return filename.endswith(DUMP_EXTENSIONS)
+
+
+def get_template_name(filename):
+    for extension in DUMP_EXTENSIONS:
+        if filename.endswith(extension):
+            return filename[:-len(extension)]
+    return filename
+
+
+class ZstdReader(object):
+    """
+    Decompresses a zstd file through the zstd command line tool
+    """
+    def __init__(self, path):
+        self._proc = subprocess.Popen(['zstd', '-d', '-c', '-q', path],
+                                      stdout=subprocess.PIPE)
+
+    def read(self, size=-1):
+        return self._proc.stdout.read(size)
+
+    def __iter__(self):
+        return iter(self._proc.stdout)
+
+    def close(self):
+        self._proc.stdout.close()
+        if self._proc.wait() not in (0, -13):  # -13: we stopped reading early
+            raise IOError(f"zstd exited with status {self._proc.returncode}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def open_dump(path):
+    """
+    Opens a dump file for reading in binary mode, decompressing it on the fly
+    when it is compressed.
+    """
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    if path.endswith('.xz'):
+        return lzma.open(path, 'rb')
+    if path.endswith('.zst'):
+        return ZstdReader(path)
+    return open(path, 'rb')
@@ -0,0 +1,87 @@
+from time import time
+from datetime import datetime
+
+from ..storage import get_storage_driver
+from .inventory import get_inventory
+from .state import read_state, locked_state
+
+GENERATIONS_STATE = 'template-generations.json'
+# volume a database was cloned from
+SOURCE_LABEL = 'com.myaas.source'
+
+# retired generations are kept at least this many seconds, it covers clones
+# that read the previous generation right before the swap and whose
+# container is not in our inventory yet
+RETIRE_TIMEOUT = 300
+
+
+def generation_name(volume_name):
+    # docker does not allow @ in container names, so no database volume can
+    # be named like this
+    return f'{volume_name}@{datetime.now().strftime("%Y%m%d%H%M%S%f")}'
+
+
+def is_generation(volume_name):
+    return '@' in volume_name
+
+
+def get_current_generation(template):
+    """
+    Returns the volume databases of `template` are cloned from, None if it
+    was never published.
+    """
+    return read_state(GENERATIONS_STATE).get(template, {}).get('current')
+
+
+def publish_generation(template, source):
+    """
+    Snapshots the volume `source`, where `template` was just imported, as its
+    new generation and makes databases be cloned from it. The previous
+    generation is retired. Returns the name of the new one.
+    """
+    volume = generation_name(source)
+    # raises VolumeAlreadyExists instead of replacing a generation
+    get_storage_driver().snapshot(source, volume)
+
+    with locked_state(GENERATIONS_STATE) as state:
+        entry = state.setdefault(template, {'current': None, 'retired': {}})
+        if entry['current']:
+            entry['retired'][entry['current']] = time()
+        entry['retired'].pop(volume, None)
+        entry['current'] = volume
+    return volume
+
+
+def collect_generations():
+    """
+    Deletes the retired generations no database was cloned from, returns
+    their names.
+
+    Generation volumes not in the state (a process died while publishing
+    them) are retired when found.
+    """
+    storage = get_storage_driver()
+    referenced = {c['Labels'].get(SOURCE_LABEL) for c in get_inventory().containers()}
+    now = time()
+    deleted = []
+    with locked_state(GENERATIONS_STATE) as state:
+        known = set()
+        for entry in state.values():
+            known.add(entry['current'])
+            known.update(entry['retired'])
+
+        for volume in filter(is_generation, storage.list()):
+            if volume not in known:
+                template_volume = volume.partition('@')[0]
+                for entry in state.values():
+                    if entry['current'] and entry['current'].partition('@')[0] == template_volume:
+                        entry['retired'][volume] = now
+
+        for entry in state.values():
+            for volume, retired_at in list(entry['retired'].items()):
+                if volume in referenced or now - retired_at < RETIRE_TIMEOUT:
+                    continue
+                storage.delete(volume)
+                del entry['retired'][volume]
+                deleted.append(volume)
+    return deleted
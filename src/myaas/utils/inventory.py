@@ -0,0 +1,213 @@
+import os
+import logging
+import threading
+from time import time, sleep
+
+import docker
+
+from .. import settings
+from .container import client, get_container_name
+from .labels import get_label_overrides, apply_label_overrides
+
+logger = logging.getLogger(__name__)
+
+# every container created by myaas (templates and databases) carries it
+MYAAS_LABEL = 'com.myaas.template'
+
+# events that do not change anything we keep in the inventory
+IGNORED_EVENTS = ('exec_create', 'exec_start', 'exec_die', 'attach', 'top',
+                  'resize', 'export', 'commit', 'copy', 'archive-path',
+                  'extract-to-dir')
+
+
+class ContainerInventory(object):
+    """
+    In-memory index of the containers created by myaas, keyed by name.
+
+    It is filled with a single listing and kept current following the docker
+    events stream from a background thread, so lookups and listings do not
+    need to hit the docker daemon. Changes done by this process are written
+    through (see `refresh` and `discard`) so they are visible right away,
+    without waiting for their event to arrive. Label overrides (see
+    `utils.labels`) are merged into the stored containers.
+
+    A full resync is done every `INVENTORY_RESYNC_INTERVAL` seconds and
+    whenever the events stream is interrupted, in case we missed something.
+
+    Other components can `subscribe` to be told about every change, and
+    `generation` is increased on all of them, so results derived from the
+    inventory can be cached until it changes.
+    """
+    def __init__(self, client, events_client):
+        self.client = client
+        self.pid = os.getpid()
+        self._events_client = events_client
+        self._lock = threading.RLock()
+        self._containers = {}  # name -> container
+        self._names = {}  # container id -> name
+        # sequence number of the last change applied to every name, sync
+        # uses it to avoid overwriting changes newer than its listing
+        self._seq = 0
+        self._changes = {}
+        self._listeners = []
+        self.generation = 0
+
+    def start(self):
+        since = self.sync()
+        threading.Thread(target=self._watch, args=(since,),
+                         name='myaas-inventory-events', daemon=True).start()
+        threading.Thread(target=self._resync_periodically,
+                         name='myaas-inventory-resync', daemon=True).start()
+
+    def get(self, name):
+        return self._containers.get(name)
+
+    def subscribe(self, listener):
+        """
+        Registers `listener(name)`, called with the name of every container
+        added, changed or removed, and with all of them after a resync. It is
+        called holding the inventory lock, so it must return right away.
+        """
+        with self._lock:
+            self._listeners.append(listener)
+
+    def containers(self):
+        with self._lock:
+            return list(self._containers.values())
+
+    def sync(self):
+        """
+        Replaces the inventory contents with a fresh listing, returns the
+        timestamp events should be followed from.
+        """
+        since = int(time())
+        with self._lock:
+            seq = self._seq
+        containers = self.client.containers(all=True, filters={'label': MYAAS_LABEL})
+        overrides = get_label_overrides()
+
+        with self._lock:
+            fresh = {get_container_name(c): apply_label_overrides(c, overrides)
+                     for c in containers}
+            for name, changed_at in self._changes.items():
+                if changed_at <= seq:
+                    continue
+                # written after our listing was requested, trust it over it
+                if name in self._containers:
+                    fresh[name] = self._containers[name]
+                else:
+                    fresh.pop(name, None)
+            previous, self._containers = self._containers, fresh
+            if fresh != previous:
+                self.generation += 1
+            self._names = {c['Id']: name for name, c in fresh.items()}
+            self._changes = {}
+            for name in set(previous) | set(fresh):
+                self._notify(name)
+        return since
+
+    def refresh(self, container_id):
+        """
+        Reloads a single container from the docker daemon.
+        """
+        containers = self.client.containers(all=True, filters={'id': container_id})
+        containers = [c for c in containers if c['Id'].startswith(container_id)]
+        with self._lock:
+            self._forget(container_id)
+            if not containers:
+                return None
+            container = containers[0]
+            if MYAAS_LABEL not in (container['Labels'] or {}):
+                return None
+            container = apply_label_overrides(container, get_label_overrides())
+            name = get_container_name(container)
+            self._containers[name] = container
+            self._names[container['Id']] = name
+            self._touch(name)
+            return container
+
+    def discard(self, name):
+        with self._lock:
+            container = self._containers.pop(name, None)
+            if container:
+                self._names.pop(container['Id'], None)
+            self._touch(name)
+
+    def _forget(self, container_id):
+        for id_, name in list(self._names.items()):
+            if id_.startswith(container_id):
+                del self._names[id_]
+                self._containers.pop(name, None)
+                self._touch(name)
+
+    def _touch(self, name):
+        self.generation += 1
+        self._seq += 1
+        self._changes[name] = self._seq
+        self._notify(name)
+
+    def _notify(self, name):
+        for listener in self._listeners:
+            try:
+                listener(name)
+            except Exception:
+                logger.exception("container inventory listener failed")
+
+    def _apply(self, event):
+        status = event.get('status', '')
+        container_id = event.get('id')
+        if not container_id or status.startswith(IGNORED_EVENTS):
+            return
+
+        if status == 'destroy':
+            with self._lock:
+                self._forget(container_id)
+        else:
+            self.refresh(container_id)
+
+    def _watch(self, since):
+        filters = {'type': 'container', 'label': MYAAS_LABEL}
+        while True:
+            try:
+                for event in self._events_client.events(since=since, filters=filters, decode=True):
+                    self._apply(event)
+            except Exception:
+                logger.exception("docker events stream interrupted")
+            sleep(1)
+            try:
+                since = self.sync()
+            except Exception:
+                logger.exception("could not resync the container inventory")
+
+    def _resync_periodically(self):
+        while True:
+            sleep(settings.INVENTORY_RESYNC_INTERVAL)
+            try:
+                self.sync()
+            except Exception:
+                logger.exception("could not resync the container inventory")
+
+
+_inventory = None
+_inventory_lock = threading.Lock()
+
+
+def get_inventory():
+    """
+    Returns the inventory for the current process, it is created on first use
+    so every forked worker gets its own background threads.
+    """
+    global _inventory
+    with _inventory_lock:
+        if _inventory is None or _inventory.pid != os.getpid():
+            events_client = docker.Client(base_url=settings.DOCKER_HOST, timeout=None)
+            inventory = ContainerInventory(client, events_client)
+            # only kept once synced, a failed sync is retried on next use
+            # instead of leaving an empty inventory behind
+            inventory.start()
+            _inventory = inventory
+        return _inventory
+
+
+def find_container(name):
+    return get_inventory().get(name)
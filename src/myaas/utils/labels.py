@@ -0,0 +1,34 @@
+from .state import read_state, locked_state
+
+OVERRIDES_STATE = 'label-overrides.json'
+
+
+def get_label_overrides():
+    """
+    Returns the labels overridden for every container, by container id.
+
+    Docker does not allow changing the labels of a container once created,
+    so the ones myaas needs to change (eg: when handing out a database from
+    the pool) are kept here and merged by the container inventory.
+    """
+    return read_state(OVERRIDES_STATE)
+
+
+def set_label_overrides(container_id, labels):
+    with locked_state(OVERRIDES_STATE) as overrides:
+        overrides.setdefault(container_id, {}).update(labels)
+
+
+def clear_label_overrides(container_id):
+    with locked_state(OVERRIDES_STATE) as overrides:
+        overrides.pop(container_id, None)
+
+
+def apply_label_overrides(container, overrides):
+    labels = overrides.get(container['Id'])
+    if not labels:
+        return container
+
+    container = dict(container)
+    container['Labels'] = dict(container['Labels'] or {}, **labels)
+    return container
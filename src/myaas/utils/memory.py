@@ -0,0 +1,37 @@
+UNITS = {'b': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3, 't': 1024 ** 4}
+
+
+def parse_size(value):
+    """
+    Converts sizes with docker syntax (eg: `512m`, `2g`) to bytes
+    """
+    value = str(value).strip().lower()
+    if value and value[-1] in UNITS:
+        return int(float(value[:-1]) * UNITS[value[-1]])
+    return int(value)
+
+
+def format_size(value):
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if abs(value) < 1024:
+            return f"{value:.1f}{unit}"
+        value /= 1024
+    return f"{value:.1f}TiB"
+
+
+def read_meminfo():
+    """
+    Returns the fields of /proc/meminfo in bytes, the values are the ones of
+    the host even from inside a container.
+    """
+    meminfo = {}
+    with open('/proc/meminfo') as f:
+        for line in f:
+            key, value = line.split(':', 1)
+            value = value.split()
+            meminfo[key] = int(value[0]) * (1024 if value[1:] == ['kB'] else 1)
+    return meminfo
+
+
+def host_memory():
+    return read_meminfo()['MemTotal']
@@ -0,0 +1,240 @@
+import io
+import os
+import re
+import tempfile
+import threading
+
+# mysqldump marks every section of the dump with a comment
+TABLE_STRUCTURE = re.compile(rb'^-- Table structure for table `(.+)`')
+TEMPORARY_VIEW = re.compile(rb'^-- Temporary (?:table|view) structure for view `(.+)`')
+TABLE_DATA = re.compile(rb'^-- Dumping data for table `(.+)`')
+POST_SECTION = re.compile(rb'^-- (?:Final view structure for view|Dumping routines for database|Dumping events for database)')
+CURRENT_DATABASE = re.compile(rb'^-- Current Database: ')
+
+FOREIGN_KEY = re.compile(rb'^\s*CONSTRAINT `.+` FOREIGN KEY ')
+# triggers follow the data of their table, wrapped in versioned comments
+TRIGGER_START = (b'DELIMITER ', b'/*!50003 ')
+
+# statements before the first table should be small, if they are not this is
+# not a mysqldump file we know how to split
+MAX_HEADER_SIZE = 1024 * 1024
+
+
+class UnsupportedDump(Exception):
+    pass
+
+
+class ChainReader(object):
+    """
+    File like object reading several ones, one after the other
+    """
+    def __init__(self, *sources):
+        self._sources = list(sources)
+
+    def read(self, size=-1):
+        while self._sources:
+            chunk = self._sources[0].read(size)
+            if chunk:
+                return chunk
+            self._sources.pop(0).close()
+        return b''
+
+    def close(self):
+        for source in self._sources:
+            source.close()
+
+
+class RangeReader(object):
+    """
+    Reads `length` bytes of a file starting at `start`
+    """
+    def __init__(self, path, start, length):
+        self._file = open(path, 'rb')
+        self._file.seek(start)
+        self._remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self._remaining:
+            size = self._remaining
+        chunk = self._file.read(size)
+        self._remaining -= len(chunk)
+        return chunk
+
+    def close(self):
+        self._file.close()
+
+
+class TableSection(object):
+    """
+    Statements needed to create a table and load its data, foreign keys are
+    left out, see `MysqlDumpSplitter.constraints`.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.ddl = b''
+        self.data_size = 0
+        self._data_range = None
+        self._spool_path = None
+        self._on_release = None
+
+    def open(self):
+        data = io.BytesIO()
+        if self._data_range:
+            data = RangeReader(*self._data_range)
+        elif self._spool_path:
+            data = open(self._spool_path, 'rb')
+        return ChainReader(io.BytesIO(self.ddl), data)
+
+    def release(self):
+        """
+        Frees the spooled data once it has been loaded
+        """
+        if self._spool_path:
+            os.unlink(self._spool_path)
+            self._spool_path = None
+        if self._on_release:
+            self._on_release(self)
+            self._on_release = None
+
+
+class MysqlDumpSplitter(object):
+    """
+    Splits a mysqldump stream at table boundaries, so tables can be loaded
+    over several connections at the same time.
+
+    `tables` yields every table as soon as it has been read. Their data is
+    read later from `path` when the dump is a plain file, or from a spool
+    file in `spool_dir` when it is a stream (eg: compressed). Spooling stops
+    while more than `max_spool` bytes are waiting to be loaded.
+
+    `header` (the session setup) has to run before every table, and
+    `constraints` plus `post` (triggers, views, routines) once all of them
+    have been loaded.
+    """
+    def __init__(self, source, path=None, spool_dir=None, max_spool=None):
+        self.source = source
+        self.path = path
+        self.spool_dir = spool_dir
+        self.max_spool = max_spool
+        self.header = b''
+        self.post = b''
+        self.constraints = []
+        self.size = 0
+        self._spooled = 0
+        self._spool_lock = threading.Condition()
+
+    def tables(self):
+        header = []
+        post = []
+        table = None
+        state = 'header'
+        spool = None
+        offset = 0
+
+        for line in self.source:
+            line_offset = offset
+            offset += len(line)
+
+            if line.startswith(b'-- '):
+                if CURRENT_DATABASE.match(line):
+                    raise UnsupportedDump("dumps with more than one database are not supported")
+
+                structure = TABLE_STRUCTURE.match(line) or TEMPORARY_VIEW.match(line)
+                data = TABLE_DATA.match(line)
+                if structure or POST_SECTION.match(line) or (data and not table):
+                    if table:
+                        self._finish(table, spool, line_offset)
+                        spool = None
+                        yield table
+                    table = None
+                    state = 'post'
+                if structure:
+                    table = TableSection(structure.group(1).decode('utf-8'))
+                    state = 'ddl'
+                elif data and table:
+                    state = 'data'
+                    table._data_start = line_offset
+                    spool = self._open_spool(table)
+
+            if state == 'header':
+                header.append(line)
+                if offset > MAX_HEADER_SIZE:
+                    raise UnsupportedDump("could not find the first table")
+            elif state == 'ddl':
+                table.ddl += line
+            elif state == 'data':
+                if line.startswith(TRIGGER_START):
+                    state = 'post'
+                    post.append(line)
+                    table._data_end = line_offset
+                elif spool:
+                    spool.write(line)
+            else:
+                post.append(line)
+
+            if not self.header and state != 'header':
+                self.header = b''.join(header)
+
+        if table:
+            self._finish(table, spool, offset)
+            yield table
+
+        if not self.header:
+            self.header = b''.join(header)
+        self.post = b''.join(post)
+        self.size = offset
+
+    def _open_spool(self, table):
+        if self.path:
+            return None
+
+        with self._spool_lock:
+            # wait for the loaders to catch up
+            while self.max_spool and self._spooled > self.max_spool:
+                self._spool_lock.wait()
+
+        fd, table._spool_path = tempfile.mkstemp(dir=self.spool_dir, suffix='.sql')
+        return os.fdopen(fd, 'wb')
+
+    def _finish(self, table, spool, offset):
+        table.ddl, constraints = strip_foreign_keys(table.ddl, table.name)
+        self.constraints.extend(constraints)
+
+        start = getattr(table, '_data_start', None)
+        if start is None:
+            return  # view placeholder, or table dumped without data
+
+        end = getattr(table, '_data_end', offset)
+        table.data_size = end - start
+        if spool:
+            spool.close()
+            with self._spool_lock:
+                self._spooled += table.data_size
+            table._on_release = self._release
+        else:
+            table._data_range = (self.path, start, table.data_size)
+
+    def _release(self, table):
+        with self._spool_lock:
+            self._spooled -= table.data_size
+            self._spool_lock.notify_all()
+
+
+def strip_foreign_keys(ddl, table):
+    """
+    Removes the foreign keys from the CREATE TABLE statements in `ddl`,
+    returns the new ddl and the statements adding them back.
+    """
+    lines = ddl.splitlines(keepends=True)
+    kept = []
+    constraints = []
+    for line in lines:
+        if FOREIGN_KEY.match(line):
+            constraint = line.strip().rstrip(b',').decode('utf-8')
+            constraints.append(f"ALTER TABLE `{table}` ADD {constraint};\n".encode('utf-8'))
+            continue
+        if line.startswith(b') ') and constraints and kept:
+            # the constraints were the last definitions, fix the comma
+            kept[-1] = kept[-1].rstrip().rstrip(b',') + b'\n'
+        kept.append(line)
+    return b''.join(kept), constraints
@@ -0,0 +1,96 @@
+from time import time
+
+from .. import settings
+from .container import get_container_owner
+from .inventory import get_inventory
+from .socket import is_port_free
+from .state import locked_state
+
+PORTS_STATE = 'ports.json'
+# host ports bound by every container, listings only include the ports of
+# running containers
+PORTS_LABEL = 'com.myaas.ports'
+
+# leases of containers that never showed up are reclaimed after this many
+# seconds, it covers processes dying between allocating and creating them
+LEASE_TIMEOUT = 300
+
+
+class PortsExhausted(Exception):
+    pass
+
+
+def parse_port_range(value):
+    first, _, last = value.partition('-')
+    return int(first), int(last or first)
+
+
+def get_container_ports(container):
+    labels = container['Labels'] or {}
+    if PORTS_LABEL in labels:
+        return [int(p) for p in labels[PORTS_LABEL].split(',') if p]
+    return [p['PublicPort'] for p in container.get('Ports') or [] if p.get('PublicPort')]
+
+
+def allocate_ports(owner, count):
+    """
+    Leases `count` free host ports from `PORT_RANGE` to `owner`.
+
+    Leases are shared by every myaas process through a locked state file.
+    Ports are handed out round robin, so recently released ones are not
+    reused right away.
+    """
+    if not count:
+        return []
+
+    first, last = parse_port_range(settings.PORT_RANGE)
+    with locked_state(PORTS_STATE) as state:
+        leases = state.setdefault('leases', {})
+        reconcile_leases(leases)
+
+        cursor = state.get('cursor', first)
+        if not first <= cursor <= last:
+            cursor = first
+        candidates = list(range(cursor, last + 1)) + list(range(first, cursor))
+
+        ports = []
+        for port in candidates:
+            if str(port) in leases or not is_port_free(port):
+                continue
+            leases[str(port)] = {'owner': owner, 'leased_at': time()}
+            ports.append(port)
+            if len(ports) == count:
+                break
+        else:
+            raise PortsExhausted(f"no free ports left in {settings.PORT_RANGE}")
+
+        state['cursor'] = ports[-1] + 1
+
+    return ports
+
+
+def release_ports(owner):
+    with locked_state(PORTS_STATE) as state:
+        leases = state.setdefault('leases', {})
+        for port, lease in list(leases.items()):
+            if lease['owner'] == owner:
+                del leases[port]
+
+
+def reconcile_leases(leases):
+    """
+    Updates `leases` with the ports used by existing containers, so state
+    lost or left behind is rebuilt, and drops the leases of containers gone
+    for good.
+    """
+    now = time()
+    owners = set()
+    for container in get_inventory().containers():
+        owner = get_container_owner(container)
+        owners.add(owner)
+        for port in get_container_ports(container):
+            leases.setdefault(str(port), {'owner': owner, 'leased_at': now})
+
+    for port, lease in list(leases.items()):
+        if lease['owner'] not in owners and now - lease['leased_at'] > LEASE_TIMEOUT:
+            del leases[port]
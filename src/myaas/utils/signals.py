@@ -0,0 +1,19 @@
+import signal
+
+
+class SignalHandler:
+    def __init__(self, on_exit=None):
+        # called when a signal arrives, to wake up a sleeping main loop
+        self.__on_exit = on_exit
+        self.__killed = False
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+    @property
+    def exit(self):
+        return self.__killed
+
+    def stop(self, signum, frame):
+        self.__killed = True
+        if self.__on_exit:
+            self.__on_exit()
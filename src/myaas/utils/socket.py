@@ -1,22 +1,23 @@
 import socket
 
 
-def reserve_port():
+def is_port_free(port):
     """
-    This function finds a free port number for new containers to be created,
-    it releases the port just before returning the port number, so there is
-    a chance for another process to get it, let's see if it works.
+    Checks if nobody is listening on `port`.
 
     This requires the myaas container to be running with --net=host otherwise
-    the port returned by this method will be a free port inside the container,
-    but may not be free on the host machine.
+    the port will be checked inside the container, but may not be free on the
+    host machine.
     """
     s = socket.socket()
-    s.bind(("", 0))
-    (ip, port) = s.getsockname()
-    s.close()
+    try:
+        s.bind(("", port))
+    except OSError:
+        return False
+    finally:
+        s.close()
 
-    return port
+    return True
 
 
 def test_tcp_connection(ip, port):
@@ -0,0 +1,58 @@
+import os
+import json
+import fcntl
+from contextlib import contextmanager
+
+from .. import settings
+
+
+def state_path(name):
+    return os.path.join(settings.STATE_DIR, name)
+
+
+def read_state(name, default=None):
+    """
+    Reads a JSON document shared by every myaas process, writes are atomic so
+    no lock is needed just to read it.
+    """
+    try:
+        with open(state_path(name)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {} if default is None else default
+
+
+def write_state(name, data):
+    path = state_path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(data, f)
+    os.rename(path + '.tmp', path)
+
+
+@contextmanager
+def state_lock(name):
+    """
+    Exclusive lock shared by every myaas process, including the ones running
+    in other containers with the same base directory.
+    """
+    path = state_path(name) + '.lock'
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+@contextmanager
+def locked_state(name, default=None):
+    """
+    Yields a shared JSON document holding its lock, the changes made to it
+    are saved on exit.
+    """
+    with state_lock(name):
+        data = read_state(name, default)
+        yield data
+        write_state(name, data)